@@ -21,6 +21,18 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-string')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    app.config['CATALOG_ENGINE'] = os.environ.get('CATALOG_ENGINE', 'sql')  # sql or columnar
+    app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+    app.config['INTENT_MODEL_PATH'] = os.environ.get('INTENT_MODEL_PATH', os.path.join(app.instance_path, 'intent_model.npz'))
+    app.config['INTENT_CONFIDENCE'] = float(os.environ.get('INTENT_CONFIDENCE', '0.6'))
+    app.config['CHAT_CACHE_SIZE'] = int(os.environ.get('CHAT_CACHE_SIZE', '1024'))  # 0 disables it
+    app.config['CHAT_CACHE_TTL'] = float(os.environ.get('CHAT_CACHE_TTL', '300'))  # seconds
+    app.config['CHAT_CONTEXT_SIZE'] = int(os.environ.get('CHAT_CONTEXT_SIZE', '10000'))  # sessions, 0 disables follow-ups
+    app.config['CHAT_CONTEXT_TTL'] = float(os.environ.get('CHAT_CONTEXT_TTL', '1800'))  # seconds
+    app.config['CHAT_WRITE_BEHIND'] = os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() == 'true'
+    app.config['CHAT_WRITE_QUEUE_SIZE'] = int(os.environ.get('CHAT_WRITE_QUEUE_SIZE', '10000'))
+    app.config['CHAT_WRITE_BATCH_SIZE'] = int(os.environ.get('CHAT_WRITE_BATCH_SIZE', '500'))
+    app.config['CATALOG_VERSION_POLL'] = float(os.environ.get('CATALOG_VERSION_POLL', '1'))  # seconds
     
     # Initialize extensions
     db.init_app(app)
@@ -28,12 +40,32 @@ def create_app():
     jwt.init_app(app)
     CORS(app)
     
+    # Track catalog changes so in-memory read structures can refresh
+    from utils.catalog_version import init_catalog_version
+    from utils.catalog_engine import init_catalog_engine
+    from utils.search_index import init_search_index
+    from utils.response_cache import init_response_cache
+    from utils.autocomplete import init_autocomplete
+    from utils.attribute_index import init_attribute_index
+    from utils.metrics import init_metrics
+    from utils.chatbot_logic import init_chatbot
+    from utils.chat_writer import init_chat_writer
+    init_catalog_version(app)
+    init_catalog_engine(app)
+    init_search_index(app)
+    init_response_cache(app)
+    init_autocomplete(app)
+    init_attribute_index(app)
+    init_metrics(app)
+    init_chatbot(app)
+    init_chat_writer(app)
+    
     # Configure login manager
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please login to access this page.'
     
     # Import models (import after db initialization)
-    from models import User, Product, ChatMessage, Category
+    from models import User, Product, ChatMessage, Category, ProductSimilarity
     
     # Register blueprints
     from routes.auth import auth_bp
@@ -53,6 +85,10 @@ def create_app():
     with app.app_context():
         db.create_all()
         
+        # Add indexes declared since the database was created
+        from utils.migrations import upgrade
+        upgrade()
+        
         # Check if database is empty and populate with sample data
         if Product.query.count() == 0:
             from utils.database import populate_database
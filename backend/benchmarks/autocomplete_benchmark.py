@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark autocomplete lookups, the index build and incremental updates
+
+Usage:
+    python benchmarks/autocomplete_benchmark.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from seed import create_bench_app, seed_products
+
+PREFIXES = ['s', 'sa', 'sam', 'samsung p', 'a', 'lego', 'd', 'dyson vac', 'x', 'b', 'boo', 'head']
+
+
+def run(size, repeat):
+    app = create_bench_app()
+    with app.app_context():
+        from models import db, Product
+        from utils.autocomplete import get_autocomplete
+        seed_products(size)
+        index = get_autocomplete()
+        
+        print(f'\n📦 {size:,} products')
+        start = time.perf_counter()
+        index.refresh()
+        print(f'   build: {(time.perf_counter() - start) * 1000:.0f} ms, {len(index):,} keys')
+        
+        print(f'   {"prefix":<16} {"p50":>10} {"max":>10}')
+        for prefix in PREFIXES:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                index.complete(prefix)
+                timings.append((time.perf_counter() - start) * 1e6)
+            print(f'   {prefix:<16} {statistics.median(timings):>8.1f}us {max(timings):>8.1f}us')
+        
+        rng = random.Random(7)
+        for product in Product.query.filter(Product.id.in_(rng.sample(range(1, size + 1), 100))).all():
+            product.rating = round(rng.uniform(1, 5), 1)
+            product.name = f'{rng.choice(["Samsung", "Sony"])} {product.name}'
+        db.session.commit()
+        start = time.perf_counter()
+        index.refresh()
+        print(f'   incremental update of 100 products: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+    
+    for size in args.sizes:
+        run(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark product listings and facets on the SQL path against the columnar catalog engine
+
+Usage:
+    python benchmarks/catalog_engine_benchmark.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import statistics
+import time
+
+from seed import create_bench_app, seed_products
+
+QUERIES = [
+    '/api/products/?page=1',
+    '/api/products/?page=50&sort_by=price',
+    '/api/products/?category_id=1&sort_by=rating&sort_order=desc',
+    '/api/products/?min_price=100&max_price=500&sort_by=price',
+    '/api/products/?brand=son&sort_by=created_at&sort_order=desc',
+    '/api/products/?category_id=3&min_price=50&brand=a&page=5',
+    '/api/products/facets',
+    '/api/products/facets?category_id=1&min_price=100',
+]
+
+
+def time_requests(app, query, repeat):
+    """Return per-request latencies in milliseconds, bypassing the response cache"""
+    client = app.test_client()
+    timings = []
+    for _ in range(repeat):
+        app.extensions['response_cache'].clear()
+        start = time.perf_counter()
+        response = client.get(query)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_json()
+    return timings
+
+
+def run(size, repeat):
+    sql_app = create_bench_app(CATALOG_ENGINE='sql')
+    with sql_app.app_context():
+        seed_products(size)
+    db_path = sql_app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    columnar_app = create_bench_app(db_path, CATALOG_ENGINE='columnar')
+    
+    print(f'\n📦 {size:,} products')
+    with columnar_app.app_context():
+        from utils.catalog_engine import get_catalog_engine
+        start = time.perf_counter()
+        get_catalog_engine().snapshot()
+        print(f'   columnar build: {(time.perf_counter() - start) * 1000:.0f} ms')
+    
+    print(f'   {"query":<64} {"sql p50":>10} {"columnar p50":>14} {"speedup":>9}')
+    for query in QUERIES:
+        sql_ms = statistics.median(time_requests(sql_app, query, repeat))
+        columnar_ms = statistics.median(time_requests(columnar_app, query, repeat))
+        print(f'   {query:<64} {sql_ms:>8.2f}ms {columnar_ms:>12.2f}ms {sql_ms / columnar_ms:>8.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    for size in args.sizes:
+        run(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Replay chat traffic through the chatbot against a seeded catalog and report
+throughput, p50/p95/p99 latency per intent and per processing stage, and SQL
+statement counts. Messages run in-process through ChatbotProcessor and over
+HTTP through the Flask test client, which adds routing, auth and saving the
+ChatMessage. Write the result with --output and diff it between releases.
+
+The corpus is a text file with one message per line, NDJSON lines of
+{"message": ..., "session_id": ...}, the chat history of a database
+(--from-history), or generated messages by default.
+
+Usage:
+    python benchmarks/chat_replay_benchmark.py --products 10000 --messages 2000 --output replay.json
+    python benchmarks/chat_replay_benchmark.py --from-history sqlite:///instance/ecommerce_chatbot.db --no-cache
+"""
+
+import argparse
+import json
+import platform
+import re
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from seed import create_bench_app, seed_products, sample_messages
+
+SERVER_TIMING_ENTRY = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) queries")?')
+
+
+def read_corpus(path):
+    """``(message, session_id)`` pairs from a text or NDJSON file"""
+    corpus = []
+    with open(path, encoding='utf-8') as stream:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                row = json.loads(line)
+                corpus.append((row['message'], row.get('session_id')))
+            else:
+                corpus.append((line, None))
+    return corpus
+
+
+def history_corpus(database_url, limit):
+    """``(message, session_id)`` pairs of the stored chat history, oldest first"""
+    from sqlalchemy import create_engine, select
+    from models import ChatMessage
+    
+    table = ChatMessage.__table__
+    query = select(table.c.message, table.c.session_id).order_by(table.c.timestamp, table.c.id)
+    if limit:
+        query = query.limit(limit)
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        corpus = [(message, session_id) for message, session_id in connection.execute(query)]
+    engine.dispose()
+    return corpus
+
+
+def percentiles(values):
+    """p50, p95 and p99 of a list of milliseconds"""
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    if len(values) == 1:
+        return {'p50': values[0], 'p95': values[0], 'p99': values[0]}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': round(statistics.median(values), 3), 'p95': round(cuts[94], 3), 'p99': round(cuts[98], 3)}
+
+
+def summarize(samples, elapsed):
+    """Aggregate ``(intent, total_ms, {stage: ms}, queries)`` samples"""
+    by_intent = defaultdict(list)
+    by_stage = defaultdict(list)
+    queries = []
+    for intent, total_ms, stages, query_count in samples:
+        by_intent[intent].append((total_ms, query_count))
+        for stage, ms in stages.items():
+            by_stage[stage].append(ms)
+        queries.append(query_count)
+    
+    return {
+        'messages': len(samples),
+        'seconds': round(elapsed, 3),
+        'throughput_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+        'latency_ms': percentiles([total_ms for _, total_ms, _, _ in samples]),
+        'by_intent': {
+            intent: dict(
+                count=len(rows),
+                sql_mean=round(sum(count for _, count in rows) / len(rows), 2),
+                **percentiles([total_ms for total_ms, _ in rows])
+            )
+            for intent, rows in sorted(by_intent.items())
+        },
+        'stages_ms': {stage: percentiles(values) for stage, values in sorted(by_stage.items())},
+        'sql': {
+            'total': sum(queries),
+            'per_message_mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'per_message_max': max(queries, default=None)
+        }
+    }
+
+
+def reset(app):
+    """Forget cached results and session contexts so every mode starts alike"""
+    processor = app.extensions['chatbot']
+    processor.results.clear()
+    processor.contexts.clear()
+
+
+def replay_in_process(app, corpus, user_id):
+    """Run every message through ChatbotProcessor.process_message"""
+    from flask import g
+    processor = app.extensions['chatbot']
+    samples = []
+    started = time.perf_counter()
+    for message, session_id in corpus:
+        # A request context, so the metrics hooks attribute SQL and stages to the message
+        with app.test_request_context():
+            app.preprocess_request()
+            start = time.perf_counter()
+            result = processor.process_message(message, user_id, session_id)
+            total_ms = (time.perf_counter() - start) * 1000
+            stages = defaultdict(float)
+            for stage, seconds in g.metrics_stages:
+                stages[stage] += seconds * 1000
+            samples.append((result['intent'], total_ms, dict(stages), g.metrics_queries))
+    return samples, time.perf_counter() - started
+
+
+def replay_test_client(app, corpus, headers):
+    """POST every message to /api/chatbot/message, reading stages and SQL from Server-Timing"""
+    client = app.test_client()
+    samples = []
+    started = time.perf_counter()
+    for message, session_id in corpus:
+        body = {'message': message}
+        if session_id:
+            body['session_id'] = session_id
+        start = time.perf_counter()
+        response = client.post('/api/chatbot/message', json=body, headers=headers)
+        total_ms = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f'{message!r}: {response.status_code} {response.get_json()}')
+        
+        stages = defaultdict(float)
+        query_count = 0
+        for name, duration, queries in SERVER_TIMING_ENTRY.findall(response.headers.get('Server-Timing', '')):
+            if name == 'db':
+                query_count = int(queries or 0)
+            elif name != 'app':
+                stages[name] += float(duration)
+        samples.append((response.get_json()['intent'], total_ms, dict(stages), query_count))
+    return samples, time.perf_counter() - started
+
+
+def print_summary(name, summary):
+    print(f'\n🔁 {name}: {summary["messages"]:,} messages in {summary["seconds"]:.1f}s, '
+          f'{summary["throughput_per_second"]:,.0f} msgs/s, '
+          f'{summary["sql"]["per_message_mean"]} SQL statements per message')
+    print(f'   {"":<18} {"count":>7} {"p50":>9} {"p95":>9} {"p99":>9} {"sql":>6}')
+    latency = summary['latency_ms']
+    print(f'   {"all":<18} {summary["messages"]:>7} {latency["p50"]:>7.2f}ms {latency["p95"]:>7.2f}ms '
+          f'{latency["p99"]:>7.2f}ms {summary["sql"]["per_message_mean"]:>6}')
+    for intent, row in summary['by_intent'].items():
+        print(f'   {intent:<18} {row["count"]:>7} {row["p50"]:>7.2f}ms {row["p95"]:>7.2f}ms '
+              f'{row["p99"]:>7.2f}ms {row["sql_mean"]:>6}')
+    for stage, row in summary['stages_ms'].items():
+        print(f'   stage {stage:<12} {"":>7} {row["p50"]:>7.2f}ms {row["p95"]:>7.2f}ms {row["p99"]:>7.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--corpus', help='text file with one message per line, or NDJSON')
+    source.add_argument('--from-history', metavar='DATABASE_URL', help='replay the chat_messages of this database')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='number of generated messages, or the most to read from history')
+    parser.add_argument('--save-corpus', help='write the replayed corpus as NDJSON')
+    parser.add_argument('--products', type=int, default=10000, help='synthetic products added to the sample catalog')
+    parser.add_argument('--mode', choices=['in-process', 'client', 'both'], default='both')
+    parser.add_argument('--warmup', type=int, default=50, help='messages run before measuring each mode')
+    parser.add_argument('--no-cache', action='store_true', help='turn the chatbot result cache off')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+    
+    if args.corpus:
+        corpus = read_corpus(args.corpus)
+        source_name = args.corpus
+    elif args.from_history:
+        corpus = history_corpus(args.from_history, args.messages)
+        source_name = 'history'
+    else:
+        corpus = [(message, None) for message in sample_messages(args.messages)]
+        source_name = 'generated'
+    if not corpus:
+        parser.exit(1, 'The corpus is empty\n')
+    if args.save_corpus:
+        with open(args.save_corpus, 'w', encoding='utf-8') as stream:
+            for message, session_id in corpus:
+                stream.write(json.dumps({'message': message, 'session_id': session_id}) + '\n')
+    
+    config = {'SERVER_TIMING': 'true', 'CATALOG_ENGINE': 'sql'}
+    if args.no_cache:
+        config['CHAT_CACHE_SIZE'] = '0'
+    app = create_bench_app(**config)
+    with app.app_context():
+        from flask_jwt_extended import create_access_token
+        from models import User, Product
+        if args.products:
+            seed_products(args.products)
+        user_id = User.query.filter_by(username='demo_user').first().id
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+        catalog_size = Product.query.count()
+    print(f'📦 {catalog_size:,} products, {len(corpus):,} messages ({source_name})')
+    
+    warmup = corpus[:args.warmup]
+    modes = {}
+    if args.mode in ('in-process', 'both'):
+        replay_in_process(app, warmup, user_id)
+        reset(app)
+        samples, elapsed = replay_in_process(app, corpus, user_id)
+        modes['in_process'] = summarize(samples, elapsed)
+        print_summary('in-process', modes['in_process'])
+    if args.mode in ('client', 'both'):
+        replay_test_client(app, warmup, headers)
+        reset(app)
+        samples, elapsed = replay_test_client(app, corpus, headers)
+        modes['test_client'] = summarize(samples, elapsed)
+        print_summary('test client', modes['test_client'])
+    
+    if args.output:
+        result = {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'config': {
+                'products': catalog_size,
+                'messages': len(corpus),
+                'corpus': source_name,
+                'warmup': args.warmup,
+                'result_cache': not args.no_cache
+            },
+            'modes': modes
+        }
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(result, stream, indent=2)
+        print(f'\nWrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hashed n-gram intent classifier: training time, held-out
+accuracy per intent and per-message latency, single and batched, next to
+the compiled rules. With --labels the accuracy of both is measured against
+a curated NDJSON file of {"message": ..., "intent": ...} lines. Without it
+synthetic messages are labelled by the rules, so the figure is only the
+model's agreement with the rules and says nothing about which is right.
+
+Usage:
+    python benchmarks/intent_classifier_benchmark.py --labels labelled.ndjson
+    python benchmarks/intent_classifier_benchmark.py --messages 20000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+
+from seed import sample_messages
+from utils.chatbot_logic import IntentClassifier, INTENT_CONFIDENCE, read_labelled
+from utils.intent_rules import RuleMatcher
+
+
+def latency(function, batches):
+    """Median microseconds per message over the batches"""
+    timings = []
+    for batch in batches:
+        start = time.perf_counter()
+        function(batch)
+        timings.append((time.perf_counter() - start) * 1e6 / len(batch))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', help='curated NDJSON of labelled messages')
+    parser.add_argument('--messages', type=int, default=20000, help='synthetic messages without --labels')
+    parser.add_argument('--epochs', type=int, default=150)
+    args = parser.parse_args()
+    
+    rules = RuleMatcher()
+    if args.labels:
+        pairs = [(message.lower(), intent) for message, intent in read_labelled(args.labels)]
+        random.Random(42).shuffle(pairs)
+        messages = [message for message, _ in pairs]
+        intents = [intent for _, intent in pairs]
+        measure = 'accuracy against the labels'
+    else:
+        messages = [message.lower() for message in sample_messages(args.messages)]
+        intents = [rules.match(message).intent for message in messages]
+        measure = 'agreement with the rules'
+    split = len(messages) * 4 // 5
+    
+    start = time.perf_counter()
+    model = IntentClassifier.train(messages[:split], intents[:split], epochs=args.epochs)
+    print(f'train: {time.perf_counter() - start:.1f}s on {split:,} messages')
+    
+    test_messages, test_intents = messages[split:], intents[split:]
+    predictions = model.predict(test_messages)
+    confident = [(intent, expected) for (intent, probability), expected in zip(predictions, test_intents)
+                 if probability >= INTENT_CONFIDENCE]
+    correct = sum(intent == expected for (intent, _), expected in zip(predictions, test_intents))
+    print(f'held-out {measure}: {correct / len(test_intents):.2%}, '
+          f'{len(confident) / len(test_intents):.1%} above the {INTENT_CONFIDENCE} confidence threshold')
+    if args.labels:
+        rules_correct = sum(rules.match(message).intent == expected
+                            for message, expected in zip(test_messages, test_intents))
+        print(f'rules {measure}: {rules_correct / len(test_intents):.2%}')
+    
+    totals = Counter(test_intents)
+    hits = Counter(expected for (intent, _), expected in zip(predictions, test_intents) if intent == expected)
+    print(f'   {"intent":<18} {"messages":>9} {"recall":>8}')
+    for intent, total in totals.most_common():
+        print(f'   {intent:<18} {total:>9} {hits[intent] / total:>8.1%}')
+    
+    print(f'   {"batch size":<18} {"classifier":>12} {"rules":>10}')
+    for size in [1, 32, 256]:
+        batches = [test_messages[i:i + size] for i in range(0, min(len(test_messages), 200 * size), size)]
+        model_us = latency(model.predict, batches)
+        rules_us = latency(lambda batch: [rules.match(message) for message in batch], batches)
+        print(f'   {size:<18} {model_us:>10.1f}us {rules_us:>8.1f}us')
+
+
+if __name__ == '__main__':
+    main()
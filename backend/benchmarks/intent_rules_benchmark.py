@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Benchmark chatbot intent and entity rules: the compiled keyword matcher
+against the rule-by-rule regex loops it replaces
+
+Usage:
+    python benchmarks/intent_rules_benchmark.py --messages 10000
+"""
+
+import argparse
+import statistics
+import time
+
+from seed import sample_messages
+from utils.intent_rules import RuleMatcher, reference_match
+
+
+def time_matcher(match, messages, repeat):
+    """Return the per-message latencies in microseconds of the fastest of ``repeat`` runs"""
+    best = None
+    for _ in range(repeat):
+        timings = []
+        for message in messages:
+            start = time.perf_counter()
+            match(message)
+            timings.append((time.perf_counter() - start) * 1e6)
+        if best is None or sum(timings) < sum(best):
+            best = timings
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    messages = [message.lower() for message in sample_messages(args.messages)]
+    start = time.perf_counter()
+    matcher = RuleMatcher()
+    print(f'compile: {(time.perf_counter() - start) * 1000:.1f} ms')
+    
+    print(f'{"matcher":<12} {"msgs/s":>10} {"p50":>10} {"p99":>10}')
+    for name, match in [('reference', reference_match), ('compiled', matcher.match)]:
+        timings = time_matcher(match, messages, args.repeat)
+        p99 = statistics.quantiles(timings, n=100)[98]
+        print(f'{name:<12} {len(timings) / (sum(timings) / 1e6):>10,.0f} '
+              f'{statistics.median(timings):>8.1f}us {p99:>8.1f}us')
+
+
+if __name__ == '__main__':
+    main()
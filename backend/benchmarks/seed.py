@@ -0,0 +1,119 @@
+"""
+Synthetic catalog seeding shared by the benchmark scripts
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Make the backend modules importable when run as a script
+backend_dir = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(backend_dir))
+
+BRANDS = ['Apple', 'Samsung', 'Sony', 'Nike', 'Adidas', 'Dell', 'Lenovo', 'Canon', 'Gap', 'Zara',
+          'LEGO', 'Hasbro', 'Dyson', 'Weber', 'Yeti', 'Garmin', 'Fitbit', 'Vitamix', 'Anker', 'JBL']
+NOUNS = ['Laptop', 'Phone', 'Tablet', 'Camera', 'Headphones', 'Speaker', 'Sneakers', 'Boots', 'Jacket',
+         'T-Shirt', 'Novel', 'Cookbook', 'Blender', 'Vacuum', 'Grill', 'Tumbler', 'Watch', 'Backpack']
+ADJECTIVES = ['Pro', 'Ultra', 'Classic', 'Lite', 'Max', 'Mini', 'Plus', 'Sport', 'Air', 'Prime']
+COLORS = ['Black', 'White', 'Blue', 'Red', 'Gray', 'Green', 'Silver', 'Gold']
+
+
+def create_bench_app(db_path=None, **config):
+    """Create the Flask app on a throwaway SQLite database"""
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    for key, value in config.items():
+        os.environ[key] = value
+    
+    from app import create_app
+    return create_app()
+
+
+def seed_products(count, seed=42, batch_size=20000):
+    """Add ``count`` synthetic products to the catalog with executemany batches"""
+    import json
+    from models import db, Category, Product
+    
+    rng = random.Random(seed)
+    category_ids = [category.id for category in Category.query.all()]
+    now = datetime.utcnow()
+    insert = Product.__table__.insert()
+    
+    batch = []
+    for i in range(count):
+        brand = rng.choice(BRANDS)
+        noun = rng.choice(NOUNS)
+        name = f'{brand} {noun} {rng.choice(ADJECTIVES)} {i}'
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        batch.append({
+            'name': name,
+            'description': f'{rng.choice(ADJECTIVES)} {noun.lower()} by {brand} in {rng.choice(COLORS).lower()}',
+            'price': round(rng.uniform(5, 2500), 2),
+            'category_id': rng.choice(category_ids),
+            'brand': brand,
+            'image_url': None,
+            'stock_quantity': rng.randint(0, 200),
+            'is_available': rng.random() > 0.05,
+            'rating': round(rng.uniform(1, 5), 1),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'attributes': json.dumps({'color': rng.choice(COLORS)})
+        })
+        if len(batch) >= batch_size:
+            db.session.execute(insert, batch)
+            batch = []
+    if batch:
+        db.session.execute(insert, batch)
+    # Core inserts skip the session hooks, so record the change with them
+    from utils.catalog_version import record_catalog_change
+    record_catalog_change()
+    db.session.commit()
+
+
+MESSAGE_TEMPLATES = [
+    'show me {noun}s under ${price}',
+    'I need {adjective} {noun} from {brand}',
+    '{greeting}! looking for a {noun}',
+    'recommend {category} under {price}',
+    'what are the best {noun}s between ${price} and ${price2}?',
+    '{brand} {noun} less than {price} dollars',
+    'any {category} from {price} to {price2}',
+    'my budget is ${price} for a {noun}',
+    'find me something {adjective}',
+    '{greeting}, how are you',
+    'what can you do',
+    '{filler} {noun} {filler}',
+    'cheaper than ${price} {brand}',
+    '{thanks}, {goodbye}',
+    '{category} {noun} {brand} {price}',
+]
+MESSAGE_WORDS = {
+    'noun': [noun.lower() for noun in NOUNS] + ['phone', 'smartphone', 'book', 'shoe', 'watch', 'sneaker', 'dress',
+                                                'non-fiction', 'living room', 'toy', 'makeup', 'product', 'item'],
+    'adjective': [adjective.lower() for adjective in ADJECTIVES] + ['cheap', 'popular', 'trending', 'top rated'],
+    'brand': BRANDS + ['hp', 'Google', 'microsoft', 'Amazon', 'asus'],
+    'category': ['electronics', 'books', 'clothing', 'shoes', 'accessories', 'home', 'sports', 'beauty', 'toys'],
+    'greeting': ['hi', 'Hello', 'hey', 'good morning', "what's up", 'yo'],
+    'filler': ['please', 'maybe', 'thunder', 'showcase', 'homework', 'topless', 'helpful', 'kids'],
+    'thanks': ['thanks', 'thank you', 'cheers'],
+    'goodbye': ['bye', 'see you', "that's all", 'later'],
+}
+
+
+def sample_messages(count, seed=42):
+    """Synthetic chat messages covering the chatbot's intents and entities"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        template = rng.choice(MESSAGE_TEMPLATES)
+        price = rng.choice([20, 50, 99, 100, 250, 500, 1000, 1500])
+        words = {name: rng.choice(choices) for name, choices in MESSAGE_WORDS.items()}
+        message = template.format(price=price, price2=price * rng.choice([2, 3]), **words)
+        if rng.random() < 0.2:
+            message = message.upper() if rng.random() < 0.5 else message.title()
+        messages.append(message)
+    return messages
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Equivalence test for the compiled chatbot rule matcher
+Runs a corpus of chat messages through RuleMatcher and the rule-by-rule
+reference_match and fails on any difference in intent or entities.
+
+Run with: python intent_rules_test.py  (or pytest intent_rules_test.py)
+"""
+
+import sys
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.absolute()
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(backend_dir / 'benchmarks'))
+
+# Messages near the edges of the rules: word boundaries, overlapping
+# keywords, rule order and unusual casing
+EDGE_CASES = [
+    '',
+    'hi',
+    'this',
+    'thunder 50',
+    'under50',
+    'under $',
+    'show me laptops under $1500',
+    'show me a laptop under $1500',
+    'recommend books',
+    'my budget is 500 for a phone',
+    'between $100 and $300 nike shoes',
+    'from 20 to 50 living room furniture',
+    "what's up",
+    "WHAT'S GOOD",
+    'non-fiction biography',
+    'cookbook or textbook',
+    'headphones and a headphone',
+    'smartphone phone',
+    'I want an apple watch',
+    'what can I do here',
+    'hp and dell and asus',
+    'HP laptop',
+    'ſhow me shoes',
+    'Ünder $20 café',
+    'looking for a good product',
+    'find anything, thing',
+    'good morning, goodbye',
+    'less than 10 and cheaper than 5',
+    'sandals and sandal',
+    'toys for kids under $30',
+]
+
+
+def corpus():
+    from seed import sample_messages
+    messages = EDGE_CASES + sample_messages(5000)
+    return messages + [message.lower() for message in messages]
+
+
+def collect_failures():
+    from utils.intent_rules import RuleMatcher, reference_match
+    matcher = RuleMatcher()
+    failures = []
+    for message in corpus():
+        compiled = matcher.match(message)
+        reference = reference_match(message)
+        if compiled != reference:
+            failures.append(f'{message!r}: {compiled} != {reference}')
+    return failures
+
+
+def test_matcher_agrees_with_rules():
+    failures = collect_failures()
+    assert not failures, 'Matcher differs from the rules:\n' + '\n'.join(failures)
+
+
+if __name__ == '__main__':
+    print("🧪 Comparing the compiled rule matcher with the rule-by-rule reference")
+    print("=" * 50)
+    failures = collect_failures()
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print(f"✅ {len(corpus())} messages match")
+    sys.exit(1 if failures else 0)
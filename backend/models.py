@@ -2,11 +2,20 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from functools import lru_cache
 import json
 
 # Initialize SQLAlchemy - this will be used by app.py
 db = SQLAlchemy()
 
+@lru_cache(maxsize=8192)
+def parse_attributes(text):
+    """Parse an attributes JSON string once per process.
+
+    The result is shared between callers, who must copy it before changing it.
+    """
+    return json.loads(text)
+
 class User(UserMixin, db.Model):
     """User model for authentication and session management"""
     __tablename__ = 'users'
@@ -51,13 +60,19 @@ class Category(db.Model):
     # Relationship with products
     products = db.relationship('Product', backref='category', lazy=True)
     
-    def to_dict(self):
-        """Convert category object to dictionary"""
+    def to_dict(self, product_count=None):
+        """Convert category object to dictionary.
+        
+        Listings pass ``product_count`` from a grouped COUNT query, otherwise
+        it is counted here without loading the products.
+        """
+        if product_count is None:
+            product_count = Product.query.filter(Product.category_id == self.id).count()
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'product_count': len(self.products)
+            'product_count': product_count
         }
 
 class Product(db.Model):
@@ -80,6 +95,18 @@ class Product(db.Model):
     # Additional product attributes stored as JSON
     attributes = db.Column(db.Text)  # JSON string for flexible product attributes
     
+    # Listings filter on availability and sort by one column, category pages
+    # and recommendations narrow by category first
+    __table_args__ = (
+        db.Index('ix_products_available_name', 'is_available', 'name'),
+        db.Index('ix_products_available_price', 'is_available', 'price'),
+        db.Index('ix_products_available_rating', 'is_available', 'rating'),
+        db.Index('ix_products_available_created_at', 'is_available', 'created_at'),
+        db.Index('ix_products_category_available_rating', 'category_id', 'is_available', 'rating'),
+        db.Index('ix_products_available_brand', 'is_available', 'brand'),
+        db.Index('ix_products_updated_at', 'updated_at'),
+    )
+    
     def set_attributes(self, attrs_dict):
         """Set product attributes as JSON string"""
         self.attributes = json.dumps(attrs_dict)
@@ -87,7 +114,7 @@ class Product(db.Model):
     def get_attributes(self):
         """Get product attributes as dictionary"""
         if self.attributes:
-            return json.loads(self.attributes)
+            return dict(parse_attributes(self.attributes))
         return {}
     
     def to_dict(self):
@@ -109,6 +136,43 @@ class Product(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+class ProductSimilarity(db.Model):
+    """Precomputed nearest neighbours of a product, built offline for recommendations"""
+    __tablename__ = 'product_similarities'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 is the most similar neighbour
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Incremental updates look up the lists a changed product appears on
+    __table_args__ = (
+        db.Index('ix_product_similarities_neighbor_id', 'neighbor_id'),
+    )
+    
+    def to_dict(self):
+        """Convert similarity row to dictionary"""
+        return {
+            'product_id': self.product_id,
+            'rank': self.rank,
+            'neighbor_id': self.neighbor_id,
+            'score': self.score,
+            'built_at': self.built_at.isoformat()
+        }
+
+class CatalogChange(db.Model):
+    """One committed change to the catalog, its id is the catalog version after it"""
+    __tablename__ = 'catalog_changes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_ids = db.Column(db.Text)  # JSON list of the changed products, NULL when unknown
+    categories_changed = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Versions are never reused, even after the oldest rows are pruned
+    __table_args__ = {'sqlite_autoincrement': True}
+
 class ChatMessage(db.Model):
     """Chat message model for storing conversation history"""
     __tablename__ = 'chat_messages'
@@ -122,6 +186,12 @@ class ChatMessage(db.Model):
     session_id = db.Column(db.String(255))  # Session identifier
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # History is read per user, optionally per session, newest first
+    __table_args__ = (
+        db.Index('ix_chat_messages_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_chat_messages_user_session_timestamp', 'user_id', 'session_id', 'timestamp'),
+    )
+    
     def set_entities(self, entities_dict):
         """Set entities as JSON string"""
         self.entities = json.dumps(entities_dict)
@@ -159,6 +229,10 @@ class UserSession(db.Model):
     # Relationship with user
     user = db.relationship('User', backref='sessions')
     
+    __table_args__ = (
+        db.Index('ix_user_sessions_user_active_activity', 'user_id', 'is_active', 'last_activity'),
+    )
+    
     def to_dict(self):
         """Convert session object to dictionary"""
         return {
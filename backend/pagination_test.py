@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Keyset pagination test
+Walks every cursor page of the product listing orders over a catalog where
+some ratings and creation dates are NULL, and fails unless each product
+appears exactly once and in the same order as a single ORDER BY query.
+
+Run with: python pagination_test.py  (or pytest pagination_test.py)
+"""
+
+import sys
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.absolute()
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(backend_dir / 'benchmarks'))
+
+CATALOG_SIZE = 500
+PER_PAGE = 7
+
+_app = None
+
+
+def get_app():
+    """Create the app once on a seeded catalog with NULL sort keys"""
+    global _app
+    if _app is None:
+        from seed import create_bench_app, seed_products
+        _app = create_bench_app(CATALOG_ENGINE='sql')
+        with _app.app_context():
+            seed_products(CATALOG_SIZE)
+            from models import db, Product
+            for product in Product.query.filter(Product.id % 5 == 0):
+                product.rating = None
+            for product in Product.query.filter(Product.id % 7 == 0):
+                product.created_at = None
+            db.session.commit()
+    return _app
+
+
+def walk(order_keys, signature):
+    """Ids of every product, page by page, following ``next_cursor``"""
+    from models import Product
+    from utils.pagination import keyset_paginate
+    ids = []
+    cursor = None
+    while True:
+        items, pagination = keyset_paginate(
+            Product.query, order_keys, PER_PAGE, cursor=cursor, signature=signature
+        )
+        ids.extend(product.id for product in items)
+        cursor = pagination['next_cursor']
+        if cursor is None or len(ids) > CATALOG_SIZE * 2:
+            return ids
+
+
+def collect_failures():
+    from models import Product
+    failures = []
+    with get_app().app_context():
+        expected_count = Product.query.count()
+        for column in (Product.rating, Product.created_at, Product.price, Product.name):
+            for direction in ('asc', 'desc'):
+                order_keys = [(column, direction), (Product.id, 'asc')]
+                name = f'{column.key} {direction}'
+                ids = walk(order_keys, name)
+                expected = [product.id for product in Product.query.order_by(
+                    column.desc() if direction == 'desc' else column.asc(), Product.id
+                )]
+                if len(set(ids)) != len(ids):
+                    failures.append(f'{name}: {len(ids) - len(set(ids))} products repeated')
+                if len(set(ids)) != expected_count:
+                    failures.append(f'{name}: {expected_count - len(set(ids))} products missing')
+                elif ids != expected:
+                    failures.append(f'{name}: pages are out of order')
+    return failures
+
+
+def test_cursor_pages_cover_every_row_once():
+    failures = collect_failures()
+    assert not failures, 'Cursor pagination lost or repeated rows:\n' + '\n'.join(failures)
+
+
+if __name__ == '__main__':
+    print("🧪 Walking cursor pages over NULL sort keys")
+    print("=" * 50)
+    failures = collect_failures()
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ every product appears once, in order")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Query-count regression test for the listing endpoints
+Fails if an endpoint issues more SQL statements than its budget, which is
+how N+1 lazy loads show up. Runs against a throwaway copy of the sample data.
+
+Run with: python query_count_test.py  (or pytest query_count_test.py)
+"""
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.absolute()
+sys.path.insert(0, str(backend_dir))
+
+# Maximum number of SQL statements per request
+QUERY_BUDGETS = {
+    '/api/products/?per_page=50': 2,
+    '/api/products/?per_page=50&sort_by=price&sort_order=desc&brand=a': 2,
+    '/api/products/?per_page=50&cursor=': 1,
+    '/api/products/search?q=apple': 1,
+    '/api/products/categories': 2,
+    '/api/products/categories/3/products?per_page=50': 4,
+    '/api/products/featured?limit=50': 1,
+    '/api/products/recommendations/1?limit=20': 4,
+    '/api/products/brands': 1,
+    '/api/products/price-range': 1,
+}
+
+_app = None
+
+
+def get_app():
+    """Create the app once on a temporary database with the sample catalog"""
+    global _app
+    if _app is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='query-count-'), 'test.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+        os.environ['CATALOG_ENGINE'] = 'sql'
+        os.environ['CATALOG_VERSION_POLL'] = '3600'  # no version reads inside counted blocks
+        from app import create_app
+        _app = create_app()
+    return _app
+
+
+@contextmanager
+def count_queries(engine):
+    """Collect the SQL statements executed on ``engine`` inside the block"""
+    from sqlalchemy import event
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def measure(url):
+    """Return the statements a warm request to ``url`` executes"""
+    app = get_app()
+    client = app.test_client()
+    # Warm up in-memory indexes so only per-request queries are counted,
+    # but measure cached endpoints on a miss
+    client.get(url)
+    app.extensions['response_cache'].clear()
+    with app.app_context():
+        from models import db
+        engine = db.engine
+    with count_queries(engine) as statements:
+        response = client.get(url)
+    assert response.status_code == 200, f'{url} returned {response.status_code}'
+    return statements
+
+
+def test_listing_query_budgets():
+    failures = []
+    for url, budget in QUERY_BUDGETS.items():
+        statements = measure(url)
+        if len(statements) > budget:
+            failures.append(f'{url}: {len(statements)} queries (budget {budget})')
+    assert not failures, 'Query budget exceeded:\n' + '\n'.join(failures)
+
+
+def test_chatbot_search_query_budget():
+    app = get_app()
+    client = app.test_client()
+    with app.app_context():
+        from flask_jwt_extended import create_access_token
+        from models import User
+        user = User.query.filter_by(username='demo_user').first()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+    message = {'message': 'show me laptops under $1500', 'session_id': 'query-count'}
+    client.post('/api/chatbot/message', json=message, headers=headers)
+    
+    with app.app_context():
+        from models import db
+        engine = db.engine
+    with count_queries(engine) as statements:
+        response = client.post('/api/chatbot/message', json=message, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    # category lookup, product load, chat message insert and its refresh
+    assert len(statements) <= 5, f'chatbot message: {len(statements)} queries (budget 5)'
+
+
+def test_chatbot_refinement_query_budget():
+    app = get_app()
+    client = app.test_client()
+    with app.app_context():
+        from flask_jwt_extended import create_access_token
+        from models import User, db
+        user = User.query.filter_by(username='demo_user').first()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        engine = db.engine
+    client.post('/api/chatbot/message', json={'message': 'what do you recommend', 'session_id': 'refine'},
+                headers=headers)
+    
+    failures = []
+    for follow_up in ['show me more', 'cheaper ones']:
+        with count_queries(engine) as statements:
+            response = client.post('/api/chatbot/message', json={'message': follow_up, 'session_id': 'refine'},
+                                   headers=headers)
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()['intent'] == 'refinement', response.get_json()['intent']
+        # loading the products shown and the chat message insert, no search
+        if len(statements) > 2:
+            failures.append(f'chatbot follow-up {follow_up!r}: {len(statements)} queries (budget 2)')
+    assert not failures, '\n'.join(failures)
+    
+    # Another user sending the same session id starts from scratch
+    with app.app_context():
+        other = User.query.filter_by(username='admin').first()
+        other_headers = {'Authorization': f'Bearer {create_access_token(identity=str(other.id))}'}
+    response = client.post('/api/chatbot/message', json={'message': 'show me more', 'session_id': 'refine'},
+                           headers=other_headers)
+    assert response.get_json()['intent'] != 'refinement', 'another user refined the session context'
+
+
+if __name__ == '__main__':
+    print("🧪 Checking query budgets of listing endpoints")
+    print("=" * 50)
+    ok = True
+    for url, budget in QUERY_BUDGETS.items():
+        count = len(measure(url))
+        status = '✅' if count <= budget else '❌'
+        ok = ok and count <= budget
+        print(f"{status} {url}: {count} queries (budget {budget})")
+    try:
+        test_chatbot_search_query_budget()
+        print("✅ chatbot message within budget")
+    except AssertionError as e:
+        ok = False
+        print(f"❌ {e}")
+    try:
+        test_chatbot_refinement_query_budget()
+        print("✅ chatbot follow-ups within budget")
+    except AssertionError as e:
+        ok = False
+        print(f"❌ {e}")
+    sys.exit(0 if ok else 1)
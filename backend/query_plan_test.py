@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression test for the API endpoints
+Captures the SQL each endpoint runs, asks SQLite for its EXPLAIN QUERY PLAN
+and fails if any statement reads a table with a full scan instead of an
+index. A substring LIKE (a pattern starting with %) counts as a full scan
+too, since it has to test every row the index range returns. Shapes that
+are known to scan are listed in KNOWN_FULL_SCANS and reported instead of
+failing, until they stop scanning. Runs against a throwaway copy of the
+sample data.
+
+Run with: python query_plan_test.py  (or pytest query_plan_test.py)
+"""
+
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.absolute()
+sys.path.insert(0, str(backend_dir))
+
+# Public endpoints, with the filter and sort combinations the UI uses
+PUBLIC_URLS = [
+    '/api/products/?per_page=20',
+    '/api/products/?sort_by=price&sort_order=desc',
+    '/api/products/?sort_by=rating&sort_order=desc',
+    '/api/products/?sort_by=created_at&sort_order=desc',
+    '/api/products/?category_id=1&sort_by=rating',
+    '/api/products/?min_price=50&max_price=200&sort_by=price',
+    '/api/products/?cursor=&sort_by=price',
+    '/api/products/facets?category_id=1',
+    '/api/products/1',
+    '/api/products/batch?ids=1,2,3',
+    '/api/products/search?q=apple',
+    '/api/products/categories',
+    '/api/products/categories/1/products',
+    '/api/products/categories/1/products?cursor=',
+    '/api/products/brands',
+    '/api/products/price-range',
+    '/api/products/featured',
+    '/api/products/recommendations/1',
+    '/api/products/export?updated_since=2030-01-01T00:00:00',
+]
+
+# Request shapes that still read every available product, with the reason.
+# They are requested like the others; the test fails if one stops scanning
+# so the list stays accurate.
+KNOWN_FULL_SCANS = {
+    '/api/products/?brand=apple': 'brand is a substring match (ilike)',
+    '/api/products/?search=phone': 'search is a substring match over name, description and brand',
+    '/api/products/?search=phone&cursor=': 'search is a substring match over name, description and brand',
+    '/api/products/facets?brand=apple': 'brand is a substring match (ilike)',
+    '/api/products/facets?search=phone': 'search is a substring match over name, description and brand',
+}
+
+# Endpoints that need a logged in user
+AUTHENTICATED_URLS = [
+    '/api/chatbot/history',
+    '/api/chatbot/history?session_id=query-plan',
+    '/api/chatbot/sessions',
+    '/api/auth/sessions',
+]
+
+# Chat messages whose handlers query the catalog
+CHAT_MESSAGES = [
+    'show me laptops under $1500',
+    'recommend something in electronics',
+    'anything with noise canceling?',
+    'apple products',
+]
+
+# "SCAN products" reads every row, "SCAN products USING INDEX ..." reads
+# every row in index order, only "SEARCH ..." seeks into an index
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+# Small lookup tables that endpoints list in full on purpose
+WHOLE_TABLE_READS = {'categories'}
+
+# Tables that a statement filters with a leading-wildcard LIKE
+LIKE_COLUMN = re.compile(r'lower\((\w+)\.\w+\) LIKE lower\(\?\)')
+
+_app = None
+
+
+def get_app():
+    """Create the app once on a temporary database with the sample catalog"""
+    global _app
+    if _app is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='query-plan-'), 'test.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+        os.environ['CATALOG_ENGINE'] = 'sql'
+        os.environ['CATALOG_VERSION_POLL'] = '3600'  # no version reads among the explained statements
+        from app import create_app
+        _app = create_app()
+    return _app
+
+
+@contextmanager
+def capture_statements(engine):
+    """Collect the ``(statement, parameters)`` executed on ``engine`` inside the block"""
+    from sqlalchemy import event
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def full_scans(engine, statements):
+    """Return ``(scan, statement)`` for every full table scan in the statements' plans"""
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            sql = ' '.join(statement.split())
+            plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            for row in plan:
+                match = FULL_SCAN.match(row[-1])
+                if match and match.group(1) not in WHOLE_TABLE_READS:
+                    scans.append((f'SCAN {match.group(1)}', sql))
+            # An index range with a substring LIKE on top still reads every row in it
+            if any(isinstance(value, str) and value.startswith('%') for value in parameters or ()):
+                for table in sorted(set(LIKE_COLUMN.findall(sql))):
+                    scans.append((f'LIKE SCAN {table}', sql))
+    return scans
+
+
+def auth_headers():
+    app = get_app()
+    with app.app_context():
+        from flask_jwt_extended import create_access_token
+        from models import User
+        user = User.query.filter_by(username='demo_user').first()
+        return {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+
+def request_scans(method, url, **kwargs):
+    """Full scans in the statements of one warm request"""
+    app = get_app()
+    client = app.test_client()
+    # Warm up in-memory indexes, whose builds read whole tables on purpose,
+    # and measure cached endpoints on a miss
+    getattr(client, method)(url, **kwargs)
+    app.extensions['response_cache'].clear()
+    with app.app_context():
+        from models import db
+        engine = db.engine
+    with capture_statements(engine) as statements:
+        response = getattr(client, method)(url, **kwargs)
+        response.get_data()  # drain streamed responses
+    assert response.status_code == 200, f'{url} returned {response.status_code}'
+    return full_scans(engine, statements)
+
+
+def collect_scans():
+    """``{request: [(scan, statement)]}`` for every request shape checked"""
+    results = {}
+    for url in PUBLIC_URLS + list(KNOWN_FULL_SCANS):
+        results[url] = request_scans('get', url)
+    
+    headers = auth_headers()
+    for message in CHAT_MESSAGES:
+        body = {'message': message, 'session_id': 'query-plan'}
+        results[f'chat "{message}"'] = request_scans('post', '/api/chatbot/message', json=body, headers=headers)
+    for url in AUTHENTICATED_URLS:
+        results[url] = request_scans('get', url, headers=headers)
+    return results
+
+
+def collect_failures():
+    """Unexpected full scans, and known ones that no longer scan"""
+    failures = []
+    for name, scans in collect_scans().items():
+        if name in KNOWN_FULL_SCANS:
+            if not scans:
+                failures.append(f'{name}: no longer scans, remove it from KNOWN_FULL_SCANS')
+            continue
+        failures.extend(f'{name}: {scan} in {sql}' for scan, sql in scans)
+    return failures
+
+
+def test_no_full_table_scans():
+    failures = collect_failures()
+    assert not failures, 'Full table scans:\n' + '\n'.join(failures)
+
+
+if __name__ == '__main__':
+    print("🧪 Checking query plans of API endpoints")
+    print("=" * 50)
+    failures = collect_failures()
+    for name, reason in KNOWN_FULL_SCANS.items():
+        print(f"⚠️  known full scan, {name}: {reason}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ every other query uses an index")
+    sys.exit(1 if failures else 0)
@@ -1,64 +1,209 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import ChatMessage, User, db
-from utils.chatbot_logic import ChatbotProcessor
+from utils.chatbot_logic import INTENT_LABELS, get_chatbot
+from utils.chat_writer import get_chat_writer
+import json
 import uuid
 from datetime import datetime
 
 chatbot_bp = Blueprint('chatbot', __name__)
 
+# Upper bound on messages accepted by the batch endpoint
+MAX_BATCH_MESSAGES = 1000
+
+def _chat_message(user_id, user_message, session_id, response_data):
+    """ChatMessage row recording one exchange"""
+    chat_message = ChatMessage(
+        user_id=user_id,
+        message=user_message,
+        response=response_data['response'],
+        intent=response_data.get('intent'),
+        session_id=session_id,
+        timestamp=datetime.utcnow()
+    )
+    
+    if response_data.get('entities'):
+        chat_message.set_entities(response_data['entities'])
+    return chat_message
+
+def _save_messages(chat_messages):
+    """Save chat messages, or queue them for the write-behind writer, and return their ids and timestamps"""
+    writer = get_chat_writer()
+    if writer is None:
+        db.session.add_all(chat_messages)
+        db.session.flush()
+    else:
+        for chat_message in chat_messages:
+            writer.submit(chat_message)
+    
+    # Read before the commit expires the rows
+    saved = [(chat_message.id, chat_message.timestamp) for chat_message in chat_messages]
+    if writer is None:
+        db.session.commit()
+    return saved
+
+def _flush_pending():
+    """Wait for the user's queued chat messages, so reads and deletes see their latest messages"""
+    writer = get_chat_writer()
+    if writer is not None:
+        writer.flush(get_jwt_identity())
+
+def _message_request():
+    """Message and session id of a ``/message`` request body.
+
+    Raises ValueError when the body is not an object with a non-empty
+    string ``message``.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('message'), str):
+        raise ValueError('Message is required')
+    
+    user_message = data['message'].strip()
+    if not user_message:
+        raise ValueError('Message cannot be empty')
+    
+    session_id = data.get('session_id') or str(uuid.uuid4())
+    if not isinstance(session_id, str):
+        raise ValueError('session_id must be a string')
+    return user_message, session_id
+
+def _sse(event, data):
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _message_payload(message_id, timestamp, user_message, session_id, response_data):
+    """Response body for one processed message"""
+    return {
+        'message_id': message_id,
+        'user_message': user_message,
+        'bot_response': response_data['response'],
+        'intent': response_data.get('intent'),
+        'entities': response_data.get('entities', {}),
+        'products': response_data.get('products', []),
+        'session_id': session_id,
+        'timestamp': timestamp.isoformat()
+    }
+
 @chatbot_bp.route('/message', methods=['POST'])
 @jwt_required()
 def process_message():
     """Process chatbot message and return response"""
     try:
         current_user_id = get_jwt_identity()
-        data = request.get_json()
-        
-        if not data or 'message' not in data:
-            return jsonify({'error': 'Message is required'}), 400
-        
-        user_message = data['message'].strip()
-        session_id = data.get('session_id', str(uuid.uuid4()))
-        
-        if not user_message:
-            return jsonify({'error': 'Message cannot be empty'}), 400
-        
-        # Initialize chatbot processor
-        chatbot = ChatbotProcessor()
+        try:
+            user_message, session_id = _message_request()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Process the message
-        response_data = chatbot.process_message(user_message, current_user_id)
+        response_data = get_chatbot().process_message(user_message, current_user_id, session_id)
         
         # Save chat message to database
-        chat_message = ChatMessage(
-            user_id=current_user_id,
-            message=user_message,
-            response=response_data['response'],
-            intent=response_data.get('intent'),
-            session_id=session_id
-        )
+        chat_message = _chat_message(current_user_id, user_message, session_id, response_data)
+        (message_id, timestamp), = _save_messages([chat_message])
         
-        if response_data.get('entities'):
-            chat_message.set_entities(response_data['entities'])
+        return jsonify(_message_payload(
+            message_id, timestamp, user_message, session_id, response_data
+        )), 200
         
-        db.session.add(chat_message)
-        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to process message', 'details': str(e)}), 500
+
+@chatbot_bp.route('/message/stream', methods=['POST'])
+@jwt_required()
+def stream_message():
+    """Process chatbot message and stream the response as Server-Sent Events"""
+    current_user_id = get_jwt_identity()
+    try:
+        user_message, session_id = _message_request()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def events():
+        # meta (intent, entities), text, one product event per card, then
+        # done once the message is saved
+        try:
+            response_data = None
+            for event, event_data in get_chatbot().stream_message(user_message, current_user_id, session_id):
+                if event == 'result':
+                    response_data = event_data
+                elif event == 'text':
+                    yield _sse(event, {'text': event_data})
+                else:
+                    yield _sse(event, event_data)
+            
+            chat_message = _chat_message(current_user_id, user_message, session_id, response_data)
+            (message_id, timestamp), = _save_messages([chat_message])
+            yield _sse('done', {
+                'message_id': message_id,
+                'session_id': session_id,
+                'timestamp': timestamp.isoformat()
+            })
+        
+        except Exception as e:
+            db.session.rollback()
+            yield _sse('error', {'error': 'Failed to process message', 'details': str(e)})
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # keep proxies from buffering the stream
+    return response
+
+@chatbot_bp.route('/message/batch', methods=['POST'])
+@jwt_required()
+def process_message_batch():
+    """Process many chatbot messages in one request and return the results in order"""
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json(silent=True)
+        
+        # {"messages": ["hi", {"message": "...", "session_id": "..."}], "session_id": "..."}
+        items = data.get('messages') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            return jsonify({'error': 'A list of messages is required'}), 400
+        
+        if len(items) > MAX_BATCH_MESSAGES:
+            return jsonify({'error': f'At most {MAX_BATCH_MESSAGES} messages per request'}), 400
+        
+        default_session_id = data.get('session_id') or str(uuid.uuid4())
+        user_messages = []
+        session_ids = []
+        for position, item in enumerate(items):
+            if isinstance(item, dict):
+                user_message = item.get('message')
+                session_ids.append(item.get('session_id') or default_session_id)
+            else:
+                user_message = item
+                session_ids.append(default_session_id)
+            if not isinstance(user_message, str) or not user_message.strip():
+                return jsonify({'error': f'Message {position} cannot be empty'}), 400
+            if not isinstance(session_ids[-1], str):
+                return jsonify({'error': f'session_id of message {position} must be a string'}), 400
+            user_messages.append(user_message.strip())
+        
+        results = get_chatbot().process_messages(user_messages, current_user_id)
+        
+        # Save every exchange in one transaction
+        chat_messages = [
+            _chat_message(current_user_id, user_message, session_id, response_data)
+            for user_message, session_id, response_data in zip(user_messages, session_ids, results)
+        ]
+        saved = _save_messages(chat_messages)
         
         return jsonify({
-            'message_id': chat_message.id,
-            'user_message': user_message,
-            'bot_response': response_data['response'],
-            'intent': response_data.get('intent'),
-            'entities': response_data.get('entities', {}),
-            'products': response_data.get('products', []),
-            'session_id': session_id,
-            'timestamp': chat_message.timestamp.isoformat()
+            'results': [
+                _message_payload(message_id, timestamp, user_message, session_id, response_data)
+                for (message_id, timestamp), user_message, session_id, response_data
+                in zip(saved, user_messages, session_ids, results)
+            ],
+            'count': len(results)
         }), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': 'Failed to process message', 'details': str(e)}), 500
+        return jsonify({'error': 'Failed to process messages', 'details': str(e)}), 500
 
 @chatbot_bp.route('/history', methods=['GET'])
 @jwt_required()
@@ -66,6 +211,7 @@ def get_chat_history():
     """Get user's chat history"""
     try:
         current_user_id = get_jwt_identity()
+        _flush_pending()
         
         # Get pagination parameters
         page = request.args.get('page', 1, type=int)
@@ -112,6 +258,7 @@ def get_chat_sessions():
     """Get user's chat sessions"""
     try:
         current_user_id = get_jwt_identity()
+        _flush_pending()
         
         # Get distinct session IDs with message counts and latest timestamps
         sessions = db.session.query(
@@ -150,6 +297,7 @@ def clear_chat_history():
     """Clear user's chat history"""
     try:
         current_user_id = get_jwt_identity()
+        _flush_pending()
         data = request.get_json() or {}
         session_id = data.get('session_id')
         
@@ -181,6 +329,7 @@ def delete_message(message_id):
     """Delete a specific chat message"""
     try:
         current_user_id = get_jwt_identity()
+        _flush_pending()
         
         message = ChatMessage.query.filter(
             ChatMessage.id == message_id,
@@ -208,6 +357,7 @@ def submit_feedback():
     """Submit feedback for a chat response"""
     try:
         current_user_id = get_jwt_identity()
+        _flush_pending()
         data = request.get_json()
         
         if not data or 'message_id' not in data or 'rating' not in data:
@@ -216,11 +366,15 @@ def submit_feedback():
         message_id = data['message_id']
         rating = data['rating']  # 1-5 scale
         feedback_text = data.get('feedback', '')
+        intent = data.get('intent')  # what the user meant, when the chatbot got it wrong
         
         # Validate rating
         if not isinstance(rating, int) or rating < 1 or rating > 5:
             return jsonify({'error': 'Rating must be between 1 and 5'}), 400
         
+        if intent is not None and intent not in INTENT_LABELS:
+            return jsonify({'error': f"Intent must be one of: {', '.join(INTENT_LABELS)}"}), 400
+        
         # Find the message
         message = ChatMessage.query.filter(
             ChatMessage.id == message_id,
@@ -237,6 +391,8 @@ def submit_feedback():
             'text': feedback_text,
             'timestamp': datetime.utcnow().isoformat()
         }
+        if intent is not None:
+            entities['feedback']['intent'] = intent
         message.set_entities(entities)
         
         db.session.commit()
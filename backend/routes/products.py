@@ -1,10 +1,62 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Product, Category, db
 from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from utils.catalog_engine import get_catalog_engine
+from utils.serializers import load_products_in_order, serialize_products, serialize_categories
+from utils.search_index import get_search_index
+from utils.pagination import keyset_paginate, InvalidCursor
+from utils.response_cache import catalog_cached
+from utils.facets import parse_price_edges, format_facets, sql_facets, category_names
+from utils.similarity_index import get_similar_products
+from utils.catalog_export import EXPORT_FORMATS, PUBLIC_EXPORT_FIELDS, iter_product_chunks, parse_timestamp
+from utils.autocomplete import get_autocomplete, MAX_SUGGESTIONS
+from utils.attribute_index import get_attribute_index, parse_attribute_filters, id_filter
 
 products_bp = Blueprint('products', __name__)
 
+# Upper bound on IDs accepted by the batch lookup endpoint
+MAX_BATCH_IDS = 500
+
+def _attribute_product_ids():
+    """Ids matching the request's ``attr=key:value`` filters, or None without any.
+
+    Raises ValueError for malformed filters.
+    """
+    filters = parse_attribute_filters(request.args.getlist('attr'))
+    if not filters:
+        return None
+    return get_attribute_index().filter_ids(filters)
+
+def _apply_listing_filters(query, category_id=None, min_price=None, max_price=None, brand=None, search=None,
+                           product_ids=None):
+    """Apply the product listing filters shared by get_products and get_facets"""
+    if product_ids is not None:
+        query = query.filter(id_filter(product_ids))
+    
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    
+    if brand:
+        query = query.filter(Product.brand.ilike(f'%{brand}%'))
+    
+    if search:
+        search_filter = or_(
+            Product.name.ilike(f'%{search}%'),
+            Product.description.ilike(f'%{search}%'),
+            Product.brand.ilike(f'%{search}%')
+        )
+        query = query.filter(search_filter)
+    
+    return query
+
 @products_bp.route('/', methods=['GET'])
 def get_products():
     """Get all products with optional filtering and pagination"""
@@ -19,33 +71,56 @@ def get_products():
         search = request.args.get('search')
         sort_by = request.args.get('sort_by', 'name')  # name, price, rating, created_at
         sort_order = request.args.get('sort_order', 'asc')  # asc, desc
+        cursor = request.args.get('cursor')  # present (even empty) selects cursor pagination
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
         # Limit per_page to prevent abuse
         per_page = min(per_page, 100)
+        if per_page < 1:
+            per_page = 20
+        
+        try:
+            product_ids = _attribute_product_ids()
+        except ValueError as e:
+            return jsonify({'error': 'Invalid attribute filter', 'details': str(e)}), 400
+        
+        filters_applied = {
+            'category_id': category_id,
+            'min_price': min_price,
+            'max_price': max_price,
+            'brand': brand,
+            'search': search,
+            'attributes': request.args.getlist('attr'),
+            'sort_by': sort_by,
+            'sort_order': sort_order
+        }
+        
+        # Serve from the in-memory column store when enabled; free text
+        # search still needs the SQL path
+        engine = get_catalog_engine()
+        if engine is not None and not search and cursor is None:
+            products, pagination = engine.paginate(
+                page=page,
+                per_page=per_page,
+                category_id=category_id,
+                min_price=min_price,
+                max_price=max_price,
+                brand=brand,
+                sort_by=sort_by,
+                sort_order=sort_order,
+                product_ids=product_ids
+            )
+            return jsonify({
+                'products': serialize_products(products),
+                'pagination': pagination,
+                'filters_applied': filters_applied
+            }), 200
         
-        # Build query
-        query = Product.query.filter(Product.is_available == True)
+        # Build query, categories are eager loaded for serialization
+        query = Product.query.options(joinedload(Product.category)).filter(Product.is_available == True)
         
         # Apply filters
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        
-        if min_price is not None:
-            query = query.filter(Product.price >= min_price)
-        
-        if max_price is not None:
-            query = query.filter(Product.price <= max_price)
-        
-        if brand:
-            query = query.filter(Product.brand.ilike(f'%{brand}%'))
-        
-        if search:
-            search_filter = or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.description.ilike(f'%{search}%'),
-                Product.brand.ilike(f'%{search}%')
-            )
-            query = query.filter(search_filter)
+        query = _apply_listing_filters(query, category_id, min_price, max_price, brand, search, product_ids)
         
         # Apply sorting
         if sort_by == 'price':
@@ -57,10 +132,28 @@ def get_products():
         else:
             sort_column = Product.name
         
+        if cursor is not None:
+            # Keyset pagination: seek past the last row of the previous page,
+            # with the id as tie breaker, instead of OFFSET and COUNT
+            products, pagination = keyset_paginate(
+                query,
+                [(sort_column, 'desc' if sort_order == 'desc' else 'asc'), (Product.id, 'asc')],
+                per_page,
+                cursor=cursor,
+                include_total=include_total,
+                signature=f"{sort_column.key}:{sort_order == 'desc'}"
+            )
+            return jsonify({
+                'products': serialize_products(products),
+                'pagination': pagination,
+                'filters_applied': filters_applied
+            }), 200
+        
         if sort_order == 'desc':
             sort_column = sort_column.desc()
         
-        query = query.order_by(sort_column)
+        # Ties go by id, like cursor pages and the columnar engine
+        query = query.order_by(sort_column, Product.id)
         
         # Paginate results
         products = query.paginate(
@@ -70,7 +163,7 @@ def get_products():
         )
         
         return jsonify({
-            'products': [product.to_dict() for product in products.items],
+            'products': serialize_products(products.items),
             'pagination': {
                 'page': products.page,
                 'pages': products.pages,
@@ -79,20 +172,62 @@ def get_products():
                 'has_next': products.has_next,
                 'has_prev': products.has_prev
             },
-            'filters_applied': {
-                'category_id': category_id,
-                'min_price': min_price,
-                'max_price': max_price,
-                'brand': brand,
-                'search': search,
-                'sort_by': sort_by,
-                'sort_order': sort_order
-            }
+            'filters_applied': filters_applied
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': 'Invalid cursor', 'details': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to get products', 'details': str(e)}), 500
 
+@products_bp.route('/facets', methods=['GET'])
+@catalog_cached
+def get_facets():
+    """Get brand, category and price bucket counts for the filtered products"""
+    try:
+        # Same filters as get_products
+        category_id = request.args.get('category_id', type=int)
+        min_price = request.args.get('min_price', type=float)
+        max_price = request.args.get('max_price', type=float)
+        brand = request.args.get('brand')
+        search = request.args.get('search')
+        
+        try:
+            edges = parse_price_edges(request.args.get('price_buckets'))
+        except ValueError as e:
+            return jsonify({'error': 'Invalid price_buckets', 'details': str(e)}), 400
+        
+        try:
+            product_ids = _attribute_product_ids()
+        except ValueError as e:
+            return jsonify({'error': 'Invalid attribute filter', 'details': str(e)}), 400
+        
+        # One vectorized pass over the column store when enabled, otherwise
+        # one grouped query
+        engine = get_catalog_engine()
+        if engine is not None and not search:
+            snapshot = engine.snapshot()
+            mask = snapshot.mask(category_id, min_price, max_price, brand, product_ids)
+            brand_counts, category_counts, bucket_counts = snapshot.facets(mask, edges)
+            facets = format_facets(brand_counts, category_counts, bucket_counts, edges, category_names())
+        else:
+            query = Product.query.filter(Product.is_available == True)
+            query = _apply_listing_filters(query, category_id, min_price, max_price, brand, search, product_ids)
+            facets = sql_facets(query, edges)
+        
+        facets['filters_applied'] = {
+            'category_id': category_id,
+            'min_price': min_price,
+            'max_price': max_price,
+            'brand': brand,
+            'search': search,
+            'attributes': request.args.getlist('attr')
+        }
+        return jsonify(facets), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get facets', 'details': str(e)}), 500
+
 @products_bp.route('/<int:product_id>', methods=['GET'])
 def get_product(product_id):
     """Get specific product by ID"""
@@ -110,6 +245,92 @@ def get_product(product_id):
     except Exception as e:
         return jsonify({'error': 'Failed to get product', 'details': str(e)}), 500
 
+@products_bp.route('/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    """Get many products by ID in one request, in request order"""
+    try:
+        # POST {"ids": [1, 2, 3]} or GET ?ids=1,2,3
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            ids = data.get('ids') if isinstance(data, dict) else None
+        else:
+            ids = [value for value in request.args.get('ids', '').split(',') if value.strip()]
+        
+        if not ids or not isinstance(ids, list):
+            return jsonify({'error': 'A list of product IDs is required'}), 400
+        
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f'At most {MAX_BATCH_IDS} product IDs per request'}), 400
+        
+        if request.method == 'POST':
+            # JSON true and 1.9 are not IDs, int() would turn them into 1
+            if not all(isinstance(product_id, int) and not isinstance(product_id, bool) for product_id in ids):
+                return jsonify({'error': 'Product IDs must be integers'}), 400
+        else:
+            try:
+                ids = [int(product_id) for product_id in ids]
+            except ValueError:
+                return jsonify({'error': 'Product IDs must be integers'}), 400
+        
+        # One IN query with categories eager loaded
+        products = Product.query.options(joinedload(Product.category)).filter(
+            Product.id.in_(set(ids))
+        ).all()
+        by_id = {product.id: product for product in products}
+        serialized = {}
+        
+        results = []
+        for product_id in ids:
+            product = by_id.get(product_id)
+            if product is None:
+                results.append({'id': product_id, 'status': 'not_found'})
+            elif not product.is_available:
+                results.append({'id': product_id, 'status': 'not_available'})
+            else:
+                if product_id not in serialized:
+                    serialized[product_id] = product.to_dict()
+                results.append({'id': product_id, 'status': 'ok', 'product': serialized[product_id]})
+        
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'found': sum(1 for result in results if result['status'] == 'ok')
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get products', 'details': str(e)}), 500
+
+@products_bp.route('/export', methods=['GET'])
+def export_products():
+    """Stream the available products as NDJSON or CSV for downstream sync"""
+    try:
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unsupported format, use one of: {', '.join(sorted(EXPORT_FORMATS))}"}), 400
+        
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = parse_timestamp(updated_since)
+            except ValueError:
+                return jsonify({'error': 'updated_since must be an ISO 8601 timestamp'}), 400
+        else:
+            updated_since = None
+        
+        encode, mimetype = EXPORT_FORMATS[export_format]
+        
+        # Like the rest of the public API, unavailable products and stock
+        # levels stay hidden; the full catalog is exported with the CLI
+        chunks = iter_product_chunks(updated_since, available_only=True)
+        
+        # Rows are read and encoded chunk by chunk while the response is sent
+        response = Response(stream_with_context(encode(chunks, PUBLIC_EXPORT_FIELDS)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=products.{export_format}'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to export products', 'details': str(e)}), 500
+
 @products_bp.route('/search', methods=['GET'])
 def search_products():
     """Search products with advanced filtering"""
@@ -124,71 +345,87 @@ def search_products():
         min_price = request.args.get('min_price', type=float)
         max_price = request.args.get('max_price', type=float)
         brand = request.args.get('brand')
+        match = request.args.get('match', 'all')  # all, any
         limit = request.args.get('limit', 20, type=int)
         
         # Limit results to prevent abuse
         limit = min(limit, 100)
         
-        # Build search query
-        search_filter = or_(
-            Product.name.ilike(f'%{query_text}%'),
-            Product.description.ilike(f'%{query_text}%'),
-            Product.brand.ilike(f'%{query_text}%')
-        )
-        
-        query = Product.query.filter(
-            and_(
-                Product.is_available == True,
-                search_filter
-            )
-        )
-        
-        # Apply additional filters
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        
-        if min_price is not None:
-            query = query.filter(Product.price >= min_price)
-        
-        if max_price is not None:
-            query = query.filter(Product.price <= max_price)
-        
-        if brand:
-            query = query.filter(Product.brand.ilike(f'%{brand}%'))
-        
-        # Order by relevance (name matches first, then description)
-        products = query.order_by(
-            func.case(
-                [(Product.name.ilike(f'%{query_text}%'), 1)],
-                else_=2
-            ),
-            Product.rating.desc(),
-            Product.name
-        ).limit(limit).all()
+        try:
+            product_ids = _attribute_product_ids()
+        except ValueError as e:
+            return jsonify({'error': 'Invalid attribute filter', 'details': str(e)}), 400
+        
+        # Rank with BM25 over the inverted index, then load the page of
+        # products in relevance order
+        index = get_search_index()
+        filters = {
+            'match': match,
+            'limit': limit,
+            'category_id': category_id,
+            'min_price': min_price,
+            'max_price': max_price,
+            'brand': brand,
+            'product_ids': product_ids
+        }
+        results = index.search(query_text, **filters)
+        
+        # Nothing matched, retry once with misspelled terms corrected
+        corrected_query = None
+        if not results:
+            corrected_query = index.correct(query_text)
+            if corrected_query:
+                results = index.search(corrected_query, **filters)
+        products = load_products_in_order([product_id for product_id, _ in results])
         
         return jsonify({
-            'products': [product.to_dict() for product in products],
+            'products': serialize_products(products),
             'query': query_text,
+            'corrected_query': corrected_query,
             'results_count': len(products),
             'filters_applied': {
                 'category_id': category_id,
                 'min_price': min_price,
                 'max_price': max_price,
-                'brand': brand
+                'brand': brand,
+                'match': match,
+                'attributes': request.args.getlist('attr')
             }
         }), 200
         
     except Exception as e:
         return jsonify({'error': 'Search failed', 'details': str(e)}), 500
 
+@products_bp.route('/autocomplete', methods=['GET'])
+def autocomplete_products():
+    """Type-ahead suggestions for a search box prefix"""
+    try:
+        prefix = request.args.get('prefix', '').strip()
+        
+        if not prefix:
+            return jsonify({'error': 'A prefix is required'}), 400
+        
+        limit = request.args.get('limit', MAX_SUGGESTIONS, type=int)
+        suggestions = get_autocomplete().complete(prefix, limit)
+        
+        return jsonify({
+            'prefix': prefix,
+            'suggestions': [suggestion._asdict() for suggestion in suggestions],
+            'count': len(suggestions)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Autocomplete failed', 'details': str(e)}), 500
+
 @products_bp.route('/categories', methods=['GET'])
+@catalog_cached
 def get_categories():
     """Get all product categories"""
     try:
         categories = Category.query.order_by(Category.name).all()
         
         return jsonify({
-            'categories': [category.to_dict() for category in categories]
+            'categories': serialize_categories(categories)
         }), 200
         
     except Exception as e:
@@ -207,6 +444,8 @@ def get_products_by_category(category_id):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         per_page = min(per_page, 100)
+        if per_page < 1:
+            per_page = 20
         
         # Get additional filters
         min_price = request.args.get('min_price', type=float)
@@ -214,7 +453,7 @@ def get_products_by_category(category_id):
         brand = request.args.get('brand')
         
         # Build query
-        query = Product.query.filter(
+        query = Product.query.options(joinedload(Product.category)).filter(
             and_(
                 Product.category_id == category_id,
                 Product.is_available == True
@@ -231,6 +470,23 @@ def get_products_by_category(category_id):
         if brand:
             query = query.filter(Product.brand.ilike(f'%{brand}%'))
         
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            include_total = request.args.get('include_total', 'false').lower() == 'true'
+            products, pagination = keyset_paginate(
+                query,
+                [(Product.rating, 'desc'), (Product.name, 'asc'), (Product.id, 'asc')],
+                per_page,
+                cursor=cursor,
+                include_total=include_total,
+                signature='rating:name'
+            )
+            return jsonify({
+                'category': category.to_dict(),
+                'products': serialize_products(products),
+                'pagination': pagination
+            }), 200
+        
         # Order by rating and name
         query = query.order_by(Product.rating.desc(), Product.name)
         
@@ -243,7 +499,7 @@ def get_products_by_category(category_id):
         
         return jsonify({
             'category': category.to_dict(),
-            'products': [product.to_dict() for product in products.items],
+            'products': serialize_products(products.items),
             'pagination': {
                 'page': products.page,
                 'pages': products.pages,
@@ -254,10 +510,13 @@ def get_products_by_category(category_id):
             }
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': 'Invalid cursor', 'details': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to get category products', 'details': str(e)}), 500
 
 @products_bp.route('/brands', methods=['GET'])
+@catalog_cached
 def get_brands():
     """Get all product brands"""
     try:
@@ -281,6 +540,7 @@ def get_brands():
         return jsonify({'error': 'Failed to get brands', 'details': str(e)}), 500
 
 @products_bp.route('/price-range', methods=['GET'])
+@catalog_cached
 def get_price_range():
     """Get min and max price range for products"""
     try:
@@ -298,13 +558,14 @@ def get_price_range():
         return jsonify({'error': 'Failed to get price range', 'details': str(e)}), 500
 
 @products_bp.route('/featured', methods=['GET'])
+@catalog_cached
 def get_featured_products():
     """Get featured products (highest rated)"""
     try:
         limit = request.args.get('limit', 10, type=int)
         limit = min(limit, 50)
         
-        products = Product.query.filter(
+        products = Product.query.options(joinedload(Product.category)).filter(
             Product.is_available == True
         ).order_by(
             Product.rating.desc(),
@@ -312,7 +573,7 @@ def get_featured_products():
         ).limit(limit).all()
         
         return jsonify({
-            'featured_products': [product.to_dict() for product in products],
+            'featured_products': serialize_products(products),
             'count': len(products)
         }), 200
         
@@ -321,7 +582,7 @@ def get_featured_products():
 
 @products_bp.route('/recommendations/<int:product_id>', methods=['GET'])
 def get_product_recommendations(product_id):
-    """Get product recommendations based on category and price"""
+    """Get product recommendations from the similarity index, falling back to category and price"""
     try:
         product = Product.query.get(product_id)
         
@@ -331,10 +592,20 @@ def get_product_recommendations(product_id):
         limit = request.args.get('limit', 5, type=int)
         limit = min(limit, 20)
         
+        # Precomputed neighbours, one indexed lookup
+        recommendations = get_similar_products(product_id, limit)
+        if recommendations:
+            return jsonify({
+                'product_id': product_id,
+                'recommendations': serialize_products(recommendations),
+                'count': len(recommendations),
+                'source': 'similarity_index'
+            }), 200
+        
         # Get products from same category with similar price range
         price_range = product.price * 0.3  # 30% price range
         
-        recommendations = Product.query.filter(
+        recommendations = Product.query.options(joinedload(Product.category)).filter(
             and_(
                 Product.id != product_id,
                 Product.category_id == product.category_id,
@@ -349,7 +620,7 @@ def get_product_recommendations(product_id):
         
         # If not enough recommendations, get from same category
         if len(recommendations) < limit:
-            additional = Product.query.filter(
+            additional = Product.query.options(joinedload(Product.category)).filter(
                 and_(
                     Product.id != product_id,
                     Product.category_id == product.category_id,
@@ -364,8 +635,9 @@ def get_product_recommendations(product_id):
         
         return jsonify({
             'product_id': product_id,
-            'recommendations': [rec.to_dict() for rec in recommendations],
-            'count': len(recommendations)
+            'recommendations': serialize_products(recommendations),
+            'count': len(recommendations),
+            'source': 'category'
         }), 200
         
     except Exception as e:
@@ -0,0 +1,284 @@
+import re
+import threading
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import Column, Integer, MetaData, Table, select, text
+from models import Product, db, parse_attributes
+from utils.catalog_version import get_catalog_version, changes_since
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+
+# Longest attribute phrase, in words, looked for in chat messages
+MAX_PHRASE_WORDS = 4
+
+# Id sets up to this size are bound as IN parameters, larger ones are
+# loaded into a temporary table in chunks and joined
+MAX_BOUND_IDS = 500
+ID_CHUNK_SIZE = 5000
+
+_filter_ids = Table('attribute_filter_ids', MetaData(), Column('id', Integer, primary_key=True))
+
+
+def normalize_key(key):
+    """``Screen Size`` and ``screen-size`` both become ``screen_size``"""
+    return '_'.join(WORD_PATTERN.findall(str(key).lower()))
+
+
+def normalize_value(value):
+    """Attribute values compare case-insensitively, flags as ``true``/``false``"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return ' '.join(WORD_PATTERN.findall(str(value).lower()))
+
+
+def compact(text):
+    """Spacing and punctuation insensitive form, "256 GB" and "256gb" are equal"""
+    return ''.join(WORD_PATTERN.findall(text.lower()))
+
+
+def _subphrases(value):
+    """Compact forms of every run of whole words in a normalized value"""
+    words = value.split()
+    return {
+        ''.join(words[start:end])
+        for start in range(len(words))
+        for end in range(start + 1, len(words) + 1)
+    }
+
+
+def _phrases(key, value):
+    """Chat phrases that name an attribute pair.
+
+    Flags are named by their key ("noise canceling"), other values by their
+    words with or without the key ("size 10", "256gb"). Bare numbers are too
+    ambiguous to stand alone.
+    """
+    key_phrase = key.replace('_', '')
+    if value == 'true':
+        return {key_phrase}
+    if value == 'false':
+        return set()
+    phrases = set()
+    for sub in _subphrases(value):
+        phrases.add(key_phrase + sub)
+        if len(sub) >= 3 and not sub.replace('.', '').isdigit():
+            phrases.add(sub)
+    return phrases
+
+
+def parse_attribute_filters(values):
+    """Parse ``attr=key:value`` request arguments; a bare ``key`` means the flag is true"""
+    filters = []
+    for raw in values:
+        key, _, value = raw.partition(':')
+        key = normalize_key(key)
+        value = normalize_value(value) if value.strip() else 'true'
+        if not key or not value:
+            raise ValueError(f'Invalid attribute filter "{raw}", use key:value')
+        filters.append((key, value))
+    return filters
+
+
+class AttributeIndex:
+    """Inverted map of product attribute (key, value) pairs to product ids.
+
+    Values are normalized (case, spacing and punctuation) and a filter
+    value also matches values it is a whole-word part of, so ``storage:256gb``
+    matches both "256GB" and "256GB SSD". The word level lookup tables are
+    sized by the attribute vocabulary, the id sets by the catalog. Only
+    available products are indexed. Changed products are re-indexed on the
+    next lookup.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._postings = defaultdict(set)  # (key, value) -> product ids
+        self._documents = {}  # product_id -> ((key, value), ...)
+        self._values = defaultdict(set)  # (key, compact subphrase) -> values
+        self._phrases = defaultdict(set)  # compact chat phrase -> (key, value) pairs
+    
+    def __len__(self):
+        return len(self._documents)
+    
+    # Maintenance
+    
+    def refresh(self):
+        """Bring the index up to date with the catalog version"""
+        if self._version == get_catalog_version():
+            return
+        with self._lock:
+            if self._version is None:
+                self._rebuild()
+                return
+            version, product_ids, _ = changes_since(self._version)
+            if product_ids is None:
+                self._rebuild()
+            elif product_ids:
+                self._reindex(product_ids, version)
+            else:
+                self._version = version
+    
+    def _rebuild(self):
+        version = get_catalog_version()
+        self._postings = defaultdict(set)
+        self._documents = {}
+        self._values = defaultdict(set)
+        self._phrases = defaultdict(set)
+        for row in self._rows(Product.is_available == True):
+            self._add(row)
+        self._version = version
+    
+    def _reindex(self, product_ids, version):
+        for product_id in product_ids:
+            self._remove(product_id)
+        ids = list(product_ids)
+        for start in range(0, len(ids), 500):
+            for row in self._rows(Product.id.in_(ids[start:start + 500]), Product.is_available == True):
+                self._add(row)
+        self._version = version
+    
+    def _rows(self, *criteria):
+        return db.session.query(Product.id, Product.attributes).filter(
+            Product.attributes.isnot(None), *criteria
+        ).yield_per(5000)
+    
+    def _add(self, row):
+        try:
+            attributes = parse_attributes(row.attributes) if row.attributes else {}
+        except ValueError:
+            return
+        if not isinstance(attributes, dict):
+            return
+        pairs = []
+        for key, value in attributes.items():
+            if value is None or isinstance(value, (list, dict)):
+                continue
+            pair = (normalize_key(key), normalize_value(value))
+            if not pair[0] or not pair[1]:
+                continue
+            if pair not in self._postings:
+                for sub in _subphrases(pair[1]):
+                    self._values[(pair[0], sub)].add(pair[1])
+                for phrase in _phrases(*pair):
+                    self._phrases[phrase].add(pair)
+            self._postings[pair].add(row.id)
+            pairs.append(pair)
+        if pairs:
+            self._documents[row.id] = tuple(pairs)
+    
+    def _remove(self, product_id):
+        for pair in self._documents.pop(product_id, ()):
+            postings = self._postings.get(pair)
+            if postings is None:
+                continue
+            postings.discard(product_id)
+            if postings:
+                continue
+            # Last product with this pair, drop its vocabulary entries
+            del self._postings[pair]
+            for sub in _subphrases(pair[1]):
+                values = self._values.get((pair[0], sub))
+                if values is not None:
+                    values.discard(pair[1])
+                    if not values:
+                        del self._values[(pair[0], sub)]
+            for phrase in _phrases(*pair):
+                pairs = self._phrases.get(phrase)
+                if pairs is not None:
+                    pairs.discard(pair)
+                    if not pairs:
+                        del self._phrases[phrase]
+    
+    # Querying
+    
+    def resolve(self, key, value):
+        """Indexed pairs a ``key:value`` filter matches"""
+        self.refresh()
+        with self._lock:
+            return {(key, indexed) for indexed in self._values.get((key, compact(value)), ())}
+    
+    def product_ids(self, groups):
+        """Ids of products matching every group of alternative (key, value) pairs"""
+        self.refresh()
+        with self._lock:
+            unions = []
+            for pairs in groups:
+                ids = set()
+                for pair in pairs:
+                    ids |= self._postings.get(pair, set())
+                unions.append(ids)
+            if not unions:
+                return set()
+            unions.sort(key=len)
+            result = set(unions[0])
+            for ids in unions[1:]:
+                result &= ids
+                if not result:
+                    break
+            return result
+    
+    def filter_ids(self, filters):
+        """Ids of products matching parsed ``attr`` filters, see ``parse_attribute_filters``"""
+        return self.product_ids([self.resolve(key, value) for key, value in filters])
+    
+    def phrase_pairs(self, phrase):
+        """Pairs a phrase returned by ``extract`` stands for"""
+        self.refresh()
+        with self._lock:
+            return set(self._phrases.get(compact(phrase), ()))
+    
+    def extract(self, text):
+        """Attribute phrases mentioned in free text.
+
+        Phrases are matched longest first from left to right without
+        overlaps. Only word n-grams of the text are looked up, so the cost
+        does not depend on the attribute vocabulary.
+        """
+        self.refresh()
+        words = WORD_PATTERN.findall(text.lower())
+        found = []
+        with self._lock:
+            start = 0
+            while start < len(words):
+                for end in range(min(len(words), start + MAX_PHRASE_WORDS), start, -1):
+                    if ''.join(words[start:end]) in self._phrases:
+                        found.append(' '.join(words[start:end]))
+                        start = end
+                        break
+                else:
+                    start += 1
+        return found
+
+
+def id_filter(ids):
+    """``Product.id IN (...)`` for an id set of any size.
+
+    Small sets are bound parameters. A common attribute can match most of
+    the catalog, so larger sets replace the rows of a per-connection
+    temporary table, written with executemany in chunks, and the filter
+    becomes a subquery on it. Statements keep the same text whatever the
+    set size, so they stay cacheable and under the bound-variable limit.
+    Only the last large set per session is kept: apply the filter right
+    before running the query.
+    """
+    ids = sorted(ids)
+    if len(ids) <= MAX_BOUND_IDS:
+        return Product.id.in_(ids)
+    
+    connection = db.session.connection()
+    connection.execute(text('CREATE TEMPORARY TABLE IF NOT EXISTS attribute_filter_ids (id INTEGER PRIMARY KEY)'))
+    connection.execute(_filter_ids.delete())
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        connection.execute(_filter_ids.insert(), [{'id': product_id} for product_id in ids[start:start + ID_CHUNK_SIZE]])
+    return Product.id.in_(select(_filter_ids.c.id))
+
+
+def init_attribute_index(app):
+    """Register the product attribute index on the app"""
+    app.extensions['attribute_index'] = AttributeIndex()
+
+
+def get_attribute_index():
+    """Get the attribute index for the current app"""
+    return current_app.extensions['attribute_index']
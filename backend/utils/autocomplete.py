@@ -0,0 +1,263 @@
+import bisect
+import heapq
+import threading
+from collections import Counter, namedtuple
+from flask import current_app
+from models import Product, Category, db
+from utils.catalog_version import get_catalog_version, changes_since
+from utils.chatbot_logic import CATEGORY_MAPPING
+
+MAX_SUGGESTIONS = 10
+
+# Prefixes matching more keys than this keep a precomputed top list, smaller
+# ranges are ranked on the fly
+HEAVY_RANGE = 128
+
+# Suggestion types in display order: categories and brands before single products
+TYPE_PRIORITY = {
+    'category': 3,
+    'brand': 2,
+    'keyword': 1,
+    'product': 0
+}
+
+# One completion. ``popularity`` is the product count for categories and
+# brands and the rating for products; keywords all rank equally.
+Suggestion = namedtuple('Suggestion', ['text', 'type', 'id', 'popularity'])
+
+
+def _rank(suggestion):
+    return (TYPE_PRIORITY[suggestion.type], suggestion.popularity, suggestion.text)
+
+
+def _key(suggestion):
+    """Sort key of a suggestion, its text first so that prefixes select a range"""
+    return f"{suggestion.text.lower()}\x00{suggestion.type}:{suggestion.id}"
+
+
+class AutocompleteIndex:
+    """Prefix index over product names, brands, categories and chatbot keywords.
+
+    Keys are kept in one sorted list, so every trie node is a contiguous
+    range found by bisection. Ranges larger than HEAVY_RANGE cache their
+    best suggestions, which keeps lookups from ever scanning a large range.
+    Product changes update the keys in place on the next lookup.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._keys = []  # sorted
+        self._suggestions = {}  # key -> Suggestion
+        self._product_keys = {}  # product_id -> key
+        self._brand_keys = {}  # lower brand -> key
+        self._product_meta = {}  # available product_id -> (lower brand, category_id)
+        self._brand_counts = Counter()  # lower brand -> available products
+        self._brand_names = {}  # lower brand -> display spelling
+        self._category_counts = Counter()  # category_id -> available products
+        self._category_names = {}
+        self._top = {}  # heavy prefix -> [Suggestion] best first
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    # Maintenance
+    
+    def refresh(self):
+        """Bring the index up to date with the catalog version"""
+        if self._version == get_catalog_version():
+            return
+        with self._lock:
+            if self._version is None:
+                self._rebuild()
+                return
+            version, product_ids, categories_changed = changes_since(self._version)
+            if product_ids is None or categories_changed:
+                self._rebuild()
+            elif product_ids:
+                self._update_products(product_ids, version)
+            else:
+                self._version = version
+    
+    def _rebuild(self):
+        version = get_catalog_version()
+        self._product_meta = {}
+        self._brand_counts = Counter()
+        self._brand_names = {}
+        self._category_counts = Counter()
+        suggestions = []
+        for product_id, name, rating, brand, category_id in self._product_rows(Product.is_available == True):
+            suggestions.append(Suggestion(name, 'product', product_id, rating or 0.0))
+            self._count(product_id, brand, category_id)
+        
+        self._category_names = dict(db.session.query(Category.id, Category.name).all())
+        suggestions.extend(self._category_suggestion(category_id) for category_id in self._category_names)
+        suggestions.extend(self._brand_suggestion(brand) for brand in self._brand_counts)
+        keywords = {keyword for words in CATEGORY_MAPPING.values() for keyword in words}
+        suggestions.extend(Suggestion(keyword, 'keyword', None, 0) for keyword in sorted(keywords))
+        
+        self._suggestions = {}
+        self._product_keys = {}
+        self._brand_keys = {}
+        for suggestion in suggestions:
+            self._remember(_key(suggestion), suggestion)
+        self._keys = sorted(self._suggestions)
+        self._top = {}
+        self._cache_heavy(0, len(self._keys), 1)
+        self._version = version
+    
+    def _product_rows(self, *criteria):
+        return db.session.query(
+            Product.id, Product.name, Product.rating, Product.brand, Product.category_id
+        ).filter(*criteria).yield_per(5000)
+    
+    def _count(self, product_id, brand, category_id):
+        """Add an available product to the brand and category counts"""
+        brand_key = brand.lower() if brand else None
+        if brand_key:
+            self._brand_counts[brand_key] += 1
+            # The alphabetically first spelling names the brand
+            if brand_key not in self._brand_names or brand < self._brand_names[brand_key]:
+                self._brand_names[brand_key] = brand
+        self._category_counts[category_id] += 1
+        self._product_meta[product_id] = (brand_key, category_id)
+    
+    def _uncount(self, product_id):
+        brand_key, category_id = self._product_meta.pop(product_id)
+        if brand_key:
+            self._brand_counts[brand_key] -= 1
+        self._category_counts[category_id] -= 1
+        return brand_key, category_id
+    
+    def _brand_suggestion(self, brand_key):
+        return Suggestion(self._brand_names[brand_key], 'brand', None, self._brand_counts[brand_key])
+    
+    def _category_suggestion(self, category_id):
+        return Suggestion(self._category_names[category_id], 'category', category_id,
+                          self._category_counts.get(category_id, 0))
+    
+    def _remember(self, key, suggestion):
+        self._suggestions[key] = suggestion
+        if suggestion.type == 'product':
+            self._product_keys[suggestion.id] = key
+        elif suggestion.type == 'brand':
+            self._brand_keys[suggestion.text.lower()] = key
+    
+    def _cache_heavy(self, lo, hi, depth):
+        """Cache the top suggestions of every heavy prefix inside ``keys[lo:hi]``.
+
+        The range holds the keys sharing their first ``depth - 1`` characters.
+        It is split by the character at ``depth - 1``, recursing only into
+        children that are still heavy.
+        """
+        while lo < hi:
+            key = self._keys[lo]
+            if len(key) < depth or key[depth - 1] == '\x00':
+                lo += 1
+                continue
+            prefix = key[:depth]
+            end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo, hi)
+            if end - lo > HEAVY_RANGE:
+                self._top[prefix] = self._best(lo, end, MAX_SUGGESTIONS)
+                self._cache_heavy(lo, end, depth + 1)
+            lo = end
+    
+    def _best(self, lo, hi, limit):
+        suggestions = (self._suggestions[self._keys[i]] for i in range(lo, hi))
+        return heapq.nlargest(limit, suggestions, key=_rank)
+    
+    def _insert(self, suggestion):
+        key = _key(suggestion)
+        self._remember(key, suggestion)
+        bisect.insort(self._keys, key)
+        # Merge into the cached lists of the prefixes this key falls under
+        text = key[:key.index('\x00')]
+        for depth in range(1, len(text) + 1):
+            top = self._top.get(text[:depth])
+            if top is None:
+                continue
+            if len(top) < MAX_SUGGESTIONS or _rank(suggestion) > _rank(top[-1]):
+                top.append(suggestion)
+                top.sort(key=_rank, reverse=True)
+                del top[MAX_SUGGESTIONS:]
+    
+    def _delete(self, key):
+        suggestion = self._suggestions.pop(key, None)
+        if suggestion is None:
+            return
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+        # Cached lists that held it are recomputed on their next lookup
+        text = key[:key.index('\x00')]
+        for depth in range(1, len(text) + 1):
+            top = self._top.get(text[:depth])
+            if top is not None and suggestion in top:
+                del self._top[text[:depth]]
+    
+    def _update_products(self, product_ids, version):
+        ids = list(product_ids)
+        brands = set()
+        categories = set()
+        for product_id in ids:
+            key = self._product_keys.pop(product_id, None)
+            if key is not None:
+                self._delete(key)
+            if product_id in self._product_meta:
+                brand_key, category_id = self._uncount(product_id)
+                brands.add(brand_key)
+                categories.add(category_id)
+        for start in range(0, len(ids), 500):
+            rows = self._product_rows(Product.id.in_(ids[start:start + 500]), Product.is_available == True)
+            for product_id, name, rating, brand, category_id in rows:
+                self._insert(Suggestion(name, 'product', product_id, rating or 0.0))
+                self._count(product_id, brand, category_id)
+                brands.add(self._product_meta[product_id][0])
+                categories.add(category_id)
+        
+        # Re-rank the brands and categories whose product counts moved
+        for brand_key in brands - {None}:
+            key = self._brand_keys.pop(brand_key, None)
+            if key is not None:
+                self._delete(key)
+            if self._brand_counts[brand_key] > 0:
+                self._insert(self._brand_suggestion(brand_key))
+            else:
+                del self._brand_counts[brand_key]
+                del self._brand_names[brand_key]
+        for category_id in categories & set(self._category_names):
+            suggestion = self._category_suggestion(category_id)
+            key = _key(suggestion)
+            if self._suggestions.get(key) != suggestion:
+                self._delete(key)
+                self._insert(suggestion)
+        self._version = version
+    
+    # Querying
+    
+    def complete(self, prefix, limit=MAX_SUGGESTIONS):
+        """Best suggestions starting with ``prefix``, case-insensitive"""
+        self.refresh()
+        prefix = prefix.lower()
+        limit = min(limit, MAX_SUGGESTIONS)
+        if not prefix or limit < 1:
+            return []
+        with self._lock:
+            top = self._top.get(prefix)
+            if top is None:
+                lo = bisect.bisect_left(self._keys, prefix)
+                hi = bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo)
+                top = self._best(lo, hi, MAX_SUGGESTIONS)
+                if hi - lo > HEAVY_RANGE:
+                    self._top[prefix] = top
+            return top[:limit]
+
+
+def init_autocomplete(app):
+    """Register the autocomplete index on the app"""
+    app.extensions['autocomplete'] = AutocompleteIndex()
+
+
+def get_autocomplete():
+    """Get the autocomplete index for the current app"""
+    return current_app.extensions['autocomplete']
@@ -0,0 +1,184 @@
+import threading
+from math import ceil
+from flask import current_app
+from models import Product, db
+from utils.catalog_version import get_catalog_version
+from utils.serializers import load_products_in_order
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the SQL path is used without it
+    np = None
+
+
+class _CatalogSnapshot:
+    """Immutable column arrays for the available products at one catalog version"""
+    
+    def __init__(self, rows, version):
+        self.version = version
+        n = len(rows)
+        self.ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=n)
+        self.price = np.fromiter((r.price for r in rows), dtype=np.float64, count=n)
+        # NULL ratings and dates sort first ascending in SQLite, -inf does the same here
+        self.rating = np.fromiter(
+            (r.rating if r.rating is not None else -np.inf for r in rows),
+            dtype=np.float64, count=n
+        )
+        self.category_id = np.fromiter((r.category_id for r in rows), dtype=np.int64, count=n)
+        created_at = np.array(
+            [r.created_at if r.created_at is not None else 'NaT' for r in rows],
+            dtype='datetime64[us]'
+        ).view(np.int64)
+        # NaT is the smallest int64, which cannot be negated for descending order
+        self.created_at = np.maximum(created_at, np.iinfo(np.int64).min + 1)
+        
+        self.brands = sorted({r.brand for r in rows if r.brand})
+        brand_codes = {brand: code for code, brand in enumerate(self.brands)}
+        self.brand_code = np.fromiter(
+            (brand_codes.get(r.brand, -1) for r in rows), dtype=np.int32, count=n
+        )
+        self._brands_lower = [brand.lower() for brand in self.brands]
+        
+        # Stable permutations per sort key and direction, ties broken by id
+        # like SQLite's rowid order. Requests only filter these, no sorting.
+        by_id = np.argsort(self.ids, kind='stable')
+        names = [rows[i].name for i in by_id]
+        self.order = {
+            ('name', 'asc'): by_id[np.array(sorted(range(n), key=names.__getitem__), dtype=np.int64)],
+            ('name', 'desc'): by_id[np.array(sorted(range(n), key=names.__getitem__, reverse=True), dtype=np.int64)],
+        }
+        for key in ('price', 'rating', 'created_at'):
+            column = getattr(self, key)[by_id]
+            self.order[(key, 'asc')] = by_id[np.argsort(column, kind='stable')]
+            self.order[(key, 'desc')] = by_id[np.argsort(-column, kind='stable')]
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def brand_codes_matching(self, brand):
+        """Codes of brands containing ``brand``, the equivalent of ``ilike('%brand%')``"""
+        needle = brand.lower()
+        return np.array(
+            [code for code, name in enumerate(self._brands_lower) if needle in name],
+            dtype=np.int32
+        )
+    
+    def mask(self, category_id=None, min_price=None, max_price=None, brand=None, product_ids=None):
+        """Boolean row mask for the listing filters, ``product_ids`` restricts to a set of ids"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if category_id:
+            mask &= self.category_id == category_id
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if brand:
+            mask &= np.isin(self.brand_code, self.brand_codes_matching(brand))
+        if product_ids is not None:
+            mask &= np.isin(self.ids, np.fromiter(product_ids, dtype=np.int64, count=len(product_ids)))
+        return mask
+    
+    def facets(self, mask, edges):
+        """Brand, category and price bucket counts of the rows in ``mask``.
+
+        Returns ``(brand_counts, category_counts, bucket_counts)`` dicts, each
+        computed with one ``bincount`` over the masked column.
+        """
+        brand_counts = np.bincount(self.brand_code[mask] + 1, minlength=len(self.brands) + 1)[1:]
+        category_counts = np.bincount(self.category_id[mask])
+        buckets = np.searchsorted(np.asarray(edges[1:], dtype=np.float64), self.price[mask], side='right')
+        bucket_counts = np.bincount(buckets, minlength=len(edges))
+        return (
+            {self.brands[code]: int(count) for code, count in enumerate(brand_counts) if count},
+            {category_id: int(count) for category_id, count in enumerate(category_counts) if count},
+            {bucket: int(count) for bucket, count in enumerate(bucket_counts) if count}
+        )
+
+
+class ColumnarCatalog:
+    """In-memory column store answering product listings without SQL.
+
+    Holds the available products as NumPy arrays and rebuilds them from the
+    ``products`` table the first time it is read after the catalog version
+    changed. Only the page of ids that is returned is loaded through the ORM.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+    
+    def snapshot(self):
+        """Get a snapshot that is current with the catalog version"""
+        snapshot = self._snapshot
+        version = get_catalog_version()
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._build(version)
+            return self._snapshot
+    
+    def _build(self, version):
+        rows = db.session.query(
+            Product.id,
+            Product.name,
+            Product.price,
+            Product.rating,
+            Product.category_id,
+            Product.brand,
+            Product.created_at
+        ).filter(Product.is_available == True).all()
+        return _CatalogSnapshot(rows, version)
+    
+    def invalidate(self):
+        """Drop the current snapshot so the next read rebuilds it"""
+        with self._lock:
+            self._snapshot = None
+    
+    def query(self, page=1, per_page=20, category_id=None, min_price=None,
+              max_price=None, brand=None, sort_by='name', sort_order='asc', product_ids=None):
+        """Return ``(product_ids, total)`` for one page of a filtered listing"""
+        snapshot = self.snapshot()
+        mask = snapshot.mask(category_id, min_price, max_price, brand, product_ids)
+        
+        if sort_by not in ('price', 'rating', 'created_at'):
+            sort_by = 'name'
+        order = snapshot.order[(sort_by, 'desc' if sort_order == 'desc' else 'asc')]
+        matched = order[mask[order]]
+        
+        start = (page - 1) * per_page
+        page_rows = matched[start:start + per_page]
+        return snapshot.ids[page_rows].tolist(), int(len(matched))
+    
+    def paginate(self, page=1, per_page=20, **filters):
+        """Load one page of products and pagination info shaped like ``paginate()``"""
+        page = max(page, 1)
+        if per_page < 1:
+            per_page = 20
+        ids, total = self.query(page=page, per_page=per_page, **filters)
+        
+        products = load_products_in_order(ids)
+        pages = ceil(total / per_page) if total else 0
+        return products, {
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'total': total,
+            'has_next': page < pages,
+            'has_prev': page > 1
+        }
+
+
+def init_catalog_engine(app):
+    """Register the columnar engine when ``CATALOG_ENGINE`` is ``columnar``"""
+    if app.config.get('CATALOG_ENGINE') != 'columnar':
+        return
+    if np is None:
+        app.logger.warning('CATALOG_ENGINE=columnar needs numpy, falling back to SQL')
+        return
+    app.extensions['catalog_engine'] = ColumnarCatalog()
+
+
+def get_catalog_engine():
+    """Get the columnar engine for the current app, or None when disabled"""
+    return current_app.extensions.get('catalog_engine')
@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from sqlalchemy import select
+from models import db, Product
+from utils.facets import category_names as load_category_names
+
+# Export columns, in the shape of Product.to_dict()
+EXPORT_FIELDS = [
+    'id', 'name', 'description', 'price', 'category', 'category_id', 'brand', 'image_url',
+    'stock_quantity', 'is_available', 'rating', 'attributes', 'created_at', 'updated_at'
+]
+
+# What the public HTTP export shows: available products, without stock levels
+PUBLIC_EXPORT_FIELDS = [field for field in EXPORT_FIELDS if field != 'stock_quantity']
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 ``updated_since`` value, ``Z`` suffix allowed.
+
+    Timestamps are stored as naive UTC, so an offset is converted to UTC and
+    dropped.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def iter_product_chunks(updated_since=None, available_only=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of at most ``chunk_size`` product dicts from a streaming cursor.
+
+    Rows are read as plain column tuples in fixed-size partitions, so memory
+    stays constant regardless of catalog size. Ordered by id, or by update
+    time with ``updated_since`` so incremental exports read the updated_at
+    index instead of the whole table.
+    """
+    category_names = load_category_names()
+    table = Product.__table__
+    statement = select(table)
+    if updated_since is not None:
+        statement = statement.where(table.c.updated_at >= updated_since).order_by(table.c.updated_at, table.c.id)
+    else:
+        statement = statement.order_by(table.c.id)
+    if available_only:
+        statement = statement.where(table.c.is_available == True)
+    
+    result = db.session.execute(
+        statement,
+        execution_options={'stream_results': True, 'yield_per': chunk_size}
+    )
+    try:
+        for partition in result.mappings().partitions(chunk_size):
+            yield [_row_to_dict(row, category_names) for row in partition]
+    finally:
+        result.close()
+
+
+def _row_to_dict(row, category_names):
+    attributes = row['attributes']
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'description': row['description'],
+        'price': row['price'],
+        'category': category_names.get(row['category_id']),
+        'category_id': row['category_id'],
+        'brand': row['brand'],
+        'image_url': row['image_url'],
+        'stock_quantity': row['stock_quantity'],
+        'is_available': row['is_available'],
+        'rating': row['rating'],
+        'attributes': json.loads(attributes) if attributes else {},
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None
+    }
+
+
+def generate_ndjson(chunks, fields=EXPORT_FIELDS):
+    """Encode product chunks as newline-delimited JSON, one string per chunk"""
+    for chunk in chunks:
+        yield ''.join(
+            json.dumps({field: product[field] for field in fields}, separators=(',', ':')) + '\n'
+            for product in chunk
+        )
+
+
+def generate_csv(chunks, fields=EXPORT_FIELDS):
+    """Encode product chunks as CSV with a header row, attributes as JSON text"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for product in chunk:
+            product['attributes'] = json.dumps(product['attributes'])
+            writer.writerow(product)
+        yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (generate_ndjson, 'application/x-ndjson'),
+    'csv': (generate_csv, 'text/csv')
+}
+
+
+if __name__ == '__main__':
+    # Nightly sync: python -m utils.catalog_export --format ndjson --output catalog.ndjson
+    import argparse
+    import sys
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Stream the product catalog as NDJSON or CSV')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+    parser.add_argument('--updated-since', type=parse_timestamp,
+                        help='only export products updated at or after this ISO timestamp')
+    parser.add_argument('--available-only', action='store_true')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--output', help='file to write, defaults to stdout')
+    args = parser.parse_args()
+    
+    app = create_app()
+    with app.app_context():
+        encode, _ = EXPORT_FORMATS[args.format]
+        chunks = iter_product_chunks(args.updated_since, args.available_only, args.chunk_size)
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for data in encode(chunks):
+                output.write(data)
+        finally:
+            if args.output:
+                output.close()
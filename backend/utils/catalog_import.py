@@ -0,0 +1,331 @@
+import csv
+import json
+import math
+from datetime import datetime
+from models import db, Product, Category
+from utils.catalog_version import record_catalog_change
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+# Columns a row may set besides ``id`` and ``category``/``category_id``
+TEXT_FIELDS = ('name', 'description', 'brand', 'image_url')
+TRUE_VALUES = {'true', '1', 'yes', 'y'}
+FALSE_VALUES = {'false', '0', 'no', 'n'}
+
+
+class RowError(ValueError):
+    """A row that cannot be imported, reported with its line number"""
+
+
+def read_ndjson(stream):
+    """Yield ``(line_number, row)`` from newline-delimited JSON, one line at a time"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError('Each line must be a JSON object')
+            continue
+        yield line_number, row
+
+
+def read_csv(stream):
+    """Yield ``(line_number, row)`` from CSV with a header row; empty cells are omitted"""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {key: value for key, value in row.items() if key and value not in (None, '')}
+
+
+IMPORT_FORMATS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv
+}
+
+
+class CategoryResolver:
+    """Category name to id map, loaded once per import and extended as it goes"""
+    
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self.ids = {name.lower(): category_id for category_id, name in db.session.query(Category.id, Category.name).all()}
+        self.known_ids = set(self.ids.values())
+        self.created = []
+    
+    def resolve(self, row):
+        if 'category_id' in row:
+            category_id = _as_int(row['category_id'], 'category_id')
+            if category_id not in self.known_ids:
+                raise RowError(f'Unknown category_id {category_id}')
+            return category_id
+        
+        name = str(row.get('category') or '').strip()
+        if not name:
+            raise RowError('category or category_id is required')
+        category_id = self.ids.get(name.lower())
+        if category_id is None:
+            if not self.create_missing:
+                raise RowError(f'Unknown category "{name}"')
+            category = Category(name=name)
+            db.session.add(category)
+            db.session.flush()
+            category_id = self.ids[name.lower()] = category.id
+            self.known_ids.add(category_id)
+            self.created.append(name)
+        return category_id
+
+
+def _as_int(value, field):
+    try:
+        if isinstance(value, bool) or float(value) != int(float(value)):
+            raise ValueError
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        raise RowError(f'{field} must be an integer')
+
+
+def _as_float(value, field):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be a number')
+    # float() accepts "nan" and "inf", which no column can store meaningfully
+    if not math.isfinite(number):
+        raise RowError(f'{field} must be a finite number')
+    return number
+
+
+def _as_bool(value, field):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError(f'{field} must be true or false')
+
+
+def validate_row(row, categories):
+    """Turn an input row into column values, raising RowError when it is invalid.
+
+    Only the fields present in the row are returned, so updates leave the
+    other columns alone.
+    """
+    values = {}
+    if row.get('id') not in (None, ''):
+        values['id'] = _as_int(row['id'], 'id')
+        if values['id'] < 1:
+            raise RowError('id must be positive')
+    
+    for field in TEXT_FIELDS:
+        if field in row and row[field] is not None:
+            values[field] = str(row[field]).strip()
+    if 'name' in values and not values['name']:
+        raise RowError('name must not be empty')
+    
+    if 'price' in row:
+        values['price'] = _as_float(row['price'], 'price')
+        if values['price'] < 0:
+            raise RowError('price must not be negative')
+    if 'rating' in row:
+        values['rating'] = _as_float(row['rating'], 'rating')
+        if not 0 <= values['rating'] <= 5:
+            raise RowError('rating must be between 0 and 5')
+    if 'stock_quantity' in row:
+        values['stock_quantity'] = _as_int(row['stock_quantity'], 'stock_quantity')
+        if values['stock_quantity'] < 0:
+            raise RowError('stock_quantity must not be negative')
+    if 'is_available' in row:
+        values['is_available'] = _as_bool(row['is_available'], 'is_available')
+    
+    if 'attributes' in row:
+        attributes = row['attributes']
+        if isinstance(attributes, str):
+            try:
+                attributes = json.loads(attributes) if attributes.strip() else {}
+            except ValueError:
+                raise RowError('attributes must be a JSON object')
+        if not isinstance(attributes, dict):
+            raise RowError('attributes must be a JSON object')
+        values['attributes'] = json.dumps(attributes)
+    
+    if 'category' in row or 'category_id' in row:
+        values['category_id'] = categories.resolve(row)
+    return values
+
+
+class CatalogImporter:
+    """Upsert products from a stream of rows in chunks, one transaction per chunk.
+
+    Rows with an ``id`` that exists update that product, every other row is
+    inserted, so new products need ``name``, ``price`` and a category. Rows
+    bypass the ORM unit of work: inserts are a single executemany per chunk
+    and updates go through ``bulk_update_mappings``.
+    """
+    
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, create_categories=False):
+        self.chunk_size = chunk_size
+        self.categories = CategoryResolver(create_missing=create_categories)
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.categories_created = 0
+        self.errors = []
+    
+    def _error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+    
+    def run(self, rows):
+        """Import ``(line_number, row)`` pairs and return the report"""
+        chunk = {}
+        anonymous = []
+        for line_number, row in rows:
+            if isinstance(row, RowError):
+                self._error(line_number, str(row))
+                continue
+            try:
+                values = validate_row(row, self.categories)
+            except RowError as e:
+                self._error(line_number, str(e))
+                continue
+            if 'id' in values:
+                chunk[values['id']] = (line_number, values)  # the last row for an id wins
+            else:
+                anonymous.append((line_number, values))
+            if len(chunk) + len(anonymous) >= self.chunk_size:
+                self._write(chunk, anonymous)
+                chunk, anonymous = {}, []
+        if chunk or anonymous or self.categories.created:
+            self._write(chunk, anonymous)
+        return self.report()
+    
+    def _existing_ids(self, ids):
+        existing = set()
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            existing.update(
+                product_id for (product_id,) in
+                db.session.query(Product.id).filter(Product.id.in_(ids[start:start + 500])).all()
+            )
+        return existing
+    
+    def _write(self, chunk, anonymous):
+        now = datetime.utcnow()
+        existing = self._existing_ids(chunk)
+        inserts = []
+        updates = []
+        for product_id, (line_number, values) in chunk.items():
+            if product_id in existing:
+                values['updated_at'] = now
+                updates.append(values)
+            else:
+                inserts.append((line_number, values))
+        inserts.extend(anonymous)
+        
+        new_rows = []
+        written_lines = [line_number for line_number, values in chunk.values() if values['id'] in existing]
+        for line_number, values in inserts:
+            missing = [label for field, label in (('name', 'name'), ('price', 'price'), ('category_id', 'category')) if field not in values]
+            if missing:
+                self._error(line_number, f"New products need {', '.join(missing)}")
+                continue
+            written_lines.append(line_number)
+            new_rows.append(dict({
+                'description': None,
+                'brand': None,
+                'image_url': None,
+                'stock_quantity': 0,
+                'is_available': True,
+                'rating': 0.0,
+                'attributes': None,
+                'created_at': now,
+                'updated_at': now
+            }, **values))
+        
+        categories_changed = bool(self.categories.created)
+        try:
+            # Explicit and generated ids go in separate statements so each is one executemany
+            with_ids = [values for values in new_rows if 'id' in values]
+            without_ids = [values for values in new_rows if 'id' not in values]
+            if with_ids:
+                db.session.execute(Product.__table__.insert(), with_ids)
+            if without_ids:
+                db.session.execute(Product.__table__.insert(), without_ids)
+            if updates:
+                db.session.bulk_update_mappings(Product, updates)
+            # Bulk statements skip the session hooks, so record the change in
+            # the chunk's transaction; the server picks it up from the table.
+            # Generated ids are unknown, which makes readers rebuild from scratch.
+            if new_rows or updates or categories_changed:
+                changed_ids = None if without_ids else [values['id'] for values in with_ids + updates]
+                record_catalog_change(changed_ids, categories_changed=categories_changed)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Categories created in this chunk were rolled back with it
+            self.categories = CategoryResolver(self.categories.create_missing)
+            # The driver's message without the statement and its parameters
+            reason = getattr(e, 'orig', None) or e.__class__.__name__
+            for line_number in written_lines:
+                self._error(line_number, f'Chunk rolled back: {reason}')
+            return
+        
+        self.inserted += len(new_rows)
+        self.updated += len(updates)
+        self.categories_created += len(self.categories.created)
+        self.categories.created = []
+    
+    def report(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'categories_created': self.categories_created,
+            'errors': self.errors
+        }
+
+
+def import_products(stream, format='ndjson', chunk_size=DEFAULT_CHUNK_SIZE, create_categories=False):
+    """Stream NDJSON or CSV text from ``stream`` into the catalog and return the report"""
+    if format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported format, use one of: {', '.join(sorted(IMPORT_FORMATS))}")
+    importer = CatalogImporter(chunk_size=chunk_size, create_categories=create_categories)
+    return importer.run(IMPORT_FORMATS[format](stream))
+
+
+if __name__ == '__main__':
+    # Bulk load: python -m utils.catalog_import products.ndjson [--create-categories]
+    import argparse
+    import sys
+    import time
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Bulk import and upsert products from NDJSON or CSV')
+    parser.add_argument('path', help='file to import, - for stdin')
+    parser.add_argument('--format', choices=sorted(IMPORT_FORMATS),
+                        help='defaults to the file extension, ndjson for stdin')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--create-categories', action='store_true',
+                        help='create categories that do not exist instead of rejecting the row')
+    args = parser.parse_args()
+    
+    import_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        if args.path == '-':
+            report = import_products(sys.stdin, import_format, args.chunk_size, args.create_categories)
+        else:
+            with open(args.path, newline='', encoding='utf-8') as stream:
+                report = import_products(stream, import_format, args.chunk_size, args.create_categories)
+        elapsed = time.perf_counter() - started
+        print(json.dumps(report, indent=2))
+        print(f"Imported {report['inserted'] + report['updated']} products in {elapsed:.1f}s")
@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from datetime import datetime
+from flask import has_app_context
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+from models import CatalogChange, Category, Product, db
+
+# The catalog version is the id of the newest row in ``catalog_changes``.
+# Every commit that touches Product or Category rows adds one, whichever
+# process makes it: this server, another worker, the import CLI. In-memory
+# read structures compare the version with the one they were built at and
+# refresh themselves when it moves. Each process reads the version again at
+# most every ``CATALOG_VERSION_POLL`` seconds, its own commits move it at
+# once.
+CHANGELOG_SIZE = 1000  # rows kept, readers further behind rebuild
+DEFAULT_POLL_INTERVAL = 1.0
+
+_changes = CatalogChange.__table__
+_lock = threading.Lock()
+_version = 0
+_checked_at = None
+_poll_interval = DEFAULT_POLL_INTERVAL
+_listeners_installed = False
+
+
+def _read_version():
+    # A connection of its own, so only committed changes count
+    with db.engine.connect() as connection:
+        return connection.execute(select(func.max(_changes.c.id))).scalar() or 0
+
+
+def _advance(version):
+    global _version
+    with _lock:
+        _version = max(_version, version)
+
+
+def get_catalog_version():
+    """Return the current catalog version, read from the database at most once per poll interval"""
+    global _checked_at
+    if not has_app_context():
+        return _version
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= _poll_interval:
+        _checked_at = now
+        _advance(_read_version())
+    return _version
+
+
+def _record(session, product_ids, categories_changed):
+    connection = session.connection()
+    version = connection.execute(insert(_changes).values(
+        product_ids=json.dumps(sorted(product_ids)) if product_ids is not None else None,
+        categories_changed=bool(categories_changed),
+        created_at=datetime.utcnow()
+    )).inserted_primary_key[0]
+    if version % 100 == 0:
+        connection.execute(delete(_changes).where(_changes.c.id <= version - CHANGELOG_SIZE))
+    session.info.setdefault('catalog_versions', []).append(version)
+    return version
+
+
+def record_catalog_change(product_ids=None, categories_changed=False):
+    """Add a catalog change to the transaction of ``db.session`` and return its version.
+
+    ``product_ids`` lists the products that changed, None means unknown.
+    The version moves when the transaction commits. Bulk operations that
+    bypass the ORM unit of work (bulk inserts, Core updates) must call this
+    before committing, or ``bump_catalog_version`` after.
+    """
+    return _record(db.session, product_ids, categories_changed)
+
+
+def bump_catalog_version(product_ids=None, categories_changed=False):
+    """Record a catalog change in a transaction of its own and return the new version"""
+    version = record_catalog_change(product_ids, categories_changed)
+    db.session.commit()
+    return version
+
+
+def changes_since(version):
+    """Get product ids changed after ``version``.
+
+    Returns ``(current_version, product_ids, categories_changed)``. ``product_ids``
+    is None when the changes are unknown or the changelog no longer reaches
+    back to ``version``, in which case callers should rebuild from scratch.
+    """
+    current = get_catalog_version()
+    if version >= current:
+        return current, set(), False
+    
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            select(_changes.c.id, _changes.c.product_ids, _changes.c.categories_changed)
+            .where(_changes.c.id > version, _changes.c.id <= current)
+            .order_by(_changes.c.id)
+            .limit(CHANGELOG_SIZE + 1)
+        ).all()
+    # A gap means pruned rows, or versions skipped by rolled back transactions
+    if not rows or rows[0].id != version + 1 or len(rows) > CHANGELOG_SIZE:
+        return current, None, True
+    
+    product_ids = set()
+    categories_changed = False
+    for _, ids, cats in rows:
+        if ids is None:
+            return current, None, True
+        product_ids.update(json.loads(ids))
+        categories_changed = categories_changed or cats
+    return current, product_ids, categories_changed
+
+
+def _record_flush(session, flush_context):
+    """Add the catalog rows a flush touched to the changelog, in the same transaction"""
+    products = set()
+    categories = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            if obj.id is not None:
+                products.add(obj.id)
+        elif isinstance(obj, Category):
+            categories = True
+    if products or categories:
+        _record(session, products, categories)
+
+
+def _publish_changes(session):
+    """Move this process's version once the recorded changes are committed"""
+    versions = session.info.pop('catalog_versions', None)
+    if versions:
+        _advance(max(versions))
+
+
+def _discard_changes(session):
+    session.info.pop('catalog_versions', None)
+
+
+def install_catalog_listeners():
+    """Attach the session hooks that record catalog changes (idempotent)"""
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(Session, 'after_flush', _record_flush)
+    event.listen(Session, 'after_commit', _publish_changes)
+    event.listen(Session, 'after_rollback', _discard_changes)
+    _listeners_installed = True
+
+
+def init_catalog_version(app):
+    """Install the change listeners and set how often the version is read, from ``CATALOG_VERSION_POLL``"""
+    global _poll_interval
+    _poll_interval = app.config.get('CATALOG_VERSION_POLL', DEFAULT_POLL_INTERVAL)
+    install_catalog_listeners()
@@ -0,0 +1,198 @@
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import func, insert
+from models import ChatMessage, db
+from utils.metrics import render_value
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PUT_TIMEOUT = 1.0  # seconds a request waits for room in a full queue
+DEFAULT_FLUSH_TIMEOUT = 5.0  # seconds a read waits for the user's queued messages
+
+_COLUMNS = [column.name for column in ChatMessage.__table__.columns]
+_STOP = object()
+
+
+class ChatMessageWriter:
+    """Write-behind persistence of chat messages.
+
+    Requests take an id from ``allocate_id``, hand the finished message to
+    ``submit`` and reply without waiting for the database. One background
+    thread drains the queue and inserts whatever has accumulated, up to
+    ``batch_size`` rows, with one executemany and one commit.
+
+    The queue holds at most ``max_queue`` messages. When it is full
+    ``submit`` waits up to ``put_timeout`` seconds for room and then writes
+    the message itself, so a slow database slows requests down rather than
+    growing the queue.
+
+    ``flush`` waits only for the messages of one user, which the writer
+    counts per user, so a steady stream of other users' messages never
+    holds it up.
+
+    Crash safety: a message is durable once its batch commits, normally a
+    few milliseconds after the reply. ``close`` runs at interpreter exit and
+    drains the queue, but messages still queued when the process is killed
+    or crashes are lost, at most ``max_queue`` of them. Ids come from an
+    in-process counter seeded with ``max(id)``, so only one process may
+    write chat messages to a database while write-behind is on.
+    """
+    
+    def __init__(self, app, max_queue=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 put_timeout=DEFAULT_PUT_TIMEOUT):
+        self.app = app
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # queue room freed or messages saved
+        self._pending = defaultdict(int)  # user id -> messages queued and not yet saved
+        self._next_id = None
+        self._thread = None
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+        self.overflows = 0  # messages the request wrote itself, the queue being full or closed
+    
+    def allocate_id(self):
+        """Reserve the id of a new chat message"""
+        with self._lock:
+            if self._next_id is None:
+                self._next_id = (db.session.query(func.max(ChatMessage.id)).scalar() or 0) + 1
+            message_id = self._next_id
+            self._next_id += 1
+            return message_id
+    
+    def submit(self, chat_message):
+        """Queue an unsaved ChatMessage for the background writer, giving it an id first if needed"""
+        if chat_message.id is None:
+            chat_message.id = self.allocate_id()
+        row = {column: getattr(chat_message, column) for column in _COLUMNS}
+        
+        # Enqueued under the lock, so nothing can follow the stop marker of close
+        deadline = time.monotonic() + self.put_timeout
+        with self._changed:
+            if not self._closed and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+                self._thread.start()
+            while not self._closed:
+                try:
+                    self._queue.put_nowait(row)
+                    self._pending[str(row['user_id'])] += 1
+                    return
+                except queue.Full:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+            self.overflows += 1
+        self._write([row])
+    
+    def flush(self, user_id=None, timeout=DEFAULT_FLUSH_TIMEOUT):
+        """Wait until the queued messages of ``user_id``, or of everyone, are saved.
+
+        Returns False when ``timeout`` seconds passed first.
+        """
+        key = None if user_id is None else str(user_id)
+        with self._changed:
+            return self._changed.wait_for(lambda: key not in self._pending if key else not self._pending, timeout)
+    
+    def close(self):
+        """Save the queued messages and stop the background thread"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+    
+    @property
+    def pending(self):
+        return self._queue.qsize()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._changed:
+                self._changed.notify_all()  # room for waiting submits
+            
+            stop = _STOP in batch
+            rows = [row for row in batch if row is not _STOP]
+            if rows:
+                self._write(rows)
+                with self._changed:
+                    for row in rows:
+                        key = str(row['user_id'])
+                        self._pending[key] -= 1
+                        if not self._pending[key]:
+                            del self._pending[key]
+                    self._changed.notify_all()
+            if stop:
+                return
+    
+    def _write(self, rows):
+        """Insert rows in one transaction, one by one if the batch fails"""
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(ChatMessage), rows)
+                db.session.commit()
+                self._count(written=len(rows))
+                return
+            except Exception:
+                db.session.rollback()
+                if len(rows) == 1:
+                    self._count(failed=1)
+                    self.app.logger.exception('Failed to save chat message %s', rows[0]['id'])
+                    return
+            
+            # Keep one bad row from losing the rest of the batch
+            for row in rows:
+                self._write([row])
+    
+    def _count(self, written=0, failed=0):
+        with self._lock:
+            self.written += written
+            self.failed += failed
+
+
+def _writer_metrics(writer):
+    def collect():
+        return '\n'.join([
+            render_value('chat_write_queue_depth', 'Chat messages waiting for the background writer.',
+                         writer.pending, 'gauge'),
+            render_value('chat_messages_written_total', 'Chat messages saved by the writer.', writer.written),
+            render_value('chat_write_failures_total', 'Chat messages that could not be saved.', writer.failed),
+            render_value('chat_write_overflows_total', 'Chat messages saved by the request because the queue was full or closed.',
+                         writer.overflows)
+        ])
+    return collect
+
+
+def init_chat_writer(app):
+    """Register the write-behind chat message writer on the app when ``CHAT_WRITE_BEHIND`` is set"""
+    if not app.config.get('CHAT_WRITE_BEHIND'):
+        app.extensions['chat_writer'] = None
+        return
+    writer = ChatMessageWriter(
+        app,
+        max_queue=app.config.get('CHAT_WRITE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+        batch_size=app.config.get('CHAT_WRITE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    )
+    atexit.register(writer.close)
+    app.extensions['chat_writer'] = writer
+    if 'metrics' in app.extensions:
+        app.extensions['metrics'].collectors.append(_writer_metrics(writer))
+
+
+def get_chat_writer():
+    """Get the chat message writer of the current app, None when messages are saved synchronously"""
+    return current_app.extensions.get('chat_writer')
@@ -1,91 +1,599 @@
+import json
+import os
 import re
 import random
-from models import Product, Category, db
+import threading
+import time
+import zlib
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, intents come from the rules without it
+    np = None
+from flask import current_app
+from models import Product, Category, ChatMessage, db
 from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from utils.serializers import load_products_in_order, preload_categories
+from utils.search_index import get_search_index
+from utils.attribute_index import get_attribute_index, id_filter
+from utils.metrics import stage_timer, observe_stage, render_value
+from utils.response_cache import ResultCache
+from utils.intent_rules import INTENT_PATTERNS, CATEGORY_MAPPING, REFINEMENT_PATTERNS, RuleMatcher
+from utils.catalog_version import get_catalog_version, changes_since
 
-class ChatbotProcessor:
-    """Chatbot logic processor for handling user messages and generating responses"""
-    
-    def __init__(self):
-        self.intent_patterns = {
-            'greeting': [
-                r'\b(hi|hello|hey|good morning|good afternoon|good evening)\b',
-                r'\bhow are you\b',
-                r'\bwhat\'s up\b'
-            ],
-            'product_search': [
-                r'\b(show|find|search|look for|need|want|looking for)\b.*\b(product|item|thing)\b',
-                r'\b(show me|find me|search for|look for)\b',
-                r'\b(laptop|phone|book|shoe|watch|camera|tablet|headphone)\b',
-                r'\bunder \$?\d+\b',
-                r'\bless than \$?\d+\b',
-                r'\bbetween \$?\d+ and \$?\d+\b'
-            ],
-            'price_filter': [
-                r'\bunder \$?(\d+)\b',
-                r'\bless than \$?(\d+)\b',
-                r'\bbetween \$?(\d+) and \$?(\d+)\b',
-                r'\bcheaper than \$?(\d+)\b',
-                r'\bbudget.*\$?(\d+)\b'
-            ],
-            'category_filter': [
-                r'\b(electronics|books|clothing|shoes|accessories|home|sports|beauty|toys)\b',
-                r'\b(smartphone|laptop|tablet|camera|headphone|speaker)\b',
-                r'\b(fiction|non-fiction|novel|textbook|cookbook)\b',
-                r'\b(shirt|pant|dress|jacket|sneaker|boot|sandal)\b'
-            ],
-            'brand_filter': [
-                r'\b(apple|samsung|google|microsoft|sony|nike|adidas|amazon)\b',
-                r'\b(brand|make|manufacturer)\b'
-            ],
-            'recommendation': [
-                r'\b(recommend|suggest|what should|best|top|popular|trending)\b',
-                r'\b(what\'s good|what do you recommend|any suggestions)\b'
-            ],
-            'help': [
-                r'\b(help|how|what can you do|what can I do|commands)\b'
-            ],
-            'goodbye': [
-                r'\b(bye|goodbye|see you|thanks|thank you|that\'s all)\b'
-            ]
-        }
+# Hashed n-gram intent classifier, see IntentClassifier
+INTENT_FEATURES = 2 ** 16  # hash buckets
+INTENT_CONFIDENCE = 0.6  # below this probability the rules decide
+
+# Intents a message can be labelled with in feedback or a curated set
+INTENT_LABELS = tuple(INTENT_PATTERNS)
+
+# Handlers whose responses are kept in the result cache, see ChatbotProcessor._respond
+CACHED_HANDLERS = ('product_search', 'recommendation')
+
+# Result ids remembered per session for follow-ups, and products per page of them
+CONTEXT_CANDIDATES = 50
+PAGE_SIZE = 10
+
+REFINEMENTS = {kind: re.compile(pattern) for kind, pattern in REFINEMENT_PATTERNS.items()}
+
+# General search reads at most GENERAL_SCAN_TERMS distinct words of a
+# message and ranks products by the GENERAL_SEARCH_TERMS rarest of them
+GENERAL_SCAN_TERMS = 64
+GENERAL_SEARCH_TERMS = 8
+
+# Words that say nothing about the product wanted
+STOPWORDS = frozenset("""
+    about after all also and any anything are been but buy can could did does doing for from get give got
+    had has have her him his how into its just know like looking maybe more most much need not now one ones
+    our out please purchase really search see should show some something that the their them then there
+    these they thing things this those too very want was way well were what when where which who why will
+    with would you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def _bucket(gram):
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(gram.encode()) % INTENT_FEATURES
+
+
+@lru_cache(maxsize=65536)
+def _word_features(word):
+    """Buckets of a word and of its character trigrams"""
+    padded = f'<{word}>'
+    return (_bucket(word),) + tuple(_bucket(f'#{padded[i:i + 3]}') for i in range(len(padded) - 2))
+
+
+def intent_features(message):
+    """Hash buckets of the word unigrams, word bigrams and character trigrams of a message"""
+    words = TOKEN_PATTERN.findall(message.lower())
+    features = [_bucket(f'{first} {second}') for first, second in zip(words, words[1:])]
+    for word in words:
+        features.extend(_word_features(word))
+    return features
+
+
+def _feature_matrix(messages):
+    """Sparse rows of the messages as ``(indices, values, offsets, lengths)``.
+
+    Row ``i`` holds ``indices[offsets[i]:offsets[i] + lengths[i]]``; values
+    scale every row to unit length.
+    """
+    rows = [intent_features(message) for message in messages]
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+    offsets = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    indices = np.fromiter((index for row in rows for index in row), dtype=np.int64, count=int(lengths.sum()))
+    values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths).astype(np.float32)
+    return indices, values, offsets, lengths
+
+
+class IntentClassifier:
+    """Linear softmax model over hashed message n-grams.
+
+    Trained offline from stored chat messages (see ``train_from_history``)
+    and scored in batches: the weights of each row's buckets are gathered
+    and summed with one ``reduceat``, so the cost per message is its n-gram
+    count times the number of intents.
+    """
+    
+    def __init__(self, labels, weights, bias):
+        self.labels = list(labels)
+        self.weights = np.asarray(weights, dtype=np.float32)  # features x labels
+        self.bias = np.asarray(bias, dtype=np.float32)
+    
+    def _scores(self, indices, values, offsets, lengths):
+        scores = np.tile(self.bias, (len(lengths), 1))
+        if len(indices):
+            contributions = self.weights[indices] * values[:, None]
+            filled = lengths > 0
+            scores[filled] += np.add.reduceat(contributions, offsets[filled], axis=0)
+        return scores
+    
+    def predict_proba(self, messages):
+        """Intent probabilities, one row per message in ``labels`` order"""
+        if len(messages) == 1:
+            # Skip the batch bookkeeping, which dominates for one message
+            features = intent_features(messages[0])
+            scores = self.bias.copy()
+            if features:
+                scores += self.weights[features].sum(axis=0) / np.float32(np.sqrt(len(features)))
+            scores = scores[None, :]
+        else:
+            scores = self._scores(*_feature_matrix(messages))
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+    
+    def predict(self, messages):
+        """``(intent, probability)`` of the most likely intent of each message"""
+        probabilities = self.predict_proba(messages)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[label], float(probabilities[row, label])) for row, label in enumerate(best)]
+    
+    @classmethod
+    def train(cls, messages, intents, sample_weights=None, epochs=150, learning_rate=0.05, l2=1e-5):
+        """Fit the model with full batch Adam on the weighted cross entropy"""
+        labels = sorted(set(intents))
+        label_index = {label: i for i, label in enumerate(labels)}
+        targets = np.array([label_index[intent] for intent in intents])
+        if sample_weights is None:
+            sample_weights = np.ones(len(messages))
+        sample_weights = np.asarray(sample_weights, dtype=np.float64)
+        sample_weights = sample_weights / sample_weights.sum()
         
-        self.category_mapping = {
-            'electronics': ['laptop', 'phone', 'smartphone', 'tablet', 'camera', 'headphone', 'speaker', 'computer'],
-            'books': ['book', 'novel', 'fiction', 'non-fiction', 'textbook', 'cookbook', 'biography'],
-            'clothing': ['shirt', 'pant', 'dress', 'jacket', 'clothes', 'clothing'],
-            'shoes': ['shoe', 'sneaker', 'boot', 'sandal', 'footwear'],
-            'accessories': ['watch', 'jewelry', 'bag', 'wallet', 'accessory'],
-            'home': ['furniture', 'kitchen', 'bedroom', 'living room', 'home'],
-            'sports': ['sports', 'fitness', 'exercise', 'gym', 'outdoor'],
-            'beauty': ['beauty', 'makeup', 'skincare', 'cosmetics'],
-            'toys': ['toy', 'game', 'kids', 'children', 'baby']
-        }
+        indices, values, offsets, lengths = _feature_matrix(messages)
+        rows = np.repeat(np.arange(len(messages)), lengths)
+        model = cls(labels, np.zeros((INTENT_FEATURES, len(labels))), np.zeros(len(labels)))
+        parameters = [model.weights, model.bias]
+        moments = [(np.zeros_like(p), np.zeros_like(p)) for p in parameters]
+        
+        for step in range(1, epochs + 1):
+            scores = model._scores(indices, values, offsets, lengths)
+            scores -= scores.max(axis=1, keepdims=True)
+            probabilities = np.exp(scores)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            probabilities[np.arange(len(targets)), targets] -= 1
+            errors = probabilities * sample_weights[:, None]
+            
+            weight_gradient = np.empty_like(model.weights)
+            for label in range(len(labels)):
+                weight_gradient[:, label] = np.bincount(
+                    indices, weights=values * errors[rows, label], minlength=INTENT_FEATURES
+                )
+            weight_gradient += l2 * model.weights
+            gradients = [weight_gradient, errors.sum(axis=0)]
+            
+            for parameter, gradient, (mean, variance) in zip(parameters, gradients, moments):
+                mean *= 0.9
+                mean += 0.1 * gradient
+                variance *= 0.999
+                variance += 0.001 * gradient * gradient
+                corrected_mean = mean / (1 - 0.9 ** step)
+                corrected_variance = variance / (1 - 0.999 ** step)
+                parameter -= learning_rate * corrected_mean / (np.sqrt(corrected_variance) + 1e-8)
+        return model
+    
+    def save(self, path):
+        np.savez_compressed(path, labels=np.array(self.labels), weights=self.weights, bias=self.bias)
+    
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['labels'].tolist(), data['weights'], data['bias'])
+
+
+def read_labelled(path):
+    """``(message, intent)`` pairs from an NDJSON file of {"message": ..., "intent": ...} lines"""
+    pairs = []
+    with open(path, encoding='utf-8') as stream:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get('intent') not in INTENT_LABELS:
+                raise ValueError(f'{path}:{line_number}: unknown intent {row.get("intent")!r}')
+            pairs.append((row['message'], row['intent']))
+    return pairs
+
+
+def training_data(min_rating=3, labelled=()):
+    """Messages, intents and sample weights confirmed by users, plus ``labelled`` pairs.
+
+    ``ChatMessage.intent`` is what the chatbot decided, so it only becomes
+    a label once feedback confirms it: an explicit ``intent`` in the
+    feedback is used whatever the rating, otherwise the stored intent of a
+    message rated ``min_rating`` or better, if it is one of ``INTENT_LABELS``
+    (follow-ups are stored as ``refinement``, which the model cannot
+    predict). Confirmed ratings above
+    ``min_rating``, corrections and curated pairs count double. Messages
+    without feedback are left out, training on them would only copy the
+    rules and the model's own earlier predictions.
+    """
+    messages, intents, weights = [], [], []
+    rows = db.session.query(ChatMessage.message, ChatMessage.intent, ChatMessage.entities).filter(
+        ChatMessage.entities.like('%"feedback"%')
+    ).yield_per(5000)
+    for message, intent, entities in rows:
+        try:
+            feedback = json.loads(entities).get('feedback') or {}
+            rating = feedback.get('rating')
+        except (ValueError, AttributeError):
+            continue
+        if feedback.get('intent') in INTENT_LABELS:
+            intent, weight = feedback['intent'], 2.0
+        elif intent in INTENT_LABELS and rating is not None and rating >= min_rating:
+            weight = 2.0 if rating > min_rating else 1.0
+        else:
+            continue
+        messages.append(message)
+        intents.append(intent)
+        weights.append(weight)
+    
+    for message, intent in labelled:
+        messages.append(message)
+        intents.append(intent)
+        weights.append(2.0)
+    return messages, intents, weights
+
+
+def train_from_history(min_rating=3, labelled=(), **options):
+    """Train an IntentClassifier on confirmed chat history and curated labels"""
+    messages, intents, weights = training_data(min_rating, labelled)
+    if len(set(intents)) < 2:
+        raise ValueError('Training needs confirmed messages with at least two intents')
+    return IntentClassifier.train(messages, intents, weights, **options)
+
+
+class ChatbotProcessor:
+    """Chatbot logic processor for handling user messages and generating responses.
+
+    One processor serves the whole app, see ``init_chatbot``. Messages are
+    processed with local state only, so it is safe to share between
+    threads. The compiled rules are swapped with ``reload_rules``, the
+    intent classifier with ``load_classifier``, and the category map
+    follows the catalog version. Product search and recommendation
+    responses are kept in ``results`` until the catalog changes.
+
+    ``contexts`` remembers, per user and session, the entities and the ids of up to
+    ``CONTEXT_CANDIDATES`` results of the last catalog answer. Follow-ups
+    such as "cheaper ones", "only Apple" or "show more" filter or page
+    through those ids in memory, and only the products shown are loaded.
+    """
+    
+    def __init__(self, classifier=None, confidence=INTENT_CONFIDENCE, result_cache=None, context_store=None):
+        self.intent_patterns = INTENT_PATTERNS
+        self.category_mapping = CATEGORY_MAPPING
+        self.rules = RuleMatcher(self.intent_patterns, category_mapping=self.category_mapping)
+        self.classifier = classifier
+        self.confidence = confidence
+        self._lock = threading.Lock()
+        self._version = None
+        self._categories = []  # (id, name) in id order
+        self._category_matches = {}  # lower entity category -> (id, name) or None
+        self.results = result_cache if result_cache is not None else ResultCache(0)
+        self.contexts = context_store if context_store is not None else ResultCache(0)
+    
+    # Maintenance
+    
+    def reload_rules(self, intent_patterns=None, category_mapping=None):
+        """Compile new intent patterns or category keywords and start using them"""
+        rules = RuleMatcher(intent_patterns or self.intent_patterns,
+                            category_mapping=category_mapping or self.category_mapping)
+        self.intent_patterns = intent_patterns or self.intent_patterns
+        self.category_mapping = category_mapping or self.category_mapping
+        self.rules = rules
+    
+    def load_classifier(self, path):
+        """Start classifying intents with the model saved at ``path``"""
+        self.classifier = IntentClassifier.load(path)
+    
+    def refresh(self):
+        """Reload the category map if categories changed since it was loaded"""
+        if self._version == get_catalog_version():
+            return
+        with self._lock:
+            if self._version is not None:
+                version, product_ids, categories_changed = changes_since(self._version)
+                if product_ids is not None and not categories_changed:
+                    self._version = version
+                    return
+            version = get_catalog_version()
+            self._categories = db.session.query(Category.id, Category.name).order_by(Category.id).all()
+            self._category_matches = {}
+            self._version = version
+    
+    def find_category(self, name):
+        """``(id, name)`` of the first category whose name contains ``name``, case-insensitive"""
+        self.refresh()
+        key = name.lower()
+        with self._lock:
+            if key not in self._category_matches:
+                self._category_matches[key] = next(
+                    ((category_id, category_name) for category_id, category_name in self._categories
+                     if key in category_name.lower()),
+                    None
+                )
+            return self._category_matches[key]
     
-    def process_message(self, message, user_id):
+    # Messages
+    
+    def process_message(self, message, user_id, session_id=None):
         """Process user message and return appropriate response"""
         message_lower = message.lower()
+        intent, entities = self._understand(message_lower)
+        intent, entities, events = self._reply(message_lower, intent, entities, user_id, session_id)
+        return self._result(intent, entities, self._collect(events))
+    
+    def stream_message(self, message, user_id, session_id=None):
+        """Process a message in steps, yielding ``(event, data)`` as each part is ready.
+
+        ``meta`` carries the intent and entities before any query runs,
+        ``text`` the reply text, then one ``product`` event per serialized
+        product card. The last event, ``result``, is what ``process_message``
+        would have returned.
+        """
+        message_lower = message.lower()
+        intent, entities = self._understand(message_lower)
+        intent, entities, events = self._reply(message_lower, intent, entities, user_id, session_id)
+        yield 'meta', {'intent': intent, 'entities': entities}
         
-        # Detect intent
-        intent = self._detect_intent(message_lower)
+        collected = []
+        for event in events:
+            collected.append(event)
+            if event[0] != 'candidates':
+                yield event
+        yield 'result', self._result(intent, entities, self._collect(collected))
+    
+    def _understand(self, message):
+        """Intent and entities of a lowercased message"""
+        # Detect intent, the same scan finds the price, category and brand
+        with stage_timer('intent'):
+            rules = self.rules.match(message)
+            intent = self._classify(message, rules.intent)
         
         # Extract entities
-        entities = self._extract_entities(message_lower)
-        
-        # Generate response based on intent
-        if intent == 'greeting':
-            response = self._handle_greeting()
-        elif intent == 'product_search':
-            response = self._handle_product_search(entities)
-        elif intent == 'recommendation':
-            response = self._handle_recommendation(entities)
-        elif intent == 'help':
-            response = self._handle_help()
-        elif intent == 'goodbye':
-            response = self._handle_goodbye()
-        else:
-            response = self._handle_general_search(message_lower)
+        with stage_timer('entities'):
+            entities = self._extract_entities(message, rules)
+        return intent, entities
+    
+    def process_messages(self, messages, user_id):
+        """Process many messages at once and return their results in order.
+
+        Intents are classified as one batch, and messages that go to the same
+        handler with the same filters share one response, so a search
+        repeated in the batch runs its queries once.
+        """
+        lowered = [message.lower() for message in messages]
+        with stage_timer('intent'):
+            rules = [self.rules.match(message) for message in lowered]
+            intents = self._classify_batch(lowered, [match.intent for match in rules])
+        with stage_timer('entities'):
+            entities = [self._extract_entities(message, match) for message, match in zip(lowered, rules)]
+        
+        shared = {}
+        results = []
+        for message, intent, message_entities in zip(lowered, intents, entities):
+            handler = self._handler(intent, message_entities)
+            key = self._response_key(handler, message_entities, message)
+            if key is None:
+                response = self._respond(handler, message_entities, message)
+            elif key in shared:
+                response = shared[key]
+            else:
+                response = shared[key] = self._respond(handler, message_entities, message)
+            results.append(self._result(intent, message_entities, response))
+        return results
+    
+    def _reply(self, message, intent, entities, user_id, session_id):
+        """Intent, entities and response events of a message, refining the session's last answer if it asks to"""
+        # Session ids come from the client, so a context belongs to the user as well
+        context_key = (str(user_id), session_id) if session_id else None
+        context = self.contexts.get(context_key, None) if context_key else None
+        kind = self._refinement(message, entities, context)
+        if kind:
+            entities = self._refined_entities(kind, entities, context)
+            events = self._refinement_events(kind, entities, context)
+            return 'refinement', entities, self._remember(context_key, entities, events)
+        events = self._response_events(self._handler(intent, entities), entities, message)
+        return intent, entities, self._remember(context_key, entities, events)
+    
+    def _remember(self, context_key, entities, events):
+        """Pass the events on, then keep a catalog answer's candidates as the session's context"""
+        candidates = None
+        shown = []
+        for event in events:
+            if event[0] == 'candidates':
+                candidates = event[1]
+            elif event[0] == 'product':
+                shown.append(event[1]['id'])
+            yield event
+        
+        if context_key and candidates is not None:
+            # Contexts do not follow the catalog version, refinements look
+            # their candidates up in the search index, which does
+            self.contexts.put(context_key, None, {
+                'entities': entities,
+                'candidates': candidates,
+                'shown': shown,
+                'offset': candidates.index(shown[-1]) + 1 if shown else len(candidates)
+            })
+    
+    def _refinement(self, message, entities, context):
+        """How ``message`` refines the session's last answer: 'more', 'cheaper', 'filter' or None"""
+        if context is None or not context['candidates']:
+            return None
+        category = entities.get('category')
+        if category and category != context['entities'].get('category'):
+            return None  # a new question
+        if REFINEMENTS['more'].search(message):
+            return 'more'
+        has_price = 'min_price' in entities or 'max_price' in entities
+        if REFINEMENTS['cheaper'].search(message):
+            return 'filter' if has_price else 'cheaper'
+        if REFINEMENTS['only'].search(message) and (has_price or 'brand' in entities):
+            return 'filter'
+        return None
+    
+    def _refined_entities(self, kind, entities, context):
+        """The session's last entities with the price and brand of a refinement applied"""
+        refined = dict(context['entities'])
+        refined['refinement'] = kind
+        if kind == 'filter':
+            refined.update((name, entities[name]) for name in ('min_price', 'max_price', 'brand') if name in entities)
+        elif kind == 'cheaper':
+            # Cheaper than the average of the products just shown
+            prices = [price for price, _, _ in get_search_index().lookup(context['shown']).values()]
+            if prices:
+                refined['max_price'] = round(sum(prices) / len(prices), 2)
+        return refined
+    
+    def _refinement_events(self, kind, entities, context):
+        """Response events of a refinement, filtering or paging the session's candidate ids"""
+        with stage_timer('query'):
+            facts = get_search_index().lookup(context['candidates'])
+            candidates = [product_id for product_id in context['candidates'] if product_id in facts]
+            if kind == 'more':
+                page = candidates[context['offset']:context['offset'] + PAGE_SIZE]
+            else:
+                brand = entities.get('brand', '').lower()
+                min_price = entities.get('min_price')
+                max_price = entities.get('max_price')
+                candidates = [
+                    product_id for product_id in candidates
+                    if (min_price is None or facts[product_id][0] >= min_price)
+                    and (max_price is None or facts[product_id][0] <= max_price)
+                    and brand in facts[product_id][1]
+                ]
+                if kind == 'cheaper':
+                    candidates.sort(key=lambda product_id: facts[product_id][0])
+                page = candidates[:PAGE_SIZE]
+            products = load_products_in_order(page)
         
+        with stage_timer('render'):
+            if kind == 'more' and not products:
+                reply = {'text': "That's everything I found for your last search. "
+                                 "Try a new search or ask me for recommendations!"}
+            else:
+                reply = self._render_search_results(products, self._refinement_info(kind, entities))
+        reply['candidates'] = candidates
+        yield from self._reply_events(reply)
+    
+    def _refinement_info(self, kind, entities):
+        """Description of a refinement's filters for the reply text"""
+        if kind == 'more':
+            return ['more results']
+        search_info = []
+        if 'brand' in entities:
+            search_info.append(f"brand: {entities['brand']}")
+        if 'min_price' in entities:
+            search_info.append(f"over ${entities['min_price']}")
+        if 'max_price' in entities:
+            search_info.append(f"under ${entities['max_price']}")
+        return search_info
+    
+    def _handler(self, intent, entities):
+        """Name of the handler that answers a message"""
+        if intent in ('greeting', 'product_search', 'recommendation', 'help', 'goodbye'):
+            return intent
+        if 'attributes' in entities:
+            # Attribute mentions ("256gb", "size 10") are product searches
+            return 'product_search'
+        return 'general'
+    
+    def _respond(self, handler, entities, message):
+        """Generate the response of a handler"""
+        return self._collect(self._response_events(handler, entities, message))
+    
+    def _collect(self, events):
+        """Response assembled from ``_response_events``"""
+        response = {}
+        for event, data in events:
+            if event == 'product':
+                response.setdefault('products', []).append(data)
+            else:
+                response[event] = data
+        return response
+    
+    def _response_events(self, handler, entities, message):
+        """Yield ``('text', text)``, ``('candidates', ids)`` of a catalog answer, then ``('product', card)`` per product.
+
+        Catalog answers go through the result cache, products are
+        serialized one at a time so a stream can send each as it is ready.
+        """
+        key = version = None
+        if handler in CACHED_HANDLERS and self.results.max_entries:
+            # Read the version first, so a change during the query leaves the
+            # response stored at the version it may already be stale for
+            key = self._response_key(handler, entities, message)
+            version = get_catalog_version()
+            response = self.results.get(key, version)
+            if response is not None:
+                yield 'text', response['text']
+                if 'candidates' in response:
+                    yield 'candidates', response['candidates']
+                for card in response.get('products', []):
+                    yield 'product', card
+                return
+        
+        response = yield from self._reply_events(self._compose(handler, entities, message))
+        if key is not None:
+            self.results.put(key, version, response)
+    
+    def _reply_events(self, reply):
+        """Yield the events of a composed reply, return the response with its products serialized"""
+        response = {'text': reply['text']}
+        yield 'text', reply['text']
+        if 'candidates' in reply:
+            response['candidates'] = reply['candidates']
+            yield 'candidates', reply['candidates']
+        
+        products = reply.get('products') or []
+        if products:
+            cards = response['products'] = []
+            start = time.perf_counter()
+            preload_categories(products)
+            elapsed = time.perf_counter() - start
+            for product in products:
+                start = time.perf_counter()
+                card = product.to_dict()
+                elapsed += time.perf_counter() - start
+                cards.append(card)
+                yield 'product', card
+            observe_stage('serialize', elapsed)
+        return response
+    
+    def _compose(self, handler, entities, message):
+        """Reply of a handler, ``products`` holding Product rows yet to be serialized"""
+        if handler == 'greeting':
+            return self._handle_greeting()
+        elif handler == 'product_search':
+            return self._handle_product_search(entities)
+        elif handler == 'recommendation':
+            return self._handle_recommendation(entities)
+        elif handler == 'help':
+            return self._handle_help()
+        elif handler == 'goodbye':
+            return self._handle_goodbye()
+        return self._handle_general_search(message)
+    
+    def _response_key(self, handler, entities, message):
+        """Everything a catalog handler's response depends on, None for the canned replies"""
+        if handler == 'product_search':
+            return (handler, entities.get('category'), entities.get('min_price'), entities.get('max_price'),
+                    entities.get('brand'), tuple(entities.get('attributes', ())), entities.get('search_term'),
+                    tuple(entities.get('search_terms', ())))
+        if handler == 'recommendation':
+            return (handler, entities.get('category'), entities.get('max_price'))
+        if handler == 'general':
+            return (handler, tuple(self._general_terms(message)))
+        return None
+    
+    def _result(self, intent, entities, response):
         return {
             'response': response['text'],
             'intent': intent,
@@ -95,51 +603,37 @@ class ChatbotProcessor:
     
     def _detect_intent(self, message):
         """Detect user intent from message"""
-        for intent, patterns in self.intent_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, message, re.IGNORECASE):
-                    return intent
-        return 'general'
+        return self._classify(message, self.rules.match(message).intent)
     
-    def _extract_entities(self, message):
-        """Extract entities from user message"""
-        entities = {}
-        
-        # Extract price range
-        price_patterns = [
-            (r'under \$?(\d+)', 'max_price'),
-            (r'less than \$?(\d+)', 'max_price'),
-            (r'cheaper than \$?(\d+)', 'max_price'),
-            (r'budget.*\$?(\d+)', 'max_price'),
-            (r'between \$?(\d+) and \$?(\d+)', 'price_range'),
-            (r'from \$?(\d+) to \$?(\d+)', 'price_range')
+    def _classify(self, message, rule_intent):
+        """The classifier's intent when it is confident enough, the rules' otherwise"""
+        classifier = self.classifier
+        if classifier is None:
+            return rule_intent
+        intent, probability = classifier.predict([message])[0]
+        return intent if probability >= self.confidence else rule_intent
+    
+    def _classify_batch(self, messages, rule_intents):
+        """``_classify`` for many messages with one classifier call"""
+        classifier = self.classifier
+        if classifier is None or not messages:
+            return list(rule_intents)
+        return [
+            intent if probability >= self.confidence else rule_intent
+            for (intent, probability), rule_intent in zip(classifier.predict(messages), rule_intents)
         ]
+    
+    def _extract_entities(self, message, rules=None):
+        """Extract entities from user message"""
+        # Price, category and brand from the rules
+        if rules is None:
+            rules = self.rules.match(message)
+        entities = dict(rules.entities)
         
-        for pattern, entity_type in price_patterns:
-            match = re.search(pattern, message, re.IGNORECASE)
-            if match:
-                if entity_type == 'price_range':
-                    entities['min_price'] = float(match.group(1))
-                    entities['max_price'] = float(match.group(2))
-                else:
-                    entities[entity_type] = float(match.group(1))
-                break
-        
-        # Extract category
-        for category, keywords in self.category_mapping.items():
-            for keyword in keywords:
-                if re.search(r'\b' + keyword + r'\b', message, re.IGNORECASE):
-                    entities['category'] = category
-                    entities['search_term'] = keyword
-                    break
-            if 'category' in entities:
-                break
-        
-        # Extract brand
-        brand_pattern = r'\b(apple|samsung|google|microsoft|sony|nike|adidas|amazon|hp|dell|asus|lenovo)\b'
-        brand_match = re.search(brand_pattern, message, re.IGNORECASE)
-        if brand_match:
-            entities['brand'] = brand_match.group(1).title()
+        # Extract product attributes ("256gb", "noise canceling", "size 10")
+        attributes = get_attribute_index().extract(message)
+        if attributes:
+            entities['attributes'] = attributes
         
         # Extract general search terms
         search_terms = []
@@ -205,19 +699,29 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
     
     def _handle_product_search(self, entities):
         """Handle product search with entities"""
+        with stage_timer('query'):
+            products, search_info, candidates = self._search_products(entities)
+        
+        with stage_timer('render'):
+            reply = self._render_search_results(products, search_info)
+        reply['candidates'] = candidates
+        return reply
+    
+    def _search_products(self, entities):
+        """Find up to 10 products matching the entities, a description of the filters and the ids of more matches"""
         # Build search query
-        query = Product.query.filter(Product.is_available == True)
+        query = Product.query.options(joinedload(Product.category)).filter(Product.is_available == True)
         
         search_info = []
+        category_id = None
         
         # Apply category filter
         if 'category' in entities:
-            category = Category.query.filter(
-                func.lower(Category.name).like(f"%{entities['category'].lower()}%")
-            ).first()
+            category = self.find_category(entities['category'])
             if category:
-                query = query.filter(Product.category_id == category.id)
-                search_info.append(f"category: {category.name}")
+                category_id, category_name = category
+                query = query.filter(Product.category_id == category_id)
+                search_info.append(f"category: {category_name}")
         
         # Apply price filters
         if 'max_price' in entities:
@@ -236,6 +740,13 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
             query = query.filter(Product.brand.ilike(f"%{entities['brand']}%"))
             search_info.append(f"brand: {entities['brand']}")
         
+        # Apply attribute filters, every mentioned attribute must match
+        product_ids = None
+        if 'attributes' in entities:
+            index = get_attribute_index()
+            product_ids = index.product_ids([index.phrase_pairs(phrase) for phrase in entities['attributes']])
+            search_info.append(f"with: {', '.join(entities['attributes'])}")
+        
         # Apply text search
         search_terms = []
         if 'search_term' in entities:
@@ -244,22 +755,37 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
             search_terms.extend(entities['search_terms'])
         
         if search_terms:
-            search_filter = or_(*[
-                or_(
-                    Product.name.ilike(f'%{term}%'),
-                    Product.description.ilike(f'%{term}%')
-                ) for term in search_terms
-            ])
-            query = query.filter(search_filter)
             search_info.append(f"matching: {', '.join(search_terms)}")
+            
+            # Rank text matches with the search index, which applies the
+            # other filters as well
+            results = get_search_index().search(
+                search_terms,
+                match='any',
+                limit=CONTEXT_CANDIDATES,
+                category_id=category_id,
+                min_price=entities.get('min_price'),
+                max_price=entities.get('max_price'),
+                brand=entities.get('brand'),
+                product_ids=product_ids
+            )
+            candidates = [product_id for product_id, _ in results]
+            products = load_products_in_order(candidates[:PAGE_SIZE])
         
-        # Execute query and get results
-        products = query.order_by(Product.rating.desc(), Product.name).limit(10).all()
+        # Without search terms, or when they match nothing but attributes were
+        # given, list the filtered products by rating
+        if not search_terms or (not products and product_ids):
+            if product_ids is not None:
+                query = query.filter(id_filter(product_ids))
+            products = query.order_by(Product.rating.desc(), Product.name).limit(CONTEXT_CANDIDATES).all()
+            candidates = [product.id for product in products]
+            products = products[:PAGE_SIZE]
         
-        # Generate response
+        return products, search_info, candidates
+    
+    def _render_search_results(self, products, search_info):
+        """Generate the product search reply"""
         if products:
-            product_list = [product.to_dict() for product in products]
-            
             if search_info:
                 search_description = " (" + ", ".join(search_info) + ")"
             else:
@@ -282,7 +808,7 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
             
             return {
                 'text': response_text.strip(),
-                'products': product_list
+                'products': products
             }
         else:
             response_text = "I couldn't find any products matching your criteria"
@@ -298,25 +824,30 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
     
     def _handle_recommendation(self, entities):
         """Handle recommendation requests"""
-        # Get top-rated products
-        query = Product.query.filter(Product.is_available == True)
-        
-        # Apply any filters from entities
-        if 'category' in entities:
-            category = Category.query.filter(
-                func.lower(Category.name).like(f"%{entities['category'].lower()}%")
-            ).first()
-            if category:
-                query = query.filter(Product.category_id == category.id)
+        with stage_timer('query'):
+            # Get top-rated products
+            query = Product.query.options(joinedload(Product.category)).filter(Product.is_available == True)
+            
+            # Apply any filters from entities
+            if 'category' in entities:
+                category = self.find_category(entities['category'])
+                if category:
+                    query = query.filter(Product.category_id == category[0])
         
-        if 'max_price' in entities:
-            query = query.filter(Product.price <= entities['max_price'])
+            if 'max_price' in entities:
+                query = query.filter(Product.price <= entities['max_price'])
         
-        products = query.order_by(Product.rating.desc(), Product.name).limit(8).all()
+            products = query.order_by(Product.rating.desc(), Product.name).limit(CONTEXT_CANDIDATES).all()
+            candidates = [product.id for product in products]
         
+        with stage_timer('render'):
+            reply = self._render_recommendations(products[:8])
+        reply['candidates'] = candidates
+        return reply
+    
+    def _render_recommendations(self, products):
+        """Generate the recommendation reply"""
         if products:
-            product_list = [product.to_dict() for product in products]
-            
             response_text = f"Here are my top recommendations for you:\n\n"
             
             for i, product in enumerate(products[:4], 1):  # Show top 4 in text
@@ -330,51 +861,51 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
             
             return {
                 'text': response_text,
-                'products': product_list
+                'products': products
             }
         else:
             return {
                 'text': "I'm sorry, I couldn't find any products to recommend at the moment. Please try searching for specific items!"
             }
     
+    def _general_terms(self, message):
+        """Potential product terms of a message, the first ``GENERAL_SCAN_TERMS`` distinct ones"""
+        terms = []
+        for match in re.finditer(r'\b\w+\b', message.lower()):
+            word = match.group()
+            if len(word) > 2 and not word.isdigit() and word not in STOPWORDS and word not in terms:
+                terms.append(word)
+                if len(terms) == GENERAL_SCAN_TERMS:
+                    break
+        return terms
+    
     def _handle_general_search(self, message):
         """Handle general search when intent is unclear"""
         # Extract potential product terms
-        words = re.findall(r'\b\w+\b', message.lower())
-        search_terms = [word for word in words if len(word) > 2 and not re.match(r'^\d+$', word)]
+        search_terms = self._general_terms(message)
         
         if search_terms:
-            # Search products using extracted terms
-            search_filter = or_(*[
-                or_(
-                    Product.name.ilike(f'%{term}%'),
-                    Product.description.ilike(f'%{term}%'),
-                    Product.brand.ilike(f'%{term}%')
-                ) for term in search_terms
-            ])
+            with stage_timer('query'):
+                # Search products using the most selective terms, best matches
+                # first, so the cost does not grow with the message
+                index = get_search_index()
+                terms = index.select_terms(search_terms, GENERAL_SEARCH_TERMS)
+                results = index.search(terms, match='any', limit=CONTEXT_CANDIDATES) if terms else []
             
-            products = Product.query.filter(
-                and_(Product.is_available == True, search_filter)
-            ).order_by(Product.rating.desc()).limit(8).all()
+                # Nothing matched, retry once with misspelled terms corrected
+                corrected_query = None
+                if not results:
+                    corrected_query = index.correct(search_terms[:GENERAL_SEARCH_TERMS])
+                    if corrected_query:
+                        results = index.search(corrected_query, match='any', limit=CONTEXT_CANDIDATES)
+                candidates = [product_id for product_id, _ in results]
+                products = load_products_in_order(candidates[:8])
             
             if products:
-                product_list = [product.to_dict() for product in products]
-                
-                response_text = f"I found some products that might interest you:\n\n"
-                
-                for i, product in enumerate(products[:3], 1):
-                    response_text += f"{i}. **{product.name}** - ${product.price:.2f}\n"
-                    response_text += f"   {'⭐' * int(product.rating)} ({product.rating}/5)\n\n"
-                
-                response_text += "Is this what you were looking for? You can also try:\n"
-                response_text += "• Being more specific: 'Show me laptops under $800'\n"
-                response_text += "• Asking for recommendations: 'What's popular?'\n"
-                response_text += "• Getting help: 'What can you do?'"
-                
-                return {
-                    'text': response_text,
-                    'products': product_list
-                }
+                with stage_timer('render'):
+                    reply = self._render_general_results(products, corrected_query)
+                reply['candidates'] = candidates
+                return reply
         
         # Fallback response
         fallback_responses = [
@@ -384,3 +915,106 @@ Just ask me naturally, like you would ask a friend! What would you like to find?
         ]
         
         return {'text': random.choice(fallback_responses)}
+    
+    def _render_general_results(self, products, corrected_query):
+        """Generate the reply listing general search matches"""
+        if corrected_query:
+            response_text = f"Showing results for \"{corrected_query}\". I found some products that might interest you:\n\n"
+        else:
+            response_text = f"I found some products that might interest you:\n\n"
+        
+        for i, product in enumerate(products[:3], 1):
+            response_text += f"{i}. **{product.name}** - ${product.price:.2f}\n"
+            response_text += f"   {'⭐' * int(product.rating)} ({product.rating}/5)\n\n"
+        
+        response_text += "Is this what you were looking for? You can also try:\n"
+        response_text += "• Being more specific: 'Show me laptops under $800'\n"
+        response_text += "• Asking for recommendations: 'What's popular?'\n"
+        response_text += "• Getting help: 'What can you do?'"
+        
+        return {
+            'text': response_text,
+            'products': products
+        }
+
+
+def _result_cache_metrics(cache):
+    def collect():
+        stats = cache.stats()
+        return '\n'.join([
+            render_value('chatbot_result_cache_hits_total', 'Chatbot responses served from the result cache.',
+                         stats['hits']),
+            render_value('chatbot_result_cache_misses_total', 'Chatbot responses computed on a cache miss.',
+                         stats['misses']),
+            render_value('chatbot_result_cache_evictions_total', 'Least recently used results evicted.',
+                         stats['evictions']),
+            render_value('chatbot_result_cache_entries', 'Results currently cached.', stats['entries'], 'gauge')
+        ])
+    return collect
+
+
+def init_chatbot(app):
+    """Register the shared chatbot processor on the app, with the trained intent model if there is one"""
+    result_cache = ResultCache(app.config.get('CHAT_CACHE_SIZE', 1024), app.config.get('CHAT_CACHE_TTL', 300))
+    context_store = ResultCache(app.config.get('CHAT_CONTEXT_SIZE', 10000), app.config.get('CHAT_CONTEXT_TTL', 1800))
+    processor = ChatbotProcessor(confidence=app.config.get('INTENT_CONFIDENCE', INTENT_CONFIDENCE),
+                                 result_cache=result_cache, context_store=context_store)
+    model_path = app.config.get('INTENT_MODEL_PATH')
+    if model_path and os.path.exists(model_path):
+        if np is None:
+            app.logger.warning('The intent model needs numpy, classifying with the rules only')
+        else:
+            processor.load_classifier(model_path)
+    app.extensions['chatbot'] = processor
+    if 'metrics' in app.extensions:
+        app.extensions['metrics'].collectors.append(_result_cache_metrics(result_cache))
+
+
+def get_chatbot():
+    """Get the chatbot processor for the current app"""
+    return current_app.extensions['chatbot']
+
+
+if __name__ == '__main__':
+    # Retrain the intent model: python -m utils.chatbot_logic [--labels labelled.ndjson] [--output intent_model.npz]
+    import argparse
+    import time
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Retrain the intent classifier from confirmed chat history')
+    parser.add_argument('--output', help='model file, defaults to INTENT_MODEL_PATH')
+    parser.add_argument('--labels', help='curated NDJSON of {"message": ..., "intent": ...} to train on as well')
+    parser.add_argument('--min-rating', type=int, default=3,
+                        help='lowest feedback rating that confirms the stored intent, ratings above it count double')
+    parser.add_argument('--epochs', type=int, default=150)
+    args = parser.parse_args()
+    if np is None:
+        parser.exit(1, 'Training the intent model needs numpy\n')
+    
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        labelled = read_labelled(args.labels) if args.labels else ()
+        messages, intents, weights = training_data(args.min_rating, labelled)
+        print(f"Loaded {len(messages)} confirmed messages with {len(set(intents))} intents")
+        if len(set(intents)) < 2:
+            parser.exit(1, 'Training needs confirmed messages with at least two intents, '
+                           'collect feedback or pass --labels\n')
+        
+        # Estimate the accuracy against the confirmed labels of every tenth
+        # message, then train on all of them
+        train = [i for i in range(len(messages)) if i % 10]
+        held_out = [i for i in range(len(messages)) if not i % 10]
+        model = IntentClassifier.train([messages[i] for i in train], [intents[i] for i in train],
+                                       [weights[i] for i in train], epochs=args.epochs)
+        predictions = model.predict([messages[i] for i in held_out])
+        correct = sum(intent == intents[i] for (intent, _), i in zip(predictions, held_out))
+        rules = RuleMatcher()
+        rules_correct = sum(rules.match(messages[i].lower()).intent == intents[i] for i in held_out)
+        print(f"Held-out accuracy against confirmed labels: {correct / len(held_out):.1%} "
+              f"(rules: {rules_correct / len(held_out):.1%}) of {len(held_out)} messages")
+        
+        model = IntentClassifier.train(messages, intents, weights, epochs=args.epochs)
+        output = args.output or app.config['INTENT_MODEL_PATH']
+        model.save(output)
+        print(f"Saved the model to {output} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,91 @@
+from sqlalchemy import case, func, literal
+from models import Product, Category, db
+
+# Lower bounds of the default price histogram buckets, the last one is open ended
+DEFAULT_PRICE_EDGES = [0, 25, 50, 100, 250, 500, 1000, 2500]
+MAX_PRICE_BUCKETS = 20
+
+
+def parse_price_edges(value):
+    """Parse ``price_buckets=0,50,100`` into sorted bucket lower bounds starting at 0"""
+    if not value:
+        return list(DEFAULT_PRICE_EDGES)
+    edges = sorted({float(edge) for edge in value.split(',') if edge.strip()})
+    if not edges or edges[0] > 0:
+        edges.insert(0, 0)
+    if len(edges) > MAX_PRICE_BUCKETS:
+        raise ValueError(f'At most {MAX_PRICE_BUCKETS} price buckets are supported')
+    return edges
+
+
+def format_facets(brand_counts, category_counts, bucket_counts, edges, category_names):
+    """Shape raw counts into the facets response body"""
+    brands = sorted(
+        ({'brand': brand, 'count': count} for brand, count in brand_counts.items() if count),
+        key=lambda item: (-item['count'], item['brand'])
+    )
+    categories = sorted(
+        (
+            {'id': category_id, 'name': category_names.get(category_id), 'count': count}
+            for category_id, count in category_counts.items() if count
+        ),
+        key=lambda item: (-item['count'], item['name'] or '')
+    )
+    price_buckets = [
+        {
+            'min': edge,
+            'max': edges[i + 1] if i + 1 < len(edges) else None,
+            'count': bucket_counts.get(i, 0)
+        }
+        for i, edge in enumerate(edges)
+    ]
+    return {
+        'brands': brands,
+        'categories': categories,
+        'price_buckets': price_buckets,
+        'total': sum(bucket_counts.values())
+    }
+
+
+def price_bucket_expression(edges):
+    """SQL expression numbering the histogram bucket a product's price falls into"""
+    whens = [(Product.price < edge, i - 1) for i, edge in enumerate(edges) if i > 0]
+    if not whens:
+        return literal(0)
+    return case(*whens, else_=len(edges) - 1)
+
+
+def sql_facets(query, edges):
+    """Brand, category and price bucket counts of a filtered product query.
+
+    One grouped query over (brand, category, bucket) combinations, the
+    individual facets are rolled up from it in Python. The number of
+    combinations is bounded by the facet cardinalities, not the catalog.
+    """
+    bucket = price_bucket_expression(edges).label('bucket')
+    grouped = query.with_entities(
+        Product.brand,
+        Product.category_id,
+        Category.name,
+        bucket,
+        func.count(Product.id)
+    ).join(Category, Category.id == Product.category_id, isouter=True).order_by(None).group_by(
+        Product.brand, Product.category_id, Category.name, bucket
+    )
+    
+    brand_counts = {}
+    category_counts = {}
+    bucket_counts = {}
+    category_names = {}
+    for brand, category_id, category_name, bucket_index, count in grouped.all():
+        if brand:
+            brand_counts[brand] = brand_counts.get(brand, 0) + count
+        category_counts[category_id] = category_counts.get(category_id, 0) + count
+        category_names[category_id] = category_name
+        bucket_counts[bucket_index] = bucket_counts.get(bucket_index, 0) + count
+    return format_facets(brand_counts, category_counts, bucket_counts, edges, category_names)
+
+
+def category_names():
+    """Map of category id to name"""
+    return dict(db.session.query(Category.id, Category.name).all())
@@ -0,0 +1,316 @@
+import re
+from collections import deque, namedtuple
+
+# Intent patterns, the first intent with a matching pattern wins
+INTENT_PATTERNS = {
+    'greeting': [
+        r'\b(hi|hello|hey|good morning|good afternoon|good evening)\b',
+        r'\bhow are you\b',
+        r'\bwhat\'s up\b'
+    ],
+    'product_search': [
+        r'\b(show|find|search|look for|need|want|looking for)\b.*\b(product|item|thing)\b',
+        r'\b(show me|find me|search for|look for)\b',
+        r'\b(laptop|phone|book|shoe|watch|camera|tablet|headphone)\b',
+        r'\bunder \$?\d+\b',
+        r'\bless than \$?\d+\b',
+        r'\bbetween \$?\d+ and \$?\d+\b'
+    ],
+    'price_filter': [
+        r'\bunder \$?(\d+)\b',
+        r'\bless than \$?(\d+)\b',
+        r'\bbetween \$?(\d+) and \$?(\d+)\b',
+        r'\bcheaper than \$?(\d+)\b',
+        r'\bbudget.*\$?(\d+)\b'
+    ],
+    'category_filter': [
+        r'\b(electronics|books|clothing|shoes|accessories|home|sports|beauty|toys)\b',
+        r'\b(smartphone|laptop|tablet|camera|headphone|speaker)\b',
+        r'\b(fiction|non-fiction|novel|textbook|cookbook)\b',
+        r'\b(shirt|pant|dress|jacket|sneaker|boot|sandal)\b'
+    ],
+    'brand_filter': [
+        r'\b(apple|samsung|google|microsoft|sony|nike|adidas|amazon)\b',
+        r'\b(brand|make|manufacturer)\b'
+    ],
+    'recommendation': [
+        r'\b(recommend|suggest|what should|best|top|popular|trending)\b',
+        r'\b(what\'s good|what do you recommend|any suggestions)\b'
+    ],
+    'help': [
+        r'\b(help|how|what can you do|what can I do|commands)\b'
+    ],
+    'goodbye': [
+        r'\b(bye|goodbye|see you|thanks|thank you|that\'s all)\b'
+    ]
+}
+
+# Price patterns, the first matching pattern sets the price entities
+PRICE_PATTERNS = [
+    (r'under \$?(\d+)', 'max_price'),
+    (r'less than \$?(\d+)', 'max_price'),
+    (r'cheaper than \$?(\d+)', 'max_price'),
+    (r'budget.*\$?(\d+)', 'max_price'),
+    (r'between \$?(\d+) and \$?(\d+)', 'price_range'),
+    (r'from \$?(\d+) to \$?(\d+)', 'price_range')
+]
+
+# Keywords that map a message to a product category, also offered as autocomplete suggestions
+CATEGORY_MAPPING = {
+    'electronics': ['laptop', 'phone', 'smartphone', 'tablet', 'camera', 'headphone', 'speaker', 'computer'],
+    'books': ['book', 'novel', 'fiction', 'non-fiction', 'textbook', 'cookbook', 'biography'],
+    'clothing': ['shirt', 'pant', 'dress', 'jacket', 'clothes', 'clothing'],
+    'shoes': ['shoe', 'sneaker', 'boot', 'sandal', 'footwear'],
+    'accessories': ['watch', 'jewelry', 'bag', 'wallet', 'accessory'],
+    'home': ['furniture', 'kitchen', 'bedroom', 'living room', 'home'],
+    'sports': ['sports', 'fitness', 'exercise', 'gym', 'outdoor'],
+    'beauty': ['beauty', 'makeup', 'skincare', 'cosmetics'],
+    'toys': ['toy', 'game', 'kids', 'children', 'baby']
+}
+
+# The first brand mentioned in the message
+BRAND_PATTERN = r'\b(apple|samsung|google|microsoft|sony|nike|adidas|amazon|hp|dell|asus|lenovo)\b'
+
+# Follow-ups that refine the previous answer of a session instead of
+# starting a new search, see ChatbotProcessor
+REFINEMENT_PATTERNS = {
+    'more': r'\b(show|see|give|any)( me)? more\b|\bmore (results|options|products|ones)\b|\bnext (page|ones)\b|^more\b',
+    'cheaper': r'\b(cheaper|less expensive|lower priced?|more affordable)\b',
+    'only': r'\b(only|just|those|these|them|ones)\b'
+}
+
+# Intent and rule based entities of one message. ``entities`` holds the
+# price, category/search_term and brand keys that matched.
+RuleMatch = namedtuple('RuleMatch', ['intent', 'entities'])
+
+# A run of characters that a pattern matches literally
+_LITERAL = re.compile(r"(?:[\w '-]|\\')+")
+
+
+def _price_entities(entity_type, groups):
+    if entity_type == 'price_range':
+        return {'min_price': float(groups[0]), 'max_price': float(groups[1])}
+    return {entity_type: float(groups[0])}
+
+
+def _result(intent, price, category, brand):
+    """Assemble a RuleMatch from the winning rule of each kind"""
+    entities = {}
+    if price is not None:
+        entities.update(_price_entities(*price))
+    if category is not None:
+        entities['category'], entities['search_term'] = category
+    if brand is not None:
+        entities['brand'] = brand.title()
+    return RuleMatch(intent or 'general', entities)
+
+
+def _has_top_level_alternation(pattern):
+    depth = 0
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+    return False
+
+
+def leading_literals(pattern):
+    """Lowercase strings one of which every match of ``pattern`` starts with.
+
+    Understands rules made of an optional ``\\b``, then a literal or a group
+    of literal alternatives, which covers the chatbot rules. Returns None
+    for anything else, meaning the rule has to be searched in full.
+    """
+    if _has_top_level_alternation(pattern):
+        return None
+    body = pattern[2:] if pattern.startswith(r'\b') else pattern
+    if body.startswith('('):
+        end = body.find(')')
+        if end < 0 or body[end + 1:end + 2] in ('?', '*', '{'):
+            return None
+        alternatives = body[1:end].split('|')
+        if not all(_LITERAL.fullmatch(alternative) for alternative in alternatives):
+            return None
+    else:
+        match = _LITERAL.match(body)
+        if not match:
+            return None
+        literal = match.group()
+        if body[match.end():match.end() + 1] in ('?', '*', '{'):
+            literal = literal[:-1]  # the last character is optional
+        if not literal:
+            return None
+        alternatives = [literal]
+    return {alternative.replace("\\'", "'").lower() for alternative in alternatives}
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton reporting every keyword occurrence in one pass"""
+    
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    self._goto[state][char] = following
+                state = following
+            self._output[state] += (keyword,)
+        
+        # Breadth first, so failure links point at already finished states
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                self._output[following] += self._output[self._fail[following]]
+    
+    def scan(self, text):
+        """``(start, keyword)`` for every occurrence, overlapping ones included"""
+        goto, fail, output = self._goto, self._fail, self._output
+        hits = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in output[state]:
+                hits.append((end - len(keyword), keyword))
+        return hits
+
+
+class _Rule:
+    __slots__ = ('kind', 'value', 'pattern')
+    
+    def __init__(self, kind, value, pattern):
+        self.kind = kind
+        self.value = value
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+
+
+class RuleMatcher:
+    """Intent and entity rules compiled into one keyword automaton.
+
+    Every rule starts with one of a few literals (``\\bunder \\$?\\d+`` with
+    "under "), so one scan of the message with an automaton over all those
+    literals finds the only positions where each rule can match. Rules are
+    then tried, anchored, at just those positions: a message with no
+    keywords costs one scan, not one ``re.search`` per rule and keyword.
+    Rules are taken in declaration order and at their leftmost position,
+    which gives the same results as the rule-by-rule loops of
+    ``reference_match``.
+    """
+    
+    def __init__(self, intent_patterns=INTENT_PATTERNS, price_patterns=PRICE_PATTERNS,
+                 category_mapping=CATEGORY_MAPPING, brand_pattern=BRAND_PATTERN):
+        self._rules = []
+        for intent, patterns in intent_patterns.items():
+            self._rules.extend(_Rule('intent', intent, pattern) for pattern in patterns)
+        self._rules.extend(_Rule('price', entity_type, pattern) for pattern, entity_type in price_patterns)
+        for category, keywords in category_mapping.items():
+            self._rules.extend(_Rule('category', (category, keyword), r'\b' + keyword + r'\b') for keyword in keywords)
+        self._rules.append(_Rule('brand', None, brand_pattern))
+        
+        self._triggers = {}  # literal -> rule indexes
+        self._unanchored = []  # rule indexes searched in full
+        for number, rule in enumerate(self._rules):
+            literals = leading_literals(rule.pattern.pattern)
+            if literals is None:
+                self._unanchored.append(number)
+                continue
+            for literal in literals:
+                self._triggers.setdefault(literal, []).append(number)
+        self._automaton = KeywordAutomaton(self._triggers)
+    
+    def _candidates(self, message):
+        """Rule index -> sorted start positions where it may match, None for anywhere"""
+        if not message.isascii():
+            # Case folding may move or hide literals, search every rule
+            return dict.fromkeys(range(len(self._rules)))
+        starts = {}
+        for start, literal in self._automaton.scan(message.lower()):
+            for number in self._triggers[literal]:
+                starts.setdefault(number, set()).add(start)
+        candidates = {number: sorted(positions) for number, positions in starts.items()}
+        candidates.update(dict.fromkeys(self._unanchored))
+        return candidates
+    
+    def _first_match(self, rule, message, positions):
+        if positions is None:
+            return rule.pattern.search(message)
+        for position in positions:
+            match = rule.pattern.match(message, position)
+            if match:
+                return match
+        return None
+    
+    def match(self, message):
+        """Intent and rule based entities of a message"""
+        winners = {}  # kind -> (rule, match)
+        candidates = self._candidates(message)
+        for number in sorted(candidates):
+            rule = self._rules[number]
+            if rule.kind in winners:
+                continue
+            match = self._first_match(rule, message, candidates[number])
+            if match:
+                winners[rule.kind] = (rule, match)
+        
+        intent = winners['intent'][0].value if 'intent' in winners else None
+        price = category = brand = None
+        if 'price' in winners:
+            rule, match = winners['price']
+            price = (rule.value, match.groups())
+        if 'category' in winners:
+            category = winners['category'][0].value
+        if 'brand' in winners:
+            brand = winners['brand'][1].group(1)
+        return _result(intent, price, category, brand)
+
+
+def reference_match(message, intent_patterns=INTENT_PATTERNS, price_patterns=PRICE_PATTERNS,
+                    category_mapping=CATEGORY_MAPPING, brand_pattern=BRAND_PATTERN):
+    """Rule-by-rule evaluation that ``RuleMatcher`` must agree with"""
+    intent = None
+    for name, patterns in intent_patterns.items():
+        if any(re.search(pattern, message, re.IGNORECASE) for pattern in patterns):
+            intent = name
+            break
+    
+    price = None
+    for pattern, entity_type in price_patterns:
+        match = re.search(pattern, message, re.IGNORECASE)
+        if match:
+            price = (entity_type, match.groups())
+            break
+    
+    category = None
+    for name, keywords in category_mapping.items():
+        for keyword in keywords:
+            if re.search(r'\b' + keyword + r'\b', message, re.IGNORECASE):
+                category = (name, keyword)
+                break
+        if category:
+            break
+    
+    brand_match = re.search(brand_pattern, message, re.IGNORECASE)
+    return _result(intent, price, category, brand_match.group(1) if brand_match else None)
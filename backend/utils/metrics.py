@@ -0,0 +1,219 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_listeners_installed = False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus style cumulative histogram with one series per label set"""
+    
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(label_values, list(values)) for label_values, values in series]
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _labels(self.label_names, label_values, [('le', _number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, label_values, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {values[-1]}')
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {_number(values[-2])}')
+            lines.append(f'{self.name}_count{labels} {values[-1]}')
+        return '\n'.join(lines)
+
+
+def render_value(name, documentation, value, kind='counter'):
+    """One unlabelled counter or gauge in the Prometheus text format"""
+    return f'# HELP {name} {documentation}\n# TYPE {name} {kind}\n{name} {_number(value)}'
+
+
+class Metrics:
+    """Request, SQL and chatbot stage timings of one app"""
+    
+    def __init__(self):
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds', 'Time spent in the request handler.',
+            ('endpoint', 'method', 'status'), SECONDS_BUCKETS
+        )
+        self.db_queries = Histogram(
+            'http_request_db_queries', 'SQL statements executed per request.',
+            ('endpoint',), QUERY_BUCKETS
+        )
+        self.db_seconds = Histogram(
+            'http_request_db_duration_seconds', 'Time spent executing SQL per request.',
+            ('endpoint',), SECONDS_BUCKETS
+        )
+        self.response_bytes = Histogram(
+            'http_response_size_bytes', 'Response body size, streamed responses excluded.',
+            ('endpoint',), BYTES_BUCKETS
+        )
+        self.chatbot_stage_seconds = Histogram(
+            'chatbot_stage_duration_seconds', 'Time spent in each chatbot processing stage.',
+            ('stage',), SECONDS_BUCKETS
+        )
+        self.collectors = []  # callables returning more metrics in the text format
+    
+    @property
+    def histograms(self):
+        return [self.request_seconds, self.db_queries, self.db_seconds,
+                self.response_bytes, self.chatbot_stage_seconds]
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        parts = [histogram.render() for histogram in self.histograms]
+        parts.extend(collector() for collector in self.collectors)
+        return '\n'.join(parts) + '\n'
+
+
+# SQL timing, attributed to the current request. The start time is kept on
+# the statement's execution context, which is discarded with the statement,
+# so one that fails leaves nothing behind on the pooled connection
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_queries += 1
+        g.metrics_db_seconds += elapsed
+
+
+def install_query_listeners():
+    """Attach the engine hooks that time SQL statements (idempotent)"""
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    _listeners_installed = True
+
+
+# Request hooks
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_db_seconds = 0.0
+    g.metrics_stages = []
+
+
+def _finish_request(response):
+    if 'metrics_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    metrics = current_app.extensions['metrics']
+    endpoint = request.endpoint or 'unmatched'
+    metrics.request_seconds.observe(elapsed, endpoint, request.method, str(response.status_code))
+    metrics.db_queries.observe(g.metrics_queries, endpoint)
+    metrics.db_seconds.observe(g.metrics_db_seconds, endpoint)
+    if not response.is_streamed:
+        metrics.response_bytes.observe(response.calculate_content_length() or 0, endpoint)
+    
+    if current_app.config.get('SERVER_TIMING'):
+        timings = [f'app;dur={elapsed * 1000:.2f}',
+                   f'db;dur={g.metrics_db_seconds * 1000:.2f};desc="{g.metrics_queries} queries"']
+        timings.extend(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in g.metrics_stages)
+        response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as a chatbot processing stage.
+
+    Stages are recorded in the stage histogram and, inside a request, listed
+    in the Server-Timing header. A no-op outside an app with metrics.
+    """
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_stage(stage, seconds):
+    """Record a chatbot stage the caller timed itself, for work spread over a generator"""
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    if metrics is None:
+        return
+    metrics.chatbot_stage_seconds.observe(seconds, stage)
+    if has_request_context() and 'metrics_stages' in g:
+        g.metrics_stages.append((stage, seconds))
+
+
+def _metrics_view():
+    body = current_app.extensions['metrics'].render()
+    return current_app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    """Register request metrics, the ``/metrics`` endpoint and the SQL hooks on the app"""
+    install_query_listeners()
+    app.extensions['metrics'] = Metrics()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+
+def get_metrics():
+    """Get the metrics of the current app"""
+    return current_app.extensions['metrics']
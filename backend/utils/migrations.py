@@ -0,0 +1,30 @@
+from sqlalchemy import inspect
+from models import db
+
+
+def missing_indexes():
+    """Indexes declared on the models that the database does not have yet"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # create_all() builds new tables with their indexes
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def upgrade():
+    """Create the secondary indexes missing from an existing database.
+
+    ``db.create_all()`` only creates tables that do not exist, so databases
+    made before an index was added to ``models.py`` need this step. Safe to
+    run repeatedly. Returns the names of the indexes created.
+    """
+    created = []
+    for index in missing_indexes():
+        index.create(db.engine, checkfirst=True)
+        created.append(index.name)
+    return created
+
@@ -0,0 +1,117 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_, DateTime
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not fit the query"""
+
+
+def encode_cursor(values, signature):
+    """Encode the last row's sort key values into an opaque cursor token"""
+    payload = {
+        's': signature,
+        'k': [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, order_keys, signature):
+    """Decode a cursor token into sort key values typed like their columns"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = payload['k']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Cursor is malformed')
+    
+    if not isinstance(values, list) or payload.get('s') != signature or len(values) != len(order_keys):
+        raise InvalidCursor('Cursor does not match the requested sort order')
+    
+    decoded = []
+    for (column, _), value in zip(order_keys, values):
+        if value is not None and isinstance(column.type, DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidCursor('Cursor is malformed')
+        decoded.append(value)
+    return decoded
+
+
+def _equal(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def _beyond(column, direction, value):
+    """Rows of ``column`` after ``value``, or None when there are none.
+
+    NULLs sort first ascending and last descending, as in SQLite, and
+    comparisons with NULL are never true, so they get explicit clauses.
+    """
+    if direction == 'desc':
+        if value is None:
+            return None
+        if column.nullable:
+            return or_(column < value, column.is_(None))
+        return column < value
+    if value is None:
+        return column.is_not(None)
+    return column > value
+
+
+def _after(order_keys, values):
+    """Row-value comparison selecting rows after ``values`` in the given order.
+
+    Expanded into ``(a > x) OR (a = x AND b > y) ...`` so mixed directions work
+    on databases without row value support.
+    """
+    clauses = []
+    for i, (column, direction) in enumerate(order_keys):
+        beyond = _beyond(column, direction, values[i])
+        if beyond is not None:
+            equal = [_equal(order_keys[j][0], values[j]) for j in range(i)]
+            clauses.append(and_(*equal, beyond))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, order_keys, per_page, cursor=None, include_total=False, signature=''):
+    """Paginate ``query`` by seeking past the last seen sort key.
+
+    ``order_keys`` is a list of ``(column, 'asc'|'desc')`` that must end with a
+    unique column such as the primary key. Unlike ``paginate()`` this costs
+    the same on every page and only counts rows when ``include_total`` is set.
+    Returns ``(items, pagination)``.
+    """
+    total = query.order_by(None).count() if include_total else None
+    
+    if cursor:
+        values = decode_cursor(cursor, order_keys, signature)
+        query = query.filter(_after(order_keys, values))
+    
+    query = query.order_by(*[
+        column.desc() if direction == 'desc' else column.asc()
+        for column, direction in order_keys
+    ])
+    items = query.limit(per_page + 1).all()
+    
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    next_cursor = None
+    if has_next:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            [getattr(last, column.key) for column, _ in order_keys],
+            signature
+        )
+    
+    pagination = {
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_next': has_next
+    }
+    if include_total:
+        pagination['total'] = total
+    return items, pagination
@@ -0,0 +1,149 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, make_response
+from utils.catalog_version import get_catalog_version
+
+
+class _CachedResponse:
+    """Serialized body of a successful response at one catalog version"""
+    
+    __slots__ = ('version', 'body', 'mimetype', 'etag')
+    
+    def __init__(self, version, body, mimetype):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    """LRU cache of endpoint responses keyed by request arguments.
+
+    Entries remember the catalog version they were rendered at and are
+    ignored once the version moves, so no explicit invalidation is needed.
+    """
+    
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+    
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResultCache:
+    """LRU cache of computed results with a time to live.
+
+    Like ``ResponseCache`` every entry remembers the catalog version it was
+    computed at and stops matching once the version moves. Entries also
+    expire ``ttl`` seconds after they were stored, which bounds how stale a
+    result can get from sources the catalog version does not track.
+    ``max_entries`` of 0 turns the cache off.
+    """
+    
+    def __init__(self, max_entries=1024, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (version, expires, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, version):
+        """The value stored for ``key`` at ``version``, None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, key, version, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (version, self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Hit, miss and eviction counts and the current number of entries"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
+
+
+def _conditional(body, mimetype, etag):
+    """Build a response with a strong ETag, or a 304 if the client has it"""
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def catalog_cached(view):
+    """Serve a catalog metadata endpoint from memory until the catalog changes.
+
+    Answers ``If-None-Match`` with 304 and repeat requests from the cached
+    body, neither of which touches the database. Only 200 responses are
+    cached.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions['response_cache']
+        key = (request.endpoint, tuple(sorted(request.args.items(multi=True))))
+        version = get_catalog_version()
+        
+        entry = cache.get(key, version)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = _CachedResponse(version, response.get_data(), response.mimetype)
+            cache.put(key, entry)
+        
+        return _conditional(entry.body, entry.mimetype, entry.etag)
+    
+    return wrapper
+
+
+def init_response_cache(app):
+    """Register the catalog response cache on the app"""
+    app.extensions['response_cache'] = ResponseCache(app.config.get('RESPONSE_CACHE_SIZE', 512))
@@ -0,0 +1,451 @@
+import heapq
+import json
+import math
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from flask import current_app
+from models import Product, db
+from utils.catalog_version import get_catalog_version, changes_since
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Per field term frequency weights, a document's tf is the weighted sum
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'brand': 2.0,
+    'description': 1.0,
+    'attributes': 1.0
+}
+
+# Query terms also match indexed terms that contain them ("phone" finds
+# "smartphone"), scored lower than an exact term match
+EXPANSION_WEIGHT = 0.5
+EXPANSION_CACHE_SIZE = 4096
+
+# Typo correction: terms from names and brands are indexed by character
+# trigram, the best overlapping ones are reranked by edit distance
+FUZZY_FIELDS = ('name', 'brand')
+FUZZY_CANDIDATES = 50
+
+
+def normalize_term(token):
+    """Fold simple plurals so "laptops" and "laptop" share a posting list"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Split text into normalized index terms"""
+    if not text:
+        return []
+    return [normalize_term(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+def trigrams(term):
+    """Character trigrams of a term, padded so the start and end count too"""
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def infixes(term):
+    """Unpadded character trigrams of a term, every term containing it has them all"""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def max_edits(term):
+    """Typos tolerated in a term of this length, short terms are never corrected"""
+    if len(term) <= 4:
+        return 0
+    return 1 if len(term) <= 7 else 2
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, giving up once it exceeds ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def attribute_text(attributes):
+    """Flatten a product's JSON attributes into searchable text.
+
+    Values are indexed as written, flags that are true contribute their key
+    ("noise_canceling": true makes the product match "noise canceling").
+    """
+    if not attributes:
+        return ''
+    if isinstance(attributes, str):
+        try:
+            attributes = json.loads(attributes)
+        except ValueError:
+            return ''
+    parts = []
+    for key, value in attributes.items():
+        if value is True:
+            parts.append(key.replace('_', ' '))
+        elif value not in (None, False):
+            parts.append(str(value))
+    return ' '.join(parts)
+
+
+class _Document:
+    """Indexed fields of one product needed for scoring and filtering"""
+    
+    __slots__ = ('terms', 'fuzzy_terms', 'length', 'category_id', 'price', 'brand', 'rating')
+    
+    def __init__(self, terms, fuzzy_terms, length, row):
+        self.terms = terms
+        self.fuzzy_terms = fuzzy_terms
+        self.length = length
+        self.category_id = row.category_id
+        self.price = row.price
+        self.brand = (row.brand or '').lower()
+        self.rating = row.rating or 0.0
+
+
+class SearchIndex:
+    """Tokenized inverted index over the available products with BM25 ranking.
+
+    Covers ``Product.name``, ``description``, ``brand`` and the JSON
+    ``attributes``. Query cost depends on the posting lists of the query
+    terms, not on catalog size. After a catalog change the products that
+    changed are re-indexed on the next search instead of rebuilding.
+
+    Name and brand terms are also indexed by character trigram so that
+    misspelled query terms can be corrected to the closest indexed term.
+    Every indexed term is indexed by its inner trigrams as well, so the
+    terms containing a query term are found from the shortest of its
+    trigram lists instead of scanning the vocabulary.
+    """
+    
+    k1 = 1.2
+    b = 0.75
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._postings = defaultdict(dict)  # term -> {product_id: weighted tf}
+        self._documents = {}  # product_id -> _Document
+        self._total_length = 0.0
+        self._expansions = OrderedDict()  # query term -> [(indexed term, weight)], LRU
+        self._infixes = defaultdict(set)  # inner trigram -> indexed terms
+        self._fuzzy_counts = defaultdict(int)  # name/brand term -> product count
+        self._trigrams = defaultdict(set)  # trigram -> name/brand terms
+    
+    def __len__(self):
+        return len(self._documents)
+    
+    # Maintenance
+    
+    def refresh(self):
+        """Bring the index up to date with the catalog version"""
+        if self._version == get_catalog_version():
+            return
+        with self._lock:
+            if self._version is None:
+                self._rebuild()
+                return
+            version, product_ids, _ = changes_since(self._version)
+            if product_ids is None:
+                self._rebuild()
+            elif product_ids:
+                self._reindex(product_ids, version)
+            else:
+                self._version = version
+    
+    def _rebuild(self):
+        version = get_catalog_version()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._total_length = 0.0
+        self._expansions = OrderedDict()
+        self._infixes = defaultdict(set)
+        self._fuzzy_counts = defaultdict(int)
+        self._trigrams = defaultdict(set)
+        for row in self._rows(Product.is_available == True):
+            self._add(row)
+        self._version = version
+    
+    def _reindex(self, product_ids, version):
+        for product_id in product_ids:
+            self._remove(product_id)
+        ids = list(product_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for row in self._rows(Product.id.in_(chunk), Product.is_available == True):
+                self._add(row)
+        self._expansions.clear()
+        self._version = version
+    
+    def _rows(self, *criteria):
+        return db.session.query(
+            Product.id,
+            Product.name,
+            Product.description,
+            Product.brand,
+            Product.attributes,
+            Product.category_id,
+            Product.price,
+            Product.rating
+        ).filter(*criteria).yield_per(2000)
+    
+    def _add(self, row):
+        term_weights = defaultdict(float)
+        fuzzy_terms = set()
+        length = 0.0
+        fields = {
+            'name': row.name,
+            'brand': row.brand,
+            'description': row.description,
+            'attributes': attribute_text(row.attributes)
+        }
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for term in tokenize(text):
+                term_weights[term] += weight
+                length += weight
+            if field in FUZZY_FIELDS and text:
+                # Corrections are offered as written, not in normalized form
+                fuzzy_terms.update(TOKEN_PATTERN.findall(text.lower()))
+        
+        for term, tf in term_weights.items():
+            postings = self._postings[term]
+            if not postings:
+                for trigram in infixes(term):
+                    self._infixes[trigram].add(term)
+            postings[row.id] = tf
+        for term in fuzzy_terms:
+            if not self._fuzzy_counts[term]:
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].add(term)
+            self._fuzzy_counts[term] += 1
+        self._documents[row.id] = _Document(tuple(term_weights), tuple(fuzzy_terms), length, row)
+        self._total_length += length
+    
+    def _remove(self, product_id):
+        document = self._documents.pop(product_id, None)
+        if document is None:
+            return
+        for term in document.terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+                    for trigram in infixes(term):
+                        self._infixes[trigram].discard(term)
+                        if not self._infixes[trigram]:
+                            del self._infixes[trigram]
+        for term in document.fuzzy_terms:
+            self._fuzzy_counts[term] -= 1
+            if not self._fuzzy_counts[term]:
+                del self._fuzzy_counts[term]
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].discard(term)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+        self._total_length -= document.length
+    
+    # Querying
+    
+    def _expand(self, term):
+        """Indexed terms matching a query term, with their weights"""
+        expansion = self._expansions.get(term)
+        if expansion is not None:
+            self._expansions.move_to_end(term)
+            return expansion
+        
+        expansion = []
+        if term in self._postings:
+            expansion.append((term, 1.0))
+        if len(term) >= 3:
+            # Only terms on every trigram list of ``term`` can contain it
+            candidates = min((self._infixes.get(trigram, ()) for trigram in infixes(term)), key=len)
+            expansion.extend(
+                (indexed, EXPANSION_WEIGHT) for indexed in sorted(candidates)
+                if term in indexed and indexed != term
+            )
+        self._expansions[term] = expansion
+        if len(self._expansions) > EXPANSION_CACHE_SIZE:
+            self._expansions.popitem(last=False)
+        return expansion
+    
+    def suggest(self, term):
+        """Closest name or brand term to a misspelled ``term``, or None.
+
+        Candidates come from the trigram posting lists of the term, the few
+        with the most shared trigrams are reranked by edit distance, then by
+        how many products use them.
+        """
+        limit = max_edits(term)
+        if not limit:
+            return None
+        shared = defaultdict(int)
+        for trigram in trigrams(term):
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        best = None
+        for candidate in heapq.nlargest(FUZZY_CANDIDATES, shared, key=shared.get):
+            distance = edit_distance(term, candidate, limit)
+            if distance > limit:
+                continue
+            key = (distance, -shared[candidate], -self._fuzzy_counts[candidate], candidate)
+            if best is None or key < best:
+                best = key
+        return best[3] if best else None
+    
+    def correct(self, query):
+        """Replace query terms that match nothing with their closest indexed term.
+
+        Returns the corrected query as a string, or None when no term changed.
+        """
+        self.refresh()
+        text = ' '.join(query) if isinstance(query, (list, tuple)) else query
+        corrected = []
+        changed = False
+        with self._lock:
+            for term in TOKEN_PATTERN.findall(text.lower()):
+                suggestion = None
+                if not self._expand(normalize_term(term)):
+                    suggestion = self.suggest(term)
+                corrected.append(suggestion or term)
+                changed = changed or suggestion is not None
+        return ' '.join(corrected) if changed else None
+    
+    def _term_scores(self, term, expand, avg_length):
+        """BM25 contribution of one query term for every document containing it"""
+        count = len(self._documents)
+        scores = {}
+        if expand:
+            expansion = self._expand(term)
+        else:
+            expansion = [(term, 1.0)] if term in self._postings else []
+        for indexed, weight in expansion:
+            postings = self._postings[indexed]
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for product_id, tf in postings.items():
+                length = self._documents[product_id].length
+                norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                score = weight * idf * norm
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+        return scores
+    
+    def search(self, query, match='all', limit=20, category_id=None, min_price=None,
+               max_price=None, brand=None, expand=True, product_ids=None):
+        """Rank products for ``query``.
+
+        ``match`` is ``all`` (every term must match) or ``any``. ``query`` may be
+        a string or a list of terms. ``product_ids`` restricts the results to a
+        set of ids. Returns ``[(product_id, score)]`` best first.
+        """
+        self.refresh()
+        terms = tokenize(' '.join(query) if isinstance(query, (list, tuple)) else query)
+        terms = list(dict.fromkeys(terms))
+        if not terms:
+            return []
+        
+        with self._lock:
+            if not self._documents:
+                return []
+            avg_length = self._total_length / len(self._documents) or 1.0
+            per_term = [self._term_scores(term, expand, avg_length) for term in terms]
+            
+            if match == 'any':
+                totals = defaultdict(float)
+                for scores in per_term:
+                    for product_id, score in scores.items():
+                        totals[product_id] += score
+            else:
+                per_term.sort(key=len)
+                if not per_term[0]:
+                    return []
+                totals = dict(per_term[0])
+                for scores in per_term[1:]:
+                    totals = {
+                        product_id: score + scores[product_id]
+                        for product_id, score in totals.items()
+                        if product_id in scores
+                    }
+                    if not totals:
+                        return []
+            
+            brand = brand.lower() if brand else None
+            candidates = []
+            for product_id, score in totals.items():
+                document = self._documents[product_id]
+                if category_id and document.category_id != category_id:
+                    continue
+                if min_price is not None and document.price < min_price:
+                    continue
+                if max_price is not None and document.price > max_price:
+                    continue
+                if brand and brand not in document.brand:
+                    continue
+                if product_ids is not None and product_id not in product_ids:
+                    continue
+                candidates.append((score, document.rating, product_id))
+        
+        best = heapq.nlargest(limit, candidates)
+        return [(product_id, score) for score, _, product_id in best]
+    
+    def select_terms(self, words, limit, max_share=0.5):
+        """The at most ``limit`` most selective of ``words``, in their original order.
+
+        Terms found in more than ``max_share`` of the products say little
+        about what is wanted and are dropped. The rest are ranked rarest
+        first (highest IDF), words that are no indexed term, which may
+        still match by expansion, after them. Looking up a word's document
+        frequency is one dict lookup, so this bounds the cost of a search
+        for text of any length.
+        """
+        self.refresh()
+        with self._lock:
+            threshold = max_share * len(self._documents)
+            ranked = []
+            seen = set()
+            for position, token in enumerate(TOKEN_PATTERN.findall(' '.join(words).lower())):
+                term = normalize_term(token)
+                if term in seen:
+                    continue
+                seen.add(term)
+                frequency = len(self._postings.get(term, ()))
+                if frequency > threshold:
+                    continue
+                ranked.append((frequency == 0, frequency, position, token))
+        best = heapq.nsmallest(limit, ranked)
+        return [token for _, _, _, token in sorted(best, key=lambda entry: entry[2])]
+    
+    def lookup(self, product_ids):
+        """``{product_id: (price, brand, rating)}`` of the indexed, so available, products among ``product_ids``"""
+        self.refresh()
+        with self._lock:
+            documents = self._documents
+            return {
+                product_id: (documents[product_id].price, documents[product_id].brand, documents[product_id].rating)
+                for product_id in product_ids if product_id in documents
+            }
+
+
+def init_search_index(app):
+    """Register the product search index on the app"""
+    app.extensions['search_index'] = SearchIndex()
+
+
+def get_search_index():
+    """Get the search index for the current app"""
+    return current_app.extensions['search_index']
@@ -0,0 +1,54 @@
+from sqlalchemy import inspect, func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Product, Category, db
+
+
+def load_products_in_order(ids):
+    """Fetch products by id with a single IN query, keeping the order of ``ids``"""
+    if not ids:
+        return []
+    products = Product.query.options(joinedload(Product.category)).filter(Product.id.in_(ids)).all()
+    by_id = {product.id: product for product in products}
+    return [by_id[product_id] for product_id in ids if product_id in by_id]
+
+
+def preload_categories(products):
+    """Attach the categories of ``products`` that are not loaded yet using one query.
+
+    ``Product.to_dict()`` reads ``product.category``, which otherwise lazy
+    loads once per product.
+    """
+    unloaded = [
+        product for product in products
+        if 'category' in inspect(product).unloaded and product.category_id is not None
+    ]
+    if not unloaded:
+        return
+    category_ids = {product.category_id for product in unloaded}
+    categories = {
+        category.id: category
+        for category in Category.query.filter(Category.id.in_(category_ids)).all()
+    }
+    for product in unloaded:
+        set_committed_value(product, 'category', categories.get(product.category_id))
+
+
+def serialize_products(products):
+    """Serialize a product listing with a constant number of queries"""
+    preload_categories(products)
+    return [product.to_dict() for product in products]
+
+
+def category_product_counts(category_ids=None):
+    """Number of products per category from one grouped COUNT query"""
+    query = db.session.query(Product.category_id, func.count(Product.id)).group_by(Product.category_id)
+    if category_ids is not None:
+        query = query.filter(Product.category_id.in_(category_ids))
+    return dict(query.all())
+
+
+def serialize_categories(categories):
+    """Serialize categories with product counts, without loading their products"""
+    counts = category_product_counts([category.id for category in categories])
+    return [category.to_dict(product_count=counts.get(category.id, 0)) for category in categories]
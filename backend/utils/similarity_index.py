@@ -0,0 +1,294 @@
+import math
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from models import db, Product, ProductSimilarity
+from utils.search_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # numpy is required to build the index, not to serve it
+    np = None
+
+TOP_K = 20
+VECTOR_DIM = 512
+# Rows are scored in chunks sized so the matrices of one chunk stay within
+# the budget whatever the category size: per score a float32 similarity, a
+# float32 price term and argpartition's int64 index
+SCORE_MEMORY_BUDGET = 64 * 2 ** 20  # bytes
+BYTES_PER_SCORE = 16
+
+# Feature weights inside the hashed vector; the price proximity term is
+# blended with the cosine similarity of the vectors
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+ATTRIBUTE_WEIGHT = 1.0
+BRAND_WEIGHT = 1.5
+PRICE_WEIGHT = 0.2
+
+
+def _feature_slot(feature):
+    """Stable hashed dimension and sign of a feature, the same in every process"""
+    digest = zlib.crc32(feature.encode('utf-8'))
+    return digest % VECTOR_DIM, 1.0 if digest & 0x80000000 else -1.0
+
+
+def _product_features(product, idf):
+    """Weighted features of one product: text tokens, attributes and brand"""
+    features = Counter()
+    for token in tokenize(product.name):
+        features[f't:{token}'] += NAME_WEIGHT * idf.get(token, 1.0)
+    for token in tokenize(product.description):
+        features[f't:{token}'] += DESCRIPTION_WEIGHT * idf.get(token, 1.0)
+    for key, value in product.get_attributes().items():
+        features[f'a:{key}={str(value).lower()}'] += ATTRIBUTE_WEIGHT
+    if product.brand:
+        features[f'b:{product.brand.lower()}'] += BRAND_WEIGHT
+    return features
+
+
+def _inverse_document_frequencies(products):
+    """Token IDF over the names and descriptions of ``products`` (objects or rows)"""
+    document_frequency = Counter()
+    count = 0
+    for product in products:
+        document_frequency.update(set(tokenize(product.name)) | set(tokenize(product.description)))
+        count += 1
+    count = count or 1
+    return {token: math.log(1 + count / df) for token, df in document_frequency.items()}
+
+
+class _Block:
+    """Normalized feature vectors and log prices of the products in one category"""
+    
+    def __init__(self, products, idf):
+        self.ids = np.array([product.id for product in products], dtype=np.int64)
+        self.vectors = np.zeros((len(products), VECTOR_DIM), dtype=np.float32)
+        for row, product in enumerate(products):
+            for feature, weight in _product_features(product, idf).items():
+                slot, sign = _feature_slot(feature)
+                self.vectors[row, slot] += sign * weight
+        norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        self.vectors /= np.maximum(norms, 1e-9)
+        self.log_price = np.log1p(np.array([max(product.price, 0.0) for product in products], dtype=np.float32))
+        self.position = {product_id: row for row, product_id in enumerate(self.ids.tolist())}
+    
+    def chunks(self, rows):
+        """``rows`` as int64 arrays small enough to score within ``SCORE_MEMORY_BUDGET``"""
+        size = max(1, SCORE_MEMORY_BUDGET // (BYTES_PER_SCORE * max(len(self.ids), 1)))
+        for start in range(0, len(rows), size):
+            yield np.asarray(rows[start:start + size], dtype=np.int64)
+    
+    def scores(self, rows):
+        """Similarity of the products at ``rows`` to every product in the block"""
+        # Computed in place, the price term is the only other matrix
+        scores = self.vectors[rows] @ self.vectors.T
+        scores *= 1 - PRICE_WEIGHT
+        price = np.subtract.outer(self.log_price[rows], self.log_price)
+        np.abs(price, out=price)
+        np.negative(price, out=price)
+        np.exp(price, out=price)
+        price *= PRICE_WEIGHT
+        scores += price
+        scores[np.arange(len(rows)), rows] = -np.inf  # never recommend the product itself
+        return scores
+    
+    def top_k(self, rows, k):
+        """Best ``k`` neighbours for each of ``rows`` as ``[(product_id, [(neighbor_id, score)])]``"""
+        results = []
+        n = len(self.ids)
+        kk = min(k, n - 1)
+        for chunk in self.chunks(rows):
+            if kk <= 0:
+                results.extend((int(self.ids[row]), []) for row in chunk)
+                continue
+            scores = self.scores(chunk)
+            best = np.argpartition(scores, n - kk, axis=1)[:, n - kk:]
+            for i, row in enumerate(chunk):
+                order = best[i][np.argsort(-scores[i, best[i]], kind='stable')]
+                results.append((
+                    int(self.ids[row]),
+                    [(int(self.ids[col]), float(scores[i, col])) for col in order]
+                ))
+        return results
+
+
+def _available_products(category_ids=None):
+    query = Product.query.filter(Product.is_available == True)
+    if category_ids is not None:
+        query = query.filter(Product.category_id.in_(category_ids))
+    return query.all()
+
+
+def _blocks(products, idf):
+    by_category = defaultdict(list)
+    for product in products:
+        by_category[product.category_id].append(product)
+    return {category_id: _Block(members, idf) for category_id, members in by_category.items()}
+
+
+def _write(neighbours, built_at, replace=True):
+    """Store neighbour lists, replacing what the given products had before"""
+    product_ids = [product_id for product_id, _ in neighbours]
+    for start in range(0, len(product_ids) if replace else 0, 500):
+        ProductSimilarity.query.filter(
+            ProductSimilarity.product_id.in_(product_ids[start:start + 500])
+        ).delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(ProductSimilarity, [
+        {
+            'product_id': product_id,
+            'rank': rank,
+            'neighbor_id': neighbor_id,
+            'score': score,
+            'built_at': built_at
+        }
+        for product_id, neighbor_list in neighbours
+        for rank, (neighbor_id, score) in enumerate(neighbor_list)
+    ])
+
+
+def build_similarity_index(top_k=TOP_K):
+    """Rebuild the neighbour lists of every available product.
+
+    Candidates come from the product's own category. Similarity is the
+    cosine of hashed TF-IDF text, attribute and brand features, blended
+    with log-price proximity. Cost is quadratic per category, which is why
+    this runs offline.
+    """
+    if np is None:
+        raise RuntimeError('Building the similarity index requires numpy')
+    built_at = datetime.utcnow()
+    products = _available_products()
+    idf = _inverse_document_frequencies(products)
+    
+    ProductSimilarity.query.delete(synchronize_session=False)
+    count = 0
+    for block in _blocks(products, idf).values():
+        neighbours = block.top_k(list(range(len(block.ids))), top_k)
+        _write(neighbours, built_at, replace=False)
+        count += len(neighbours)
+    db.session.commit()
+    return count
+
+
+def update_similarity_index(since=None, top_k=TOP_K):
+    """Refresh neighbour lists after products changed since the last build.
+
+    A product needs a full recompute when it changed itself or when a changed
+    product was on its list, since its replacement is unknown. Every other
+    list only has to merge in the changed products' new scores, because its
+    unchanged candidates kept their scores. That holds up to the IDF drift
+    the changed products cause themselves, which a periodic full build
+    resets.
+    """
+    if np is None:
+        raise RuntimeError('Building the similarity index requires numpy')
+    if since is None:
+        since = db.session.query(func.max(ProductSimilarity.built_at)).scalar()
+        if since is None:
+            return build_similarity_index(top_k)
+    built_at = datetime.utcnow()
+    
+    changed = {
+        product_id for (product_id,) in
+        db.session.query(Product.id).filter(Product.updated_at > since).all()
+    }
+    if not changed:
+        return 0
+    
+    # Lists that referenced a changed product, and the categories involved
+    referencing = set()
+    changed_product_ids = list(changed)
+    for start in range(0, len(changed_product_ids), 500):
+        referencing.update(
+            product_id for (product_id,) in db.session.query(ProductSimilarity.product_id).filter(
+                ProductSimilarity.neighbor_id.in_(changed_product_ids[start:start + 500])
+            ).distinct().all()
+        )
+    recompute = changed | referencing
+    recompute_ids = list(recompute)
+    category_ids = set()
+    for start in range(0, len(recompute_ids), 500):
+        category_ids.update(
+            category_id for (category_id,) in db.session.query(Product.category_id).filter(
+                Product.id.in_(recompute_ids[start:start + 500])
+            ).distinct().all()
+        )
+    
+    idf = _inverse_document_frequencies(
+        db.session.query(Product.name, Product.description).filter(Product.is_available == True).yield_per(5000)
+    )
+    products = _available_products(category_ids)
+    blocks = _blocks(products, idf)
+    
+    stored = defaultdict(list)
+    product_ids = [product.id for product in products]
+    for start in range(0, len(product_ids), 500):
+        for row in ProductSimilarity.query.filter(
+            ProductSimilarity.product_id.in_(product_ids[start:start + 500])
+        ).order_by(ProductSimilarity.product_id, ProductSimilarity.rank).all():
+            stored[row.product_id].append((row.neighbor_id, row.score))
+    
+    neighbours = []
+    for block in blocks.values():
+        full_rows = [row for product_id, row in block.position.items() if product_id in recompute]
+        neighbours.extend(block.top_k(full_rows, top_k))
+        
+        changed_rows = [row for product_id, row in block.position.items() if product_id in changed]
+        if not changed_rows:
+            continue
+        # The changed products' old scores are dropped first, so trimming
+        # to top_k after each chunk of new scores keeps the exact result
+        changed_ids = set(block.ids[changed_rows].tolist())
+        kept = {product_id: row for product_id, row in block.position.items() if product_id not in recompute}
+        candidates = {
+            product_id: [item for item in stored.get(product_id, []) if item[0] not in changed_ids]
+            for product_id in kept
+        }
+        # Scores are symmetric, so a chunk's rows give every product's score to its changed products
+        for chunk in block.chunks(changed_rows):
+            chunk_scores = block.scores(chunk)
+            chunk_ids = block.ids[chunk].tolist()
+            for product_id, row in kept.items():
+                merged = candidates[product_id] + list(zip(chunk_ids, chunk_scores[:, row].tolist()))
+                candidates[product_id] = sorted(merged, key=lambda item: -item[1])[:top_k]
+        neighbours.extend(candidates.items())
+    
+    # Changed products that are no longer available keep no list
+    indexed = {product.id for product in products}
+    neighbours.extend((product_id, []) for product_id in changed if product_id not in indexed)
+    _write(neighbours, built_at)
+    db.session.commit()
+    return len(neighbours)
+
+
+def get_similar_products(product_id, limit):
+    """Available neighbours of a product from the precomputed table, best first"""
+    return Product.query.options(joinedload(Product.category)).join(
+        ProductSimilarity, ProductSimilarity.neighbor_id == Product.id
+    ).filter(
+        ProductSimilarity.product_id == product_id,
+        Product.is_available == True
+    ).order_by(ProductSimilarity.rank).limit(limit).all()
+
+
+if __name__ == '__main__':
+    # Offline build: python -m utils.similarity_index [--incremental]
+    import argparse
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Build the product similarity index')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only refresh products whose updated_at changed since the last build')
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    args = parser.parse_args()
+    
+    app = create_app()
+    with app.app_context():
+        if args.incremental:
+            count = update_similarity_index(top_k=args.top_k)
+        else:
+            count = build_similarity_index(top_k=args.top_k)
+        print(f"Similarity index updated for {count} products")